@@ -0,0 +1,103 @@
+"""
+Hot-SKU contention benchmark: reservations per second on a single variant.
+
+Fires --requests single-unit reservations at one variant with --concurrency
+callers in flight, first through the per-request conditional update path and
+then through the drop-mode allocator (leased token pools + group commit). After
+each run it checks that nothing was oversold: successful holds never exceed
+stock, and inventory.reserved equals units in holds plus units still pooled.
+Needs a reachable MongoDB; the scratch database is dropped afterwards.
+
+Usage: MONGO_URL=mongodb://localhost:27017 python benchmarks/drop_mode_contention.py [--stock 5000] [--requests 6000] [--concurrency 500]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+from fastapi import HTTPException
+
+import server
+
+BENCH_DB = "benchmark_drop_mode"
+HOT_SKU = {"product_id": 1, "product_name": "Performance T-Shirt", "color": "Black", "size": "M"}
+
+
+async def reset(stock: int):
+    await server.db.inventory.delete_many({})
+    await server.db.inventory_holds.delete_many({})
+    await server.db.drop_leases.delete_many({})
+    await server.db.inventory.insert_one({**HOT_SKU, "quantity": stock, "reserved": 0, "low_stock_threshold": 5})
+    server.drop_pools.clear()
+    await server.load_inventory_snapshot()
+
+
+async def run(drop_mode: bool, stock: int, requests: int, concurrency: int):
+    await reset(stock)
+    server.DROP_MODE_ENABLED = drop_mode
+    flusher = asyncio.create_task(server.drop_mode_flusher()) if drop_mode else None
+    slots = asyncio.Semaphore(concurrency)
+    outcomes = {"ok": 0, "rejected": 0}
+
+    async def reserve():
+        async with slots:
+            try:
+                await server.acquire_inventory_hold([{**HOT_SKU, "quantity": 1}])
+                outcomes["ok"] += 1
+            except HTTPException:
+                outcomes["rejected"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[reserve() for _ in range(requests)])
+    elapsed = time.perf_counter() - started
+
+    if flusher:
+        flusher.cancel()
+        await asyncio.gather(flusher, return_exceptions=True)
+
+    doc = await server.db.inventory.find_one({"product_id": 1, "color": "Black", "size": "M"})
+    held = await server.db.inventory_holds.count_documents({"state": "active"})
+    pooled = sum(pool["available"] for pool in server.drop_pools.values())
+    consistent = doc['reserved'] == held + pooled and held <= stock and held == outcomes["ok"]
+    return {
+        "mode": "drop" if drop_mode else "per-request",
+        "ok": outcomes["ok"],
+        "rejected": outcomes["rejected"],
+        "per_second": outcomes["ok"] / elapsed,
+        "seconds": elapsed,
+        "consistent": consistent,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stock", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=6000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    args = parser.parse_args()
+
+    server.db = server.client[BENCH_DB]
+    for name in ("inventory", "inventory_holds", "drop_leases"):
+        await server.db[name].create_indexes(server.INDEX_REGISTRY[name])
+
+    print(f"{args.requests} reservations on one SKU with {args.stock} units, {args.concurrency} in flight, "
+          f"lease block {server.DROP_MODE_LEASE_UNITS}")
+    print(f"{'mode':<12} {'ok':>6} {'rejected':>9} {'res/s':>10} {'seconds':>9} {'no oversell':>12}")
+    try:
+        for drop_mode in (False, True):
+            result = await run(drop_mode, args.stock, args.requests, args.concurrency)
+            print(f"{result['mode']:<12} {result['ok']:>6} {result['rejected']:>9} {result['per_second']:>10.0f} "
+                  f"{result['seconds']:>9.2f} {str(result['consistent']):>12}")
+    finally:
+        await server.client.drop_database(BENCH_DB)
+        server.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
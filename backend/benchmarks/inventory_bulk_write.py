@@ -0,0 +1,96 @@
+"""
+Restock benchmark: one update_one per SKU versus a single bulk_write.
+
+Seeds N variants into a scratch database, then times setting every quantity
+through the old per-item loop and through bulk_update_variants (the batching
+layer used by /inventory/bulk-update, /inventory/import and hold commits).
+Needs a reachable MongoDB; the scratch database is dropped afterwards.
+
+Usage: MONGO_URL=mongodb://localhost:27017 python benchmarks/inventory_bulk_write.py [--sizes 10,100,1000,5000] [--repeat 3]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+import server
+
+BENCH_DB = "benchmark_inventory_bulk_write"
+COLORS = ["Black", "White", "Grey", "Navy", "Olive"]
+SIZES = ["XS", "S", "M", "L", "XL"]
+
+
+def variant_keys(count: int):
+    per_product = len(COLORS) * len(SIZES)
+    return [
+        (index // per_product, COLORS[(index // len(SIZES)) % len(COLORS)], SIZES[index % len(SIZES)])
+        for index in range(count)
+    ]
+
+
+async def seed(keys):
+    await server.db.inventory.delete_many({})
+    await server.db.inventory.insert_many([
+        {"product_id": p, "color": c, "size": s, "quantity": 0, "reserved": 0, "low_stock_threshold": 5}
+        for p, c, s in keys
+    ])
+
+
+async def per_item(keys, quantity: int):
+    now = datetime.now(timezone.utc).isoformat()
+    for key in keys:
+        await server.db.inventory.update_one(
+            server.variant_filter(key),
+            {"$set": {"quantity": quantity, "updated_at": now}}
+        )
+
+
+async def batched(keys, quantity: int):
+    now = datetime.now(timezone.utc).isoformat()
+    await server.bulk_update_variants(
+        [(key, {"$set": {"quantity": quantity, "updated_at": now}}) for key in keys],
+        ordered=False
+    )
+
+
+async def time_path(path, keys, repeat: int):
+    samples = []
+    for attempt in range(repeat):
+        start = time.perf_counter()
+        await path(keys, attempt + 1)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,100,1000,5000")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    server.db = server.client[BENCH_DB]
+    await server.db.inventory.create_indexes(server.INDEX_REGISTRY["inventory"])
+
+    print(f"{'skus':>6} {'per-item ms':>12} {'bulk ms':>10} {'speedup':>9}")
+    try:
+        for size in (int(value) for value in args.sizes.split(",")):
+            keys = variant_keys(size)
+            await seed(keys)
+            loop_ms = await time_path(per_item, keys, args.repeat)
+            bulk_ms = await time_path(batched, keys, args.repeat)
+            print(f"{size:>6} {loop_ms:>12.1f} {bulk_ms:>10.1f} {loop_ms / bulk_ms:>8.1f}x")
+    finally:
+        await server.client.drop_database(BENCH_DB)
+        server.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+"""
+Live counters benchmark: backend CPU for SSE fan-out vs per-client polling.
+
+For each client count, measures process CPU seconds spent over --duration
+seconds of wall time in two modes:
+  poll  - every client polls /api/visitors/count every 10s and
+          /api/waitlist/stats every 30s (what the frontend did), through the
+          ASGI app
+  sse   - every client is subscribed to the live events hub; the hub ticks
+          every --tick seconds with a change each tick and fans out one
+          pre-encoded frame per subscriber
+Subscribers are drained in-process (no sockets), so this isolates the work
+the server does per client. Needs a reachable MongoDB for the waitlist
+counter; the scratch database is dropped afterwards.
+
+Usage: MONGO_URL=mongodb://localhost:27017 python benchmarks/live_events_fanout.py [--clients 100,1000,10000] [--duration 10] [--tick 1]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+import httpx
+
+import server
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+BENCH_DB = "benchmark_live_events"
+
+
+async def measure(work, duration: float):
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    await work()
+    wall = time.perf_counter() - wall_started
+    return (time.process_time() - cpu_started) / wall * duration
+
+
+async def run_polling(clients: int, duration: float):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def work():
+            # Requests land spread evenly over the window, as they would from real browsers
+            count_calls = int(clients * duration / 10)
+            stats_calls = int(clients * duration / 30)
+            calls = [("/api/visitors/count", i * 10 / clients) for i in range(count_calls)]
+            calls += [("/api/waitlist/stats", i * 30 / clients) for i in range(stats_calls)]
+            calls.sort(key=lambda call: call[1])
+            started = time.perf_counter()
+            pending = []
+            for path, at in calls:
+                delay = at - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                pending.append(asyncio.create_task(client.get(path)))
+            await asyncio.gather(*pending)
+            remaining = duration - (time.perf_counter() - started)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+
+        return await measure(work, duration)
+
+
+async def run_sse(clients: int, duration: float, tick: float):
+    server.LIVE_EVENTS_TICK_SECONDS = tick
+    frames = {"count": 0, "bytes": 0}
+
+    async def subscriber():
+        async for frame in server.iter_live_events(asyncio.Queue(maxsize=1)):
+            frames["count"] += 1
+            frames["bytes"] += len(frame)
+
+    subscribers = [asyncio.create_task(subscriber()) for _ in range(clients)]
+    await asyncio.sleep(0.5)  # Let everyone receive the initial snapshot
+
+    async def work():
+        started = time.perf_counter()
+        while time.perf_counter() - started < duration:
+            # One visitor arrives per tick so every tick publishes
+            await server.visitor_tracker.heartbeat(f"bench-{time.perf_counter()}")
+            await server.publish_live_tick()
+            await asyncio.sleep(tick)
+
+    cpu = await measure(work, duration)
+    for task in subscribers:
+        task.cancel()
+    await asyncio.gather(*subscribers, return_exceptions=True)
+    return cpu, frames
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", default="100,1000,10000")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--tick", type=float, default=1.0)
+    args = parser.parse_args()
+
+    server.db = server.client[BENCH_DB]
+    await server.seed_inventory()
+    await server.load_inventory_snapshot()
+    await server.sync_waitlist_counter()
+
+    print(f"CPU seconds per {args.duration:.0f}s window; SSE tick {args.tick}s")
+    print(f"{'clients':>8} {'poll cpu s':>11} {'sse cpu s':>10} {'sse frames':>11}")
+    try:
+        for clients in (int(value) for value in args.clients.split(",")):
+            server.visitor_tracker = server.LocalVisitorTracker()
+            poll_cpu = await run_polling(clients, args.duration)
+            server.live_state.update(seq=0, snapshot=None, full_frame=None, diff_frame=None)
+            sse_cpu, frames = await run_sse(clients, args.duration, args.tick)
+            print(f"{clients:>8} {poll_cpu:>11.3f} {sse_cpu:>10.3f} {frames['count']:>11}")
+    finally:
+        await server.client.drop_database(BENCH_DB)
+        server.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""
+Login storm benchmark: p99 latency of an unrelated endpoint while PBKDF2 runs.
+
+Compares the old path (verify_password called inline in the handler) with the
+pooled path (verify_password_async). Runs in-process against a minimal app that
+reuses the real hashing helpers from server.py, so no MongoDB is needed.
+
+Usage: python benchmarks/password_hashing.py [--logins 200] [--probe-interval 0.005]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+import httpx
+from fastapi import FastAPI
+
+import server
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+STORED_HASH = server.hash_password("correct horse battery staple")
+
+bench_app = FastAPI()
+
+@bench_app.get("/inventory")
+async def inventory():
+    await asyncio.sleep(0)
+    return {"ok": True}
+
+@bench_app.post("/login/inline")
+async def login_inline():
+    return {"valid": server.verify_password("wrong password", STORED_HASH)}
+
+@bench_app.post("/login/pooled")
+async def login_pooled():
+    return {"valid": await server.verify_password_async("wrong password", STORED_HASH)}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_storm(mode: str, logins: int, probe_interval: float):
+    transport = httpx.ASGITransport(app=bench_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        latencies = []
+        storm_done = asyncio.Event()
+
+        async def probe():
+            # Only sample while the login storm is in progress
+            while not storm_done.is_set():
+                start = time.perf_counter()
+                await client.get("/inventory")
+                latencies.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(probe_interval)
+
+        async def storm():
+            await asyncio.gather(*[client.post(f"/login/{mode}") for _ in range(logins)])
+            storm_done.set()
+
+        started = time.perf_counter()
+        await asyncio.gather(probe(), storm())
+        elapsed = time.perf_counter() - started
+
+    return {
+        "mode": mode,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies),
+        "samples": len(latencies),
+        "storm_seconds": elapsed,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--probe-interval", type=float, default=0.005)
+    args = parser.parse_args()
+
+    print(f"{args.logins} concurrent logins, /inventory probed every {args.probe_interval * 1000:.0f}ms, "
+          f"{server.PASSWORD_HASH_WORKERS} hash workers")
+    print(f"{'mode':<8} {'samples':>8} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10} {'storm s':>10}")
+    for mode in ("inline", "pooled"):
+        result = await run_storm(mode, args.logins, args.probe_interval)
+        print(f"{result['mode']:<8} {result['samples']:>8} {result['p50_ms']:>10.2f} {result['p99_ms']:>10.2f} "
+              f"{result['max_ms']:>10.2f} {result['storm_seconds']:>10.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""
+Hot promo code benchmark: redemptions per second on one code.
+
+Fires --requests redemptions of a single code with --concurrency callers in
+flight, first counted on the promo_codes document itself and then on
+--shards shard counters. The code's max_uses is below --requests, so each run
+also checks the limit held exactly: accepted redemptions equal max_uses and
+the rolled-up uses match. Needs a reachable MongoDB; the scratch database is
+dropped afterwards.
+
+Usage: MONGO_URL=mongodb://localhost:27017 python benchmarks/promo_hot_code.py [--max-uses 4000] [--requests 5000] [--concurrency 500] [--shards 16]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+import server
+
+BENCH_DB = "benchmark_promo_hot_code"
+CODE = "VIRAL"
+
+
+async def reset(max_uses: int, shards: int):
+    await server.db.promo_codes.delete_many({})
+    await server.db.promo_usage_shards.delete_many({})
+    await server.db.promo_redemptions.delete_many({})
+    await server.db.promo_codes.insert_one({
+        "code": CODE, "discount_type": "percentage", "discount_value": 10, "min_order": 0,
+        "max_uses": max_uses, "uses": 0, "active": True, "expires_at": None
+    })
+    if shards > 1:
+        await server.shard_promo_usage(CODE, shards)
+    await server.load_promo_index()
+
+
+async def run(shards: int, max_uses: int, requests: int, concurrency: int):
+    await reset(max_uses, shards)
+    slots = asyncio.Semaphore(concurrency)
+    outcomes = {"ok": 0, "rejected": 0}
+
+    async def redeem(index: int):
+        async with slots:
+            try:
+                await server.use_promo_code(server.PromoCodeUse(code=CODE, reference=f"bench-{index}"))
+                outcomes["ok"] += 1
+            except server.HTTPException:
+                outcomes["rejected"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[redeem(index) for index in range(requests)])
+    elapsed = time.perf_counter() - started
+
+    await server.rollup_promo_usage()
+    doc = await server.db.promo_codes.find_one({"code": CODE})
+    logged = await server.db.promo_redemptions.count_documents({"code": CODE})
+    exact = outcomes["ok"] == max_uses == doc["uses"] == logged
+    return {
+        "mode": f"{shards} shards" if shards > 1 else "single doc",
+        "ok": outcomes["ok"],
+        "rejected": outcomes["rejected"],
+        "per_second": requests / elapsed,
+        "seconds": elapsed,
+        "exact": exact,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-uses", type=int, default=4000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--shards", type=int, default=16)
+    args = parser.parse_args()
+
+    server.db = server.client[BENCH_DB]
+    for name in ("promo_codes", "promo_usage_shards", "promo_redemptions"):
+        await server.db[name].create_indexes(server.INDEX_REGISTRY[name])
+
+    print(f"{args.requests} redemptions of one code capped at {args.max_uses}, {args.concurrency} in flight")
+    print(f"{'mode':<12} {'ok':>6} {'rejected':>9} {'req/s':>10} {'seconds':>9} {'limit exact':>12}")
+    try:
+        for shards in (1, args.shards):
+            result = await run(shards, args.max_uses, args.requests, args.concurrency)
+            print(f"{result['mode']:<12} {result['ok']:>6} {result['rejected']:>9} {result['per_second']:>10.0f} "
+                  f"{result['seconds']:>9.2f} {str(result['exact']):>12}")
+    finally:
+        await server.client.drop_database(BENCH_DB)
+        server.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""
+Response serialization benchmark: rendering order lists the old way and the new way.
+
+Builds N order documents shaped like the ones Mongo returns (aware datetimes,
+nested items and shipping) and times turning them into a response body:
+  pydantic+json  - response_model=List[Order] validation and serialization,
+                   then the stdlib JSONResponse render (the previous path)
+  encoder+orjson - jsonable_encoder then ORJSONResponse (plain dict endpoints
+                   under the new default response class)
+  fast orjson    - fast_response(): documents encoded directly by orjson
+  fast msgpack   - fast_response() with Accept: application/msgpack
+No database is needed.
+
+Usage: python benchmarks/response_serialization.py [--sizes 1000,10000] [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import TypeAdapter
+from starlette.requests import Request
+
+import server
+
+
+def make_orders(count: int):
+    started = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "order_number": f"RAZE-{index:08X}",
+            "items": [
+                {"product_id": 1 + line, "product_name": "Performance T-Shirt", "color": "Black", "size": "M",
+                 "quantity": 1 + line, "price": 45.0, "image": "/images/products/tshirt-black.webp"}
+                for line in range(3)
+            ],
+            "shipping": {
+                "first_name": "Alex", "last_name": "Rivera", "email": f"alex{index}@example.com", "phone": "555-0100",
+                "address_line1": "1 Main St", "address_line2": "", "city": "Austin", "state": "TX",
+                "postal_code": "78701", "country": "US"
+            },
+            "subtotal": 180.0,
+            "discount": 18.0,
+            "discount_description": "10% off (WELCOME10)",
+            "shipping_cost": 0.0,
+            "total": 162.0,
+            "status": "confirmed",
+            "tracking_number": None,
+            "notes": None,
+            "created_at": started + timedelta(minutes=index),
+            "updated_at": started + timedelta(minutes=index, seconds=30),
+        }
+        for index in range(count)
+    ]
+
+
+def msgpack_request() -> Request:
+    return Request({"type": "http", "headers": [(b"accept", server.MSGPACK_MEDIA_TYPE.encode())]})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    adapter = TypeAdapter(List[server.Order])
+    paths = {
+        "pydantic+json": lambda docs: JSONResponse(adapter.dump_python(adapter.validate_python(docs), mode="json")).body,
+        "encoder+orjson": lambda docs: ORJSONResponse(jsonable_encoder(docs)).body,
+        "fast orjson": lambda docs: server.fast_response(docs).body,
+    }
+    if server.MSGPACK_AVAILABLE:
+        paths["fast msgpack"] = lambda docs: server.fast_response(docs, msgpack_request()).body
+
+    print(f"{'orders':>7} {'path':<15} {'median ms':>10} {'bytes':>10} {'speedup':>8}")
+    for size in (int(value) for value in args.sizes.split(",")):
+        docs = make_orders(size)
+        baseline = None
+        for name, render in paths.items():
+            samples = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                body = render(docs)
+                samples.append((time.perf_counter() - start) * 1000)
+            median = statistics.median(samples)
+            baseline = baseline or median
+            print(f"{size:>7} {name:<15} {median:>10.1f} {len(body):>10} {baseline / median:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
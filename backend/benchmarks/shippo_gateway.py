@@ -0,0 +1,85 @@
+"""
+Shippo stall benchmark: how long the event loop freezes while rate quotes run.
+
+Fires --quotes concurrent shipment (rate quote) calls at FakeShippo (which blocks
+for --latency seconds per call, like the real SDK's HTTP round trip) and
+measures event-loop lag with a ticker that sleeps --tick seconds and records
+how late it wakes up. Compares the old path (SDK called inline in the handler)
+with the gateway (call_shippo on the Shippo thread pool). No MongoDB or Shippo
+account is needed.
+
+Usage: python benchmarks/shippo_gateway.py [--quotes 20] [--latency 0.2] [--tick 0.005]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+import server
+
+
+async def quote_inline():
+    return server.shippo_client.shipments.create(None)
+
+async def quote_gateway():
+    return await server.call_shippo("rates", "shipments.create", None)
+
+
+async def run(mode: str, quotes: int, tick: float):
+    quote = quote_inline if mode == "inline" else quote_gateway
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(tick)
+            lags.append((time.perf_counter() - start - tick) * 1000)
+
+    async def burst():
+        await asyncio.sleep(tick)  # Let the ticker start first
+        await asyncio.gather(*[quote() for _ in range(quotes)])
+        done.set()
+
+    started = time.perf_counter()
+    await asyncio.gather(ticker(), burst())
+    elapsed = time.perf_counter() - started
+
+    return {
+        "mode": mode,
+        "ticks": len(lags),
+        "p50_lag_ms": statistics.median(lags),
+        "max_lag_ms": max(lags),
+        "stalled_ms": sum(lag for lag in lags if lag > 1),
+        "seconds": elapsed,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quotes", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tick", type=float, default=0.005)
+    args = parser.parse_args()
+
+    server.shippo_client = server.FakeShippo(latency=args.latency)
+
+    print(f"{args.quotes} concurrent rate quotes, {args.latency * 1000:.0f}ms per Shippo call, "
+          f"rates concurrency {server.SHIPPO_CONCURRENCY['rates']}, {server.SHIPPO_WORKERS} workers")
+    print(f"{'mode':<8} {'ticks':>6} {'p50 lag ms':>11} {'max lag ms':>11} {'stalled ms':>11} {'seconds':>8}")
+    for mode in ("inline", "gateway"):
+        result = await run(mode, args.quotes, args.tick)
+        print(f"{result['mode']:<8} {result['ticks']:>6} {result['p50_lag_ms']:>11.2f} {result['max_lag_ms']:>11.2f} "
+              f"{result['stalled_ms']:>11.0f} {result['seconds']:>8.2f}")
+    server.shippo_executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
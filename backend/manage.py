@@ -0,0 +1,58 @@
+"""
+Maintenance commands run against the configured database (MONGO_URL / DB_NAME).
+
+Usage: python manage.py <command>
+
+Commands:
+  rebuild-orders-rollup   recompute orders_rollup from the orders collection
+  migrate-dates           convert ISO string timestamps to BSON dates (resumable;
+                          re-run after an interruption to continue where it stopped)
+  dedupe-orders           archive duplicate orders per Stripe session to
+                          orders_duplicates (keeps the earliest), then build indexes
+"""
+import argparse
+import asyncio
+
+import server
+
+
+async def rebuild_orders_rollup(args):
+    buckets = await server.rebuild_orders_rollup()
+    print(f"Rebuilt orders rollup: {buckets} day/status buckets")
+
+
+async def migrate_dates(args):
+    migration = await server.migrate_native_dates(batch_size=args.batch_size)
+    for name, state in migration.get("progress", {}).items():
+        print(f"{name:<22} {state['converted']:>8} converted {state['skipped']:>6} skipped")
+    print(f"{server.MIGRATION_NATIVE_DATES}: {migration['state']}")
+
+
+async def dedupe_orders(args):
+    archived = await server.dedupe_stripe_session_orders()
+    print(f"Archived {archived} duplicate orders")
+    failures = await server.ensure_indexes()
+    print(f"Index failures: {failures}" if failures else "All indexes built")
+
+
+COMMANDS = {
+    "rebuild-orders-rollup": rebuild_orders_rollup,
+    "migrate-dates": migrate_dates,
+    "dedupe-orders": dedupe_orders,
+}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--batch-size", type=int, default=500, help="documents per batch for migrate-dates")
+    args = parser.parse_args()
+
+    try:
+        await COMMANDS[args.command](args)
+    finally:
+        server.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,21 +1,36 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Cookie
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Cookie, Query, Body
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
+import io
+import csv
+import json
 import logging
 import asyncio
+import functools
+import time
+from collections import OrderedDict, deque
+from itertools import islice
 from pathlib import Path
+from types import SimpleNamespace
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional, Dict
 import uuid
+import random
+import socket
+import base64
 import hashlib
 import secrets
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, timezone, timedelta
 import httpx
 import resend
 import shippo
+from cachetools import TTLCache
 
 # Stripe imports
 from emergentintegrations.payments.stripe.checkout import (
@@ -31,7 +46,8 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# tz_aware: stored dates come back as aware UTC datetimes
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # Resend configuration
@@ -78,7 +94,7 @@ RAZE_ADDRESS = {
 }
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -157,6 +173,7 @@ class Order(BaseModel):
     status: str = "pending"  # pending, confirmed, processing, shipped, delivered, cancelled
     tracking_number: Optional[str] = None
     notes: Optional[str] = None
+    needs_review: bool = False  # e.g. paid after its stock hold lapsed and the stock was gone
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -196,6 +213,7 @@ class ShippingRate(BaseModel):
 class ShippingRatesResponse(BaseModel):
     success: bool
     rates: List[ShippingRate]
+    cached: bool = False
     message: Optional[str] = None
 
 class CreateLabelRequest(BaseModel):
@@ -266,6 +284,7 @@ class CheckoutRequest(BaseModel):
     subtotal: float
     discount: float = 0
     discount_description: Optional[str] = None
+    promo_code: Optional[str] = None  # Redeemed once the stock hold succeeds
     shipping_cost: float = 0
     total: float
     origin_url: str  # Frontend URL for redirects
@@ -407,6 +426,13 @@ class PromoCodeCreate(BaseModel):
     min_order: float = 0
     max_uses: Optional[int] = None
     expires_at: Optional[str] = None
+    usage_shards: int = Field(0, ge=0, le=64)  # >1 spreads usage counting for hot codes
+
+class PromoCodeUse(BaseModel):
+    code: str
+    subtotal: float = 0
+    email: Optional[str] = None
+    reference: Optional[str] = None  # Checkout session or order number
 
 
 # Default promo codes
@@ -417,10 +443,719 @@ DEFAULT_PROMO_CODES = [
 ]
 
 
+# ============================================
+# DATABASE INDEXES
+# ============================================
+
+# Declarative index registry, applied at startup by ensure_indexes().
+# Unique indexes back the lookups the code treats as unique.
+INDEX_REGISTRY: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("created_at", DESCENDING), ("user_id", DESCENDING)], name="created_at_user_id"),
+    ],
+    "user_sessions": [
+        IndexModel([("session_token", ASCENDING)], name="session_token_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        # Only applies to BSON dates, so legacy string sessions linger until migrated
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "orders": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("order_number", ASCENDING)], name="order_number_unique", unique=True),
+        IndexModel([("shipping.email", ASCENDING), ("created_at", DESCENDING)], name="shipping_email_created_at"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("status", ASCENDING)], name="status"),
+        # One order per Stripe session; order creation upserts on it
+        IndexModel([("stripe_session_id", ASCENDING)], name="stripe_session_id_unique", unique=True,
+                   partialFilterExpression={"stripe_session_id": {"$type": "string"}}),
+    ],
+    "pending_orders": [
+        IndexModel([("session_id", ASCENDING)], name="session_id"),
+    ],
+    "stripe_events": [
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt_at"),
+        IndexModel([("session_id", ASCENDING)], name="session_id"),
+        # Kept well past Stripe's redelivery window (3 days) for dedupe, then dropped
+        IndexModel([("received_at", ASCENDING)], name="received_at_ttl", expireAfterSeconds=30 * 24 * 3600),
+    ],
+    "orders_rollup": [
+        IndexModel([("day", ASCENDING), ("status", ASCENDING)], name="day_status"),
+    ],
+    "payment_transactions": [
+        IndexModel([("session_id", ASCENDING)], name="session_id"),
+    ],
+    "inventory": [
+        IndexModel([("product_id", ASCENDING), ("color", ASCENDING), ("size", ASCENDING)], name="variant_unique", unique=True),
+    ],
+    "inventory_holds": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("owner", ASCENDING), ("state", ASCENDING)], name="owner_state"),
+        IndexModel([("state", ASCENDING), ("expires_at", ASCENDING)], name="state_expires_at"),
+        IndexModel([("items.lease_id", ASCENDING)], name="items_lease_id", sparse=True),
+    ],
+    "visitor_presence": [
+        # Counts filter on last_seen themselves; the TTL only keeps the collection small
+        IndexModel([("last_seen", ASCENDING)], name="last_seen_ttl", expireAfterSeconds=300),
+    ],
+    "drop_leases": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("state", ASCENDING), ("heartbeat_at", ASCENDING)], name="state_heartbeat_at"),
+        IndexModel([("worker_id", ASCENDING), ("state", ASCENDING)], name="worker_state"),
+    ],
+    "promo_codes": [
+        IndexModel([("code", ASCENDING)], name="code_unique", unique=True),
+    ],
+    "promo_usage_shards": [
+        IndexModel([("code", ASCENDING), ("shard", ASCENDING)], name="code_shard_unique", unique=True),
+    ],
+    "promo_redemptions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("code", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="code_created_at_id"),
+    ],
+    "waitlist": [
+        IndexModel([("email", ASCENDING), ("product_id", ASCENDING), ("variant", ASCENDING)], name="email_product_variant_unique", unique=True),
+        IndexModel([("access_code", ASCENDING)], name="access_code_unique", unique=True),
+        IndexModel([("position", ASCENDING)], name="position"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+    ],
+    "email_subscriptions": [
+        IndexModel([("email", ASCENDING), ("source", ASCENDING)], name="email_source"),
+        IndexModel([("source", ASCENDING), ("timestamp", DESCENDING), ("id", DESCENDING)], name="source_timestamp_id"),
+        IndexModel([("timestamp", DESCENDING), ("id", DESCENDING)], name="timestamp_id"),
+    ],
+    "webhook_outbox": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt_at"),
+        IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)], name="status_lease_expires_at"),
+        IndexModel([("endpoint", ASCENDING), ("status", ASCENDING)], name="endpoint_status"),
+        # Delivered entries are kept for a week for latency reporting, then expire
+        IndexModel([("delivered_at", ASCENDING)], name="delivered_at_ttl", expireAfterSeconds=7 * 24 * 60 * 60),
+    ],
+    "abandoned_carts": [
+        IndexModel([("recovered", ASCENDING), ("created_at", ASCENDING)], name="recovered_created_at"),
+        IndexModel([("email", ASCENDING), ("recovered", ASCENDING)], name="email_recovered"),
+        IndexModel([("id", ASCENDING)], name="id"),
+    ],
+}
+
+# Hot queries checked by verify_hot_query_plans() - none of these may COLLSCAN
+HOT_QUERIES = [
+    {"name": "user_by_email", "collection": "users", "filter": {"email": "x@example.com"}},
+    {"name": "user_by_id", "collection": "users", "filter": {"user_id": "user_x"}},
+    {"name": "session_by_token", "collection": "user_sessions", "filter": {"session_token": "x"}},
+    {"name": "order_by_id", "collection": "orders", "filter": {"id": "x"}},
+    {"name": "order_by_number", "collection": "orders", "filter": {"order_number": "RAZE-X"}},
+    {"name": "orders_by_email", "collection": "orders", "filter": {"shipping.email": "x@example.com"}, "sort": [("created_at", DESCENDING)]},
+    {"name": "order_by_stripe_session", "collection": "orders", "filter": {"stripe_session_id": "cs_x"}},
+    {"name": "inventory_variant", "collection": "inventory", "filter": {"product_id": 1, "color": "Black", "size": "M"}},
+    {"name": "promo_by_code", "collection": "promo_codes", "filter": {"code": "X"}},
+    {"name": "waitlist_entry", "collection": "waitlist", "filter": {"email": "x@example.com", "product_id": 1, "variant": "Black"}},
+    {"name": "waitlist_by_access_code", "collection": "waitlist", "filter": {"access_code": "RAZE-X"}},
+    {"name": "subscription_by_email_source", "collection": "email_subscriptions", "filter": {"email": "x@example.com", "source": "giveaway_popup"}},
+    {"name": "subscriptions_by_source_time", "collection": "email_subscriptions", "filter": {"source": "giveaway_popup", "timestamp": {"$gte": datetime(2025, 1, 1, tzinfo=timezone.utc)}}},
+    {"name": "abandoned_carts_pending", "collection": "abandoned_carts", "filter": {"recovered": False}, "sort": [("created_at", ASCENDING)]},
+    {"name": "pending_order_by_session", "collection": "pending_orders", "filter": {"session_id": "cs_x"}},
+]
+
+# Indexes replaced by a registry entry over the same keys. A retired index is only
+# dropped once its replacement exists; if MongoDB won't build the replacement next to
+# it (same keys, conflicting options) it is swapped out and restored should the build
+# fail, so the collection always keeps an index on those keys.
+RETIRED_INDEXES: Dict[str, List[str]] = {
+    "waitlist": ["email_product_variant"],
+    "orders": ["stripe_session_id"],
+}
+
+# Run before building a registered index that doesn't exist yet, e.g. to clear out
+# duplicates a new unique index would reject. Keyed by (collection, index name).
+INDEX_PREREQUISITES: Dict[tuple, object] = {}
+
+async def create_registered_index(collection, index: IndexModel, existing: dict, retired: List[str]):
+    """Create one registry index, swapping out a retired index that blocks it"""
+    try:
+        await collection.create_indexes([index])
+        return
+    except OperationFailure as e:
+        keys = list(index.document["key"].items())
+        blocking = [name for name in retired if name in existing and list(existing[name]["key"]) == keys]
+        # IndexOptionsConflict (85) / IndexKeySpecsConflict (86)
+        if e.code not in (85, 86) or not blocking:
+            raise
+    
+    old_name = blocking[0]
+    old = existing[old_name]
+    await collection.drop_index(old_name)
+    try:
+        await collection.create_indexes([index])
+    except OperationFailure:
+        options = {key: value for key, value in old.items() if key not in ("key", "v", "ns")}
+        await collection.create_indexes([IndexModel(old["key"], name=old_name, **options)])
+        raise
+
+async def ensure_indexes() -> Dict[str, List[str]]:
+    """Create every registered index (idempotent). Returns failures per collection."""
+    failures: Dict[str, List[str]] = {}
+    for collection_name, indexes in INDEX_REGISTRY.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        retired = RETIRED_INDEXES.get(collection_name, [])
+        for index in indexes:
+            name = index.document["name"]
+            try:
+                prerequisite = INDEX_PREREQUISITES.get((collection_name, name))
+                if prerequisite and name not in existing:
+                    await prerequisite()
+                await create_registered_index(collection, index, existing, retired)
+            except OperationFailure as e:
+                failures.setdefault(collection_name, []).append(name)
+                logger.error(f"Failed to create index {collection_name}.{name}: {str(e)}")
+        
+        present = await collection.index_information()
+        for name in retired:
+            if name not in present:
+                continue
+            if any(other not in retired and list(info["key"]) == list(present[name]["key"]) for other, info in present.items()):
+                await collection.drop_index(name)
+            else:
+                logger.warning(f"Keeping retired index {collection_name}.{name} until its replacement builds")
+    return failures
+
+def unique_index_failures(failures: Dict[str, List[str]]) -> List[str]:
+    """Failed indexes that enforce uniqueness (the app can't run correctly without them)"""
+    return [
+        f"{collection_name}.{index.document['name']}"
+        for collection_name, indexes in INDEX_REGISTRY.items()
+        for index in indexes
+        if index.document.get("unique") and index.document["name"] in failures.get(collection_name, [])
+    ]
+
+def find_plan_stages(plan, stages: Optional[List[str]] = None) -> List[str]:
+    """Collect every stage name in an explain() plan tree"""
+    if stages is None:
+        stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            if isinstance(value, (dict, list)):
+                find_plan_stages(value, stages)
+    elif isinstance(plan, list):
+        for item in plan:
+            find_plan_stages(item, stages)
+    return stages
+
+async def verify_hot_query_plans() -> List[dict]:
+    """Run explain() on each hot query and flag any that fall back to COLLSCAN"""
+    results = []
+    for query in HOT_QUERIES:
+        cursor = db[query["collection"]].find(query["filter"])
+        if query.get("sort"):
+            cursor = cursor.sort(query["sort"])
+        explain = await cursor.limit(1).explain()
+        stages = find_plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        results.append({
+            "name": query["name"],
+            "collection": query["collection"],
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages
+        })
+    return results
+
+
+# ============================================
+# OUTBOUND HTTP CLIENTS
+# ============================================
+
+# HTTP/2 needs the optional h2 package; fall back to HTTP/1.1 keep-alive without it
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# One shared connection pool per upstream, created on startup and closed on shutdown
+HTTP_UPSTREAMS = {
+    "n8n": {
+        "timeout": httpx.Timeout(10.0, connect=5.0),
+        "limits": httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0),
+    },
+    "emergent_auth": {
+        "timeout": httpx.Timeout(10.0, connect=5.0),
+        "limits": httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=30.0),
+    },
+    "images": {
+        "timeout": httpx.Timeout(30.0, connect=5.0),
+        "limits": httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0),
+    },
+}
+
+http_clients: Dict[str, httpx.AsyncClient] = {}
+http_client_stats: Dict[str, Dict[str, int]] = {}
+
+def create_http_client(name: str) -> httpx.AsyncClient:
+    """Build the pooled client for an upstream, counting requests and error responses"""
+    config = HTTP_UPSTREAMS[name]
+    stats = http_client_stats.setdefault(name, {"requests": 0, "error_responses": 0, "clients_created": 0})
+    stats["clients_created"] += 1
+    
+    async def count_request(request: httpx.Request):
+        stats["requests"] += 1
+    
+    async def count_response(response: httpx.Response):
+        if response.status_code >= 400:
+            stats["error_responses"] += 1
+    
+    return httpx.AsyncClient(
+        http2=HTTP2_AVAILABLE,
+        timeout=config["timeout"],
+        limits=config["limits"],
+        event_hooks={"request": [count_request], "response": [count_response]}
+    )
+
+def get_http_client(name: str) -> httpx.AsyncClient:
+    """Get the shared client for an upstream (created lazily if startup hasn't run)"""
+    http_client = http_clients.get(name)
+    if http_client is None or http_client.is_closed:
+        http_client = create_http_client(name)
+        http_clients[name] = http_client
+    return http_client
+
+async def close_http_clients():
+    """Close every pooled client"""
+    for http_client in list(http_clients.values()):
+        await http_client.aclose()
+    http_clients.clear()
+
+def get_http_pool_stats() -> Dict[str, dict]:
+    """Request counters and open connections per upstream pool"""
+    pools = {}
+    for name, config in HTTP_UPSTREAMS.items():
+        http_client = http_clients.get(name)
+        connections = []
+        if http_client is not None and not http_client.is_closed:
+            # httpx doesn't expose pool state publicly; read it from the httpcore pool
+            pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+        pools[name] = {
+            **http_client_stats.get(name, {"requests": 0, "error_responses": 0, "clients_created": 0}),
+            "open": http_client is not None and not http_client.is_closed,
+            "http2": HTTP2_AVAILABLE,
+            "connections": len(connections),
+            "idle_connections": sum(1 for conn in connections if conn.is_idle()),
+            "max_connections": config["limits"].max_connections,
+            "max_keepalive_connections": config["limits"].max_keepalive_connections,
+            "timeout_seconds": config["timeout"].read
+        }
+    return pools
+
+
+# ============================================
+# BACKGROUND TASKS
+# ============================================
+
+background_tasks: Dict[str, asyncio.Task] = {}
+
+def start_background_task(name: str, coro):
+    """Start a named long-running task (cancelled on shutdown)"""
+    existing = background_tasks.get(name)
+    if existing and not existing.done():
+        coro.close()
+        return existing
+    task = asyncio.create_task(coro, name=name)
+    background_tasks[name] = task
+    return task
+
+async def stop_background_tasks():
+    """Cancel every background task and wait for them to finish"""
+    tasks = list(background_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    background_tasks.clear()
+
+
+# ============================================
+# WEBHOOK OUTBOX
+# ============================================
+
+# Outbound n8n webhooks are written to db.webhook_outbox and delivered by a
+# worker, so bursts are bounded and failures/restarts don't lose events.
+WEBHOOK_OUTBOX_CONCURRENCY = int(os.environ.get('WEBHOOK_OUTBOX_CONCURRENCY', '8'))
+WEBHOOK_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_OUTBOX_MAX_ATTEMPTS', '8'))
+WEBHOOK_OUTBOX_POLL_SECONDS = float(os.environ.get('WEBHOOK_OUTBOX_POLL_SECONDS', '2'))
+WEBHOOK_OUTBOX_LEASE_SECONDS = 60  # In-flight entries are retried if a worker dies mid-delivery
+WEBHOOK_OUTBOX_BASE_BACKOFF_SECONDS = 5
+WEBHOOK_OUTBOX_MAX_BACKOFF_SECONDS = 30 * 60
+
+# Endpoints whose n8n workflow accepts {"event_type": "batch", "events": [...]}
+# e.g. WEBHOOK_OUTBOX_BATCH_ENDPOINTS="giveaway,waitlist"
+WEBHOOK_OUTBOX_BATCH_ENDPOINTS = {
+    name.strip() for name in os.environ.get('WEBHOOK_OUTBOX_BATCH_ENDPOINTS', '').split(',') if name.strip()
+}
+WEBHOOK_OUTBOX_BATCH_SIZE = int(os.environ.get('WEBHOOK_OUTBOX_BATCH_SIZE', '25'))
+
+webhook_outbox_wakeup = asyncio.Event()
+webhook_outbox_slots = asyncio.Semaphore(WEBHOOK_OUTBOX_CONCURRENCY)
+webhook_outbox_deliveries = set()
+
+def webhook_backoff_seconds(attempts: int) -> float:
+    """Exponential backoff with jitter for the given number of failed attempts"""
+    delay = min(WEBHOOK_OUTBOX_MAX_BACKOFF_SECONDS, WEBHOOK_OUTBOX_BASE_BACKOFF_SECONDS * (2 ** (attempts - 1)))
+    return delay * (0.75 + secrets.randbelow(500) / 1000)
+
+async def enqueue_webhook(endpoint: str, url: str, payload: dict, entry_id: Optional[str] = None):
+    """Write a webhook to the outbox for the delivery worker. An entry_id makes it
+    idempotent: a second enqueue with the same id is ignored."""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.webhook_outbox.insert_one({
+            "id": entry_id or str(uuid.uuid4()),
+            "endpoint": endpoint,
+            "url": url,
+            "payload": payload,
+            "status": "pending",  # pending, in_flight, delivered, dead
+            "attempts": 0,
+            "created_at": now,
+            "next_attempt_at": now
+        })
+    except DuplicateKeyError:
+        return
+    webhook_outbox_wakeup.set()
+
+async def claim_outbox_entries() -> List[dict]:
+    """Lease the next due outbox entry (plus same-endpoint entries when batching)"""
+    now = datetime.now(timezone.utc)
+    # Each lease counts an attempt, so an entry whose delivery keeps killing or hanging
+    # its worker runs out of attempts too instead of being re-leased forever
+    await db.webhook_outbox.update_many(
+        {"status": "in_flight", "lease_expires_at": {"$lte": now}, "attempts": {"$gte": WEBHOOK_OUTBOX_MAX_ATTEMPTS}},
+        {"$set": {"status": "dead", "dead_at": now, "last_error": "lease expired during delivery"},
+         "$unset": {"lease_expires_at": ""}}
+    )
+    claimable = {"$or": [
+        {"status": "pending", "next_attempt_at": {"$lte": now}},
+        {"status": "in_flight", "lease_expires_at": {"$lte": now}, "attempts": {"$lt": WEBHOOK_OUTBOX_MAX_ATTEMPTS}}
+    ]}
+    lease = {
+        "$set": {"status": "in_flight", "lease_expires_at": now + timedelta(seconds=WEBHOOK_OUTBOX_LEASE_SECONDS)},
+        "$inc": {"attempts": 1}
+    }
+    
+    # Entries are returned as they were before the lease (only their payload and attempts
+    # are used), so entry["attempts"] + 1 is the attempt this lease counted
+    first = await db.webhook_outbox.find_one_and_update(claimable, lease, sort=[("next_attempt_at", 1)])
+    if not first:
+        return []
+    
+    entries = [first]
+    if first["endpoint"] in WEBHOOK_OUTBOX_BATCH_ENDPOINTS:
+        while len(entries) < WEBHOOK_OUTBOX_BATCH_SIZE:
+            entry = await db.webhook_outbox.find_one_and_update(
+                {"$and": [claimable, {"endpoint": first["endpoint"], "url": first["url"]}]},
+                lease, sort=[("next_attempt_at", 1)]
+            )
+            if not entry:
+                break
+            entries.append(entry)
+    return entries
+
+async def deliver_outbox_entries(entries: List[dict]):
+    """POST one entry (or a batch) to n8n and record the outcome"""
+    endpoint = entries[0]["endpoint"]
+    error = None
+    try:
+        if endpoint in WEBHOOK_OUTBOX_BATCH_ENDPOINTS:
+            body = {"event_type": "batch", "endpoint": endpoint, "events": [entry["payload"] for entry in entries]}
+        else:
+            body = entries[0]["payload"]
+        response = await get_http_client("n8n").post(
+            entries[0]["url"],
+            json=body,
+            headers={"Content-Type": "application/json"}
+        )
+        if not 200 <= response.status_code < 300:
+            error = f"HTTP {response.status_code}"
+    except Exception as e:
+        # Anything else (bad URL, unserializable payload) is retried and dead-lettered the
+        # same way; left in_flight it would be re-claimed forever without counting attempts
+        error = f"{type(e).__name__}: {str(e)}"
+    
+    now = datetime.now(timezone.utc)
+    if error is None:
+        await db.webhook_outbox.update_many(
+            {"id": {"$in": [entry["id"] for entry in entries]}},
+            {"$set": {"status": "delivered", "delivered_at": now, "attempts_at_delivery": entries[0]["attempts"] + 1},
+             "$unset": {"lease_expires_at": ""}}
+        )
+        logger.info(f"Delivered {len(entries)} {endpoint} webhook(s)")
+        return
+    
+    for entry in entries:
+        attempts = entry["attempts"] + 1
+        if attempts >= WEBHOOK_OUTBOX_MAX_ATTEMPTS:
+            update = {"status": "dead", "dead_at": now}
+            logger.error(f"Webhook {entry['id']} ({endpoint}) dead-lettered after {attempts} attempts: {error}")
+        else:
+            update = {"status": "pending", "next_attempt_at": now + timedelta(seconds=webhook_backoff_seconds(attempts))}
+            logger.warning(f"Webhook {entry['id']} ({endpoint}) attempt {attempts} failed: {error}")
+        await db.webhook_outbox.update_one(
+            {"id": entry["id"]},
+            {"$set": {**update, "attempts": attempts, "last_error": error}, "$unset": {"lease_expires_at": ""}}
+        )
+
+def log_outbox_delivery_error(task: asyncio.Task):
+    """Log unexpected delivery errors (the entry is retried once its lease expires)"""
+    if not task.cancelled() and task.exception():
+        logger.error(f"Webhook outbox delivery failed: {str(task.exception())}")
+
+async def webhook_outbox_worker():
+    """Drain the outbox with at most WEBHOOK_OUTBOX_CONCURRENCY deliveries in flight"""
+    while True:
+        await webhook_outbox_slots.acquire()
+        try:
+            entries = await claim_outbox_entries()
+        except Exception as e:
+            webhook_outbox_slots.release()
+            logger.error(f"Webhook outbox claim failed: {str(e)}")
+            await asyncio.sleep(WEBHOOK_OUTBOX_POLL_SECONDS)
+            continue
+        
+        if not entries:
+            webhook_outbox_slots.release()
+            webhook_outbox_wakeup.clear()
+            try:
+                await asyncio.wait_for(webhook_outbox_wakeup.wait(), timeout=WEBHOOK_OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        
+        task = asyncio.create_task(deliver_outbox_entries(entries))
+        task.add_done_callback(log_outbox_delivery_error)
+        webhook_outbox_deliveries.add(task)
+        task.add_done_callback(webhook_outbox_deliveries.discard)
+        task.add_done_callback(lambda _: webhook_outbox_slots.release())
+
+
 # ============================================
 # HELPER FUNCTIONS
 # ============================================
 
+single_flight_calls: Dict[str, asyncio.Future] = {}
+
+async def single_flight(key: str, factory):
+    """Run factory() at most once per key at a time; concurrent callers share its result"""
+    future = single_flight_calls.get(key)
+    if future is None:
+        future = asyncio.ensure_future(factory())
+        single_flight_calls[key] = future
+        future.add_done_callback(lambda _: single_flight_calls.pop(key, None))
+    # Shield so one caller disconnecting doesn't cancel the shared refresh
+    return await asyncio.shield(future)
+
+# Responses default to ORJSONResponse. High-volume reads of trusted Mongo documents go
+# further through fast_response(): the query projects to the response model's fields and
+# the documents are encoded directly, skipping response_model validation and
+# jsonable_encoder. Admin clients may send Accept: application/msgpack instead (when
+# msgpack is installed); dates are ISO strings in both encodings.
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+def model_projection(model) -> dict:
+    """Mongo projection returning just a response model's fields"""
+    return {"_id": 0, **{field: 1 for field in model.model_fields}}
+
+def msgpack_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__} as msgpack")
+
+class MsgpackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+    
+    def render(self, content) -> bytes:
+        return msgpack.packb(content, default=msgpack_default)
+
+def fast_response(content, request: Optional[Request] = None) -> Response:
+    """Encode trusted content without validation; pass the request to allow msgpack negotiation"""
+    if request is None:
+        return ORJSONResponse(content)
+    if MSGPACK_AVAILABLE and MSGPACK_MEDIA_TYPE in request.headers.get("accept", ""):
+        return MsgpackResponse(content, headers={"Vary": "Accept"})
+    return ORJSONResponse(content, headers={"Vary": "Accept"})
+
+# Timestamps are stored as native BSON dates; with the tz_aware client they read back
+# as aware UTC datetimes and FastAPI renders them as ISO 8601 strings. Documents written
+# before the 0001_native_dates migration (python manage.py migrate-dates) may still hold
+# ISO strings, so until it has completed, range filters built with date_range() match
+# both representations and readers go through as_utc().
+MIGRATION_NATIVE_DATES = "0001_native_dates"
+DATE_FIELDS: Dict[str, List[str]] = {
+    "users": ["created_at", "updated_at"],
+    "user_sessions": ["created_at", "expires_at"],
+    "orders": ["created_at", "updated_at", "shipped_at", "delivered_at"],
+    "pending_orders": ["created_at"],
+    "payment_transactions": ["created_at", "updated_at"],
+    "waitlist": ["created_at", "updated_at"],
+    "email_subscriptions": ["timestamp", "upsell_sent_at"],
+    "status_checks": ["timestamp"],
+    "promo_codes": ["created_at", "expires_at"],
+    "promo_redemptions": ["created_at"],
+    "inventory": ["updated_at"],
+    "orders_rollup": ["updated_at"],
+}
+date_storage = {"legacy_strings": True}
+
+def as_utc(value) -> Optional[datetime]:
+    """Aware UTC datetime from a stored value (datetime, legacy ISO string or None)"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def date_range(field: str, gte: Optional[datetime] = None, lt: Optional[datetime] = None) -> dict:
+    """Range filter on a date field; also matches legacy ISO strings until the migration has run"""
+    bounds = {}
+    if gte is not None:
+        bounds["$gte"] = gte
+    if lt is not None:
+        bounds["$lt"] = lt
+    if not date_storage["legacy_strings"]:
+        return {field: bounds}
+    legacy = {op: bound.isoformat() for op, bound in bounds.items()}
+    return {"$or": [{field: bounds}, {field: legacy}]}
+
+async def load_date_storage_state():
+    """Switch off the legacy string handling once the migration is recorded as complete"""
+    migration = await db.schema_migrations.find_one({"_id": MIGRATION_NATIVE_DATES})
+    date_storage["legacy_strings"] = not (migration and migration.get("state") == "completed")
+
+async def migrate_native_dates(batch_size: int = 500) -> dict:
+    """Convert ISO string timestamps in DATE_FIELDS to BSON dates. Resumable: progress is
+    checkpointed per collection in schema_migrations, and each document is only rewritten
+    if the field still holds the string we read, so it is safe to run against live traffic."""
+    migration = await db.schema_migrations.find_one({"_id": MIGRATION_NATIVE_DATES}) or {}
+    if migration.get("state") == "completed":
+        return migration
+    
+    await db.schema_migrations.update_one(
+        {"_id": MIGRATION_NATIVE_DATES},
+        {"$set": {"state": "running"}, "$setOnInsert": {"started_at": datetime.now(timezone.utc), "progress": {}}},
+        upsert=True
+    )
+    progress = migration.get("progress", {})
+    
+    for name, fields in DATE_FIELDS.items():
+        state = progress.get(name, {"last_id": None, "converted": 0, "skipped": 0, "done": False})
+        if state["done"]:
+            continue
+        
+        string_fields = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        while True:
+            query = string_fields if state["last_id"] is None else {"$and": [string_fields, {"_id": {"$gt": state["last_id"]}}]}
+            docs = await db[name].find(query, {field: 1 for field in fields}).sort("_id", ASCENDING).limit(batch_size).to_list(batch_size)
+            if not docs:
+                break
+            
+            operations = []
+            for doc in docs:
+                for field in fields:
+                    value = doc.get(field)
+                    if not isinstance(value, str):
+                        continue
+                    try:
+                        parsed = as_utc(value)
+                    except ValueError:
+                        state["skipped"] += 1
+                        logger.warning(f"Date migration: unparseable {name}.{field} on {doc['_id']}: {value!r}")
+                        continue
+                    operations.append(UpdateOne({"_id": doc["_id"], field: value}, {"$set": {field: parsed}}))
+            if operations:
+                result = await db[name].bulk_write(operations, ordered=False)
+                state["converted"] += result.modified_count
+            
+            state["last_id"] = docs[-1]["_id"]
+            await db.schema_migrations.update_one(
+                {"_id": MIGRATION_NATIVE_DATES}, {"$set": {f"progress.{name}": state}}
+            )
+        
+        state["done"] = True
+        await db.schema_migrations.update_one({"_id": MIGRATION_NATIVE_DATES}, {"$set": {f"progress.{name}": state}})
+        progress[name] = state
+        logger.info(f"Date migration: {name} done ({state['converted']} converted, {state['skipped']} skipped)")
+    
+    await db.schema_migrations.update_one(
+        {"_id": MIGRATION_NATIVE_DATES},
+        {"$set": {"state": "completed", "completed_at": datetime.now(timezone.utc)}}
+    )
+    date_storage["legacy_strings"] = False
+    return await db.schema_migrations.find_one({"_id": MIGRATION_NATIVE_DATES})
+
+# Streaming exports (?format=ndjson|csv) read the cursor in batches and flush rows
+# as they arrive, so memory stays flat and nothing is truncated at a list cap.
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+EXPORT_FLUSH_BYTES = 64 * 1024
+EXPORT_FORMAT_PATTERN = "^(json|ndjson|csv)$"
+
+def export_json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def export_csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=export_json_default)
+    return value
+
+async def iter_export_rows(cursor, fmt: str, fields: List[str]):
+    """Yield ndjson/csv chunks from a Motor cursor"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(fields)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    
+    first = True
+    async for doc in cursor.batch_size(EXPORT_BATCH_SIZE):
+        if fmt == "csv":
+            writer.writerow([export_csv_value(doc.get(field)) for field in fields])
+        else:
+            buffer.write(json.dumps(doc, default=export_json_default))
+            buffer.write("\n")
+        # Send the first row right away, then flush in larger chunks
+        if first or buffer.tell() >= EXPORT_FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            first = False
+    
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def stream_export(cursor, fmt: str, fields: List[str], filename: str) -> StreamingResponse:
+    """Stream a cursor as NDJSON or CSV"""
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        iter_export_rows(cursor, fmt, fields),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'}
+    )
+
 def hash_password(password: str) -> str:
     """Hash password with salt"""
     salt = secrets.token_hex(16)
@@ -436,8 +1171,52 @@ def verify_password(password: str, password_hash: str) -> bool:
     except:
         return False
 
+# PBKDF2 takes ~50-100ms of CPU per call, so it runs on a dedicated thread pool
+# (hashlib releases the GIL while hashing) instead of stalling the event loop.
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '4'))
+PASSWORD_HASH_MAX_CONCURRENCY = int(os.environ.get('PASSWORD_HASH_MAX_CONCURRENCY', str(PASSWORD_HASH_WORKERS)))
+password_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+password_hash_semaphore = asyncio.Semaphore(PASSWORD_HASH_MAX_CONCURRENCY)
+password_hash_stats = {
+    "queued": 0,  # Waiting for a semaphore slot
+    "running": 0,
+    "peak_queued": 0,
+    "completed": 0,
+    "total_wait_seconds": 0.0,
+}
+
+async def run_password_hash(func, *args):
+    """Run a password hashing function on the bounded hash pool"""
+    loop = asyncio.get_running_loop()
+    queued_at = loop.time()
+    password_hash_stats["queued"] += 1
+    password_hash_stats["peak_queued"] = max(password_hash_stats["peak_queued"], password_hash_stats["queued"])
+    acquired = False
+    try:
+        async with password_hash_semaphore:
+            acquired = True
+            password_hash_stats["queued"] -= 1
+            password_hash_stats["running"] += 1
+            password_hash_stats["total_wait_seconds"] += loop.time() - queued_at
+            try:
+                return await loop.run_in_executor(password_hash_executor, func, *args)
+            finally:
+                password_hash_stats["running"] -= 1
+                password_hash_stats["completed"] += 1
+    finally:
+        if not acquired:
+            password_hash_stats["queued"] -= 1
+
+async def hash_password_async(password: str) -> str:
+    """Hash password without blocking the event loop"""
+    return await run_password_hash(hash_password, password)
+
+async def verify_password_async(password: str, password_hash: str) -> bool:
+    """Verify password without blocking the event loop"""
+    return await run_password_hash(verify_password, password, password_hash)
+
 async def send_n8n_signup_webhook(email: str, name: str, discount_code: str, signup_method: str, gymnastics_type: str = None):
-    """Send webhook to n8n when a user signs up"""
+    """Queue webhook to n8n when a user signs up"""
     try:
         # Production domain for all images
         PRODUCTION_URL = "https://razetraining.com"
@@ -486,51 +1265,30 @@ async def send_n8n_signup_webhook(email: str, name: str, discount_code: str, sig
         # Debug log the payload
         logging.info(f"Signup webhook payload: {payload}")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                N8N_WEBHOOK_URL,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=10.0
-            )
-            
-            if response.status_code == 200:
-                logging.info(f"n8n webhook sent successfully for {email}")
-            else:
-                logging.warning(f"n8n webhook returned status {response.status_code} for {email}")
+        await enqueue_webhook("signup", N8N_WEBHOOK_URL, payload)
                 
     except Exception as e:
         # Don't fail the registration if webhook fails
-        logging.error(f"Failed to send n8n webhook for {email}: {str(e)}")
+        logging.error(f"Failed to queue n8n webhook for {email}: {str(e)}")
 
 async def send_n8n_giveaway_webhook(email: str):
-    """Send webhook to n8n when someone enters the giveaway"""
+    """Queue webhook to n8n when someone enters the giveaway"""
     try:
         # Production domain for images
         PRODUCTION_URL = "https://razetraining.com"
         LOGO_URL = f"{PRODUCTION_URL}/images/logo/raze_logo.png"
         
-        async with httpx.AsyncClient() as client:
-            payload = {
-                "email": email,
-                "event_type": "giveaway_entry",
-                "logo_url": LOGO_URL,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            }
-            
-            response = await client.post(
-                N8N_GIVEAWAY_WEBHOOK_URL,
-                json=payload,
-                timeout=10.0
-            )
-            
-            if response.status_code == 200:
-                logging.info(f"n8n giveaway webhook sent successfully for {email}")
-            else:
-                logging.warning(f"n8n giveaway webhook returned status {response.status_code} for {email}")
+        payload = {
+            "email": email,
+            "event_type": "giveaway_entry",
+            "logo_url": LOGO_URL,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+        
+        await enqueue_webhook("giveaway", N8N_GIVEAWAY_WEBHOOK_URL, payload)
                 
     except Exception as e:
-        logging.error(f"Failed to send n8n giveaway webhook for {email}: {str(e)}")
+        logging.error(f"Failed to queue n8n giveaway webhook for {email}: {str(e)}")
 
 async def send_n8n_waitlist_webhook(
     email: str,
@@ -541,7 +1299,7 @@ async def send_n8n_waitlist_webhook(
     access_code: str,
     is_update: bool
 ):
-    """Send webhook to n8n for waitlist join/update emails"""
+    """Queue webhook to n8n for waitlist join/update emails"""
     try:
         # Production domain for images
         PRODUCTION_URL = "https://razetraining.com"
@@ -578,23 +1336,31 @@ async def send_n8n_waitlist_webhook(
         # Debug log the full payload
         logging.info(f"Waitlist webhook payload: {payload}")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                N8N_WAITLIST_WEBHOOK_URL,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=10.0
-            )
-            
-            if response.status_code == 200:
-                logging.info(f"n8n waitlist webhook sent successfully for {email} (is_update={is_update})")
-            else:
-                logging.warning(f"n8n waitlist webhook returned status {response.status_code} for {email}")
+        await enqueue_webhook("waitlist", N8N_WAITLIST_WEBHOOK_URL, payload)
                 
     except Exception as e:
-        logging.error(f"Failed to send n8n waitlist webhook for {email}: {str(e)}")
+        logging.error(f"Failed to queue n8n waitlist webhook for {email}: {str(e)}")
+
+# Session cache: session_token -> (user document, session expiry)
+# Bounded LRU with a short TTL so changes made by other workers are picked up quickly.
+SESSION_CACHE_TTL_SECONDS = int(os.environ.get('SESSION_CACHE_TTL_SECONDS', '60'))
+SESSION_CACHE_MAX_SIZE = int(os.environ.get('SESSION_CACHE_MAX_SIZE', '10000'))
+session_cache: TTLCache = TTLCache(maxsize=SESSION_CACHE_MAX_SIZE, ttl=SESSION_CACHE_TTL_SECONDS)
 
-async def get_current_user(request: Request) -> Optional[dict]:
+def invalidate_session_cache(session_token: Optional[str] = None, user_id: Optional[str] = None, email: Optional[str] = None):
+    """Drop cached sessions by token, or every cached session belonging to a user"""
+    if session_token:
+        session_cache.pop(session_token, None)
+    if user_id or email:
+        for token in list(session_cache.keys()):
+            cached = session_cache.get(token)
+            if not cached:
+                continue
+            user = cached[0]
+            if (user_id and user.get('user_id') == user_id) or (email and user.get('email') == email):
+                session_cache.pop(token, None)
+
+async def get_current_user(request: Request, use_cache: bool = True) -> Optional[dict]:
     """Get current user from session token (cookie or header)"""
     # Try cookie first
     session_token = request.cookies.get("session_token")
@@ -612,26 +1378,34 @@ async def get_current_user(request: Request) -> Optional[dict]:
     if not session_token:
         return None
     
+    # Serve from the session cache when possible (skips two DB round trips)
+    cached = session_cache.get(session_token) if use_cache else None
+    if cached:
+        user, expires_at = cached
+        if expires_at < datetime.now(timezone.utc):
+            session_cache.pop(session_token, None)
+            return None
+        return dict(user)
+    
     # Find session
     session = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0})
     if not session:
         return None
     
     # Check expiry
-    expires_at = session.get("expires_at")
-    if isinstance(expires_at, str):
-        expires_at = datetime.fromisoformat(expires_at)
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    expires_at = as_utc(session.get("expires_at"))
     if expires_at < datetime.now(timezone.utc):
         return None
     
     # Get user
     user = await db.users.find_one({"user_id": session["user_id"]}, {"_id": 0})
+    if user:
+        session_cache[session_token] = (user, expires_at)
+        return dict(user)
     return user
 
 async def send_order_confirmation_email(order: dict):
-    """Send order confirmation webhook to n8n"""
+    """Queue order confirmation webhook to n8n"""
     shipping = order.get('shipping', {})
     customer_email = shipping.get('email')
     
@@ -675,21 +1449,8 @@ async def send_order_confirmation_email(order: dict):
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
     
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                N8N_ORDER_WEBHOOK_URL,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=10.0
-            )
-            
-            if response.status_code == 200:
-                logger.info(f"Order confirmation webhook sent for {customer_email}")
-            else:
-                logger.warning(f"Order confirmation webhook returned status {response.status_code}")
-    except Exception as e:
-        logger.error(f"Failed to send order confirmation webhook: {str(e)}")
+    # Not caught: a failed enqueue fails the finalization step so it's retried
+    await enqueue_webhook("order_confirmation", N8N_ORDER_WEBHOOK_URL, payload, entry_id=f"order_confirmation:{order['id']}")
 
 
 # ============================================
@@ -700,48 +1461,306 @@ async def send_order_confirmation_email(order: dict):
 async def root():
     return {"message": "RAZE API"}
 
-@api_router.get("/stats")
-async def get_public_stats():
-    """
-    Public stats endpoint - returns signup, waitlist, and giveaway counts.
-    No authentication required.
-    """
-    # Get today's date range
+# Public stats are served from a snapshot refreshed at most every PUBLIC_STATS_TTL_SECONDS.
+# "Today" counts are derived as total minus a per-day baseline of documents created
+# before midnight UTC, so they are never recounted from scratch on a refresh.
+PUBLIC_STATS_TTL_SECONDS = float(os.environ.get('PUBLIC_STATS_TTL_SECONDS', '15'))
+PUBLIC_STATS_BASELINE_SECONDS = 60 * 60  # Re-anchor the baseline hourly to absorb deletes
+public_stats_cache = {"data": None, "expires_at": 0.0, "baseline": None, "baseline_day": None, "baseline_at": 0.0}
+
+async def load_public_stats_baseline(today_start: datetime) -> dict:
+    """Count documents created before today (one indexed range count per collection)"""
+    signups, waitlist, giveaway = await asyncio.gather(
+        db.users.count_documents(date_range("created_at", lt=today_start)),
+        db.waitlist.count_documents(date_range("created_at", lt=today_start)),
+        db.email_subscriptions.count_documents({"source": "giveaway_popup", **date_range("timestamp", lt=today_start)})
+    )
+    return {"signups": signups, "waitlist": waitlist, "giveaway": giveaway}
+
+async def refresh_public_stats() -> dict:
+    """Recompute the public stats snapshot"""
+    loop = asyncio.get_running_loop()
     today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    today_iso = today_start.isoformat()
-    
-    # Total counts
-    total_signups = await db.users.count_documents({})
-    total_waitlist = await db.waitlist.count_documents({})
-    total_giveaway = await db.email_subscriptions.count_documents({"source": "giveaway_popup"})
     
-    # Today's counts
-    signups_today = await db.users.count_documents({"created_at": {"$gte": today_iso}})
-    waitlist_today = await db.waitlist.count_documents({"created_at": {"$gte": today_iso}})
-    giveaway_today = await db.email_subscriptions.count_documents({
-        "source": "giveaway_popup",
-        "timestamp": {"$gte": today_iso}
-    })
+    if (public_stats_cache["baseline_day"] != today_start.date()
+            or loop.time() - public_stats_cache["baseline_at"] > PUBLIC_STATS_BASELINE_SECONDS):
+        public_stats_cache["baseline"] = await load_public_stats_baseline(today_start)
+        public_stats_cache["baseline_day"] = today_start.date()
+        public_stats_cache["baseline_at"] = loop.time()
+    baseline = public_stats_cache["baseline"]
+    
+    total_signups, total_waitlist, total_giveaway = await asyncio.gather(
+        db.users.estimated_document_count(),
+        db.waitlist.estimated_document_count(),
+        db.email_subscriptions.count_documents({"source": "giveaway_popup"})
+    )
     
-    return {
+    data = {
         "total_signups": total_signups,
         "total_waitlist": total_waitlist,
         "total_giveaway": total_giveaway,
-        "signups_today": signups_today,
-        "waitlist_today": waitlist_today,
-        "giveaway_today": giveaway_today
+        "signups_today": max(0, total_signups - baseline["signups"]),
+        "waitlist_today": max(0, total_waitlist - baseline["waitlist"]),
+        "giveaway_today": max(0, total_giveaway - baseline["giveaway"])
     }
+    public_stats_cache["data"] = data
+    public_stats_cache["expires_at"] = loop.time() + PUBLIC_STATS_TTL_SECONDS
+    return data
+
+@api_router.get("/stats")
+async def get_public_stats():
+    """
+    Public stats endpoint - returns signup, waitlist, and giveaway counts.
+    No authentication required.
+    """
+    if public_stats_cache["data"] is not None and asyncio.get_running_loop().time() < public_stats_cache["expires_at"]:
+        return public_stats_cache["data"]
+    
+    # Concurrent cache misses share a single refresh
+    return await single_flight("public_stats", refresh_public_stats)
 
 
 # ============================================
 # IMAGE PROXY ROUTE (for CORS bypass in canvas sanitization)
 # ============================================
 
+# Proxied images are cached by (url, format, width, quality) in memory and on disk,
+# both bounded by total bytes with LRU eviction. Transcoding runs in a process pool.
+IMAGE_CACHE_DIR = Path(os.environ.get('IMAGE_CACHE_DIR', str(ROOT_DIR / 'image_cache')))
+IMAGE_CACHE_MEMORY_BYTES = int(os.environ.get('IMAGE_CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+IMAGE_CACHE_DISK_BYTES = int(os.environ.get('IMAGE_CACHE_DISK_BYTES', str(1024 * 1024 * 1024)))
+IMAGE_PROXY_MAX_SOURCE_BYTES = 25 * 1024 * 1024
+IMAGE_TRANSCODE_WORKERS = int(os.environ.get('IMAGE_TRANSCODE_WORKERS', '2'))
+IMAGE_STREAM_CHUNK_BYTES = 64 * 1024
+IMAGE_DEFAULT_QUALITY = 80
+
+IMAGE_EXTENSIONS = {
+    "image/webp": "webp",
+    "image/avif": "avif",
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/svg+xml": "svg",
+}
+IMAGE_CONTENT_TYPES = {ext: content_type for content_type, ext in IMAGE_EXTENSIONS.items()}
+
+image_memory_cache: "OrderedDict[str, dict]" = OrderedDict()  # key -> {content, content_type, etag}
+image_disk_index: "OrderedDict[str, dict]" = OrderedDict()  # key -> {path, size, content_type, etag}
+image_cache_stats = {"memory_bytes": 0, "disk_bytes": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "not_modified": 0}
+image_transcode_executor: Optional[ProcessPoolExecutor] = None
+
+def transcode_image(data: bytes, source_type: str, fmt: str, width: Optional[int], quality: int):
+    """Resize/re-encode an image (runs in a worker process). Returns (bytes, content_type)."""
+    from PIL import Image, ImageOps
+    
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            target = fmt if fmt != "original" else (img.format or "PNG").lower()
+            img = ImageOps.exif_transpose(img)
+            if width and img.width > width:
+                img.thumbnail((width, round(img.height * width / img.width)), Image.LANCZOS)
+            if target in ("webp", "avif", "jpeg") and img.mode not in ("RGB", "RGBA"):
+                has_alpha = "A" in img.getbands() or "transparency" in img.info
+                img = img.convert("RGBA" if has_alpha and target != "jpeg" else "RGB")
+            if target == "jpeg" and img.mode == "RGBA":
+                img = img.convert("RGB")
+            
+            out = io.BytesIO()
+            save_options = {"quality": quality}
+            if target == "webp":
+                save_options["method"] = 4
+            elif target in ("jpeg", "png"):
+                save_options["optimize"] = True
+            img.save(out, format=target.upper(), **save_options)
+            encoded = out.getvalue()
+    except Exception:
+        # Not something Pillow can re-encode (e.g. SVG) - pass it through unchanged
+        return data, source_type
+    
+    # A plain re-encode that came out bigger isn't worth serving
+    if fmt == "original" and not width and len(encoded) >= len(data):
+        return data, source_type
+    content_type = IMAGE_CONTENT_TYPES.get("jpg" if target == "jpeg" else target, source_type)
+    return encoded, content_type
+
+def get_image_transcode_executor() -> ProcessPoolExecutor:
+    global image_transcode_executor
+    if image_transcode_executor is None:
+        image_transcode_executor = ProcessPoolExecutor(max_workers=IMAGE_TRANSCODE_WORKERS)
+    return image_transcode_executor
+
+def image_supports(fmt: str) -> bool:
+    """Check whether this Pillow build can encode the given format"""
+    try:
+        from PIL import features
+        return bool(features.check(fmt))
+    except Exception:
+        return False
+
+IMAGE_AVIF_SUPPORTED = image_supports("avif")
+IMAGE_WEBP_SUPPORTED = image_supports("webp")
+
+def negotiate_image_format(requested: str, accept: str) -> str:
+    """Pick the output format from ?format= and the Accept header"""
+    if requested == "avif" and IMAGE_AVIF_SUPPORTED:
+        return "avif"
+    if requested == "webp" and IMAGE_WEBP_SUPPORTED:
+        return "webp"
+    if requested == "auto":
+        if "image/avif" in accept and IMAGE_AVIF_SUPPORTED:
+            return "avif"
+        if "image/webp" in accept and IMAGE_WEBP_SUPPORTED:
+            return "webp"
+    return "original"
+
+def image_cache_key(url: str, fmt: str, width: Optional[int], quality: int) -> str:
+    return hashlib.sha256(f"{url}|{fmt}|{width or 0}|{quality}".encode()).hexdigest()
+
+def remember_image_in_memory(key: str, entry: dict):
+    """Insert into the memory cache and evict least recently used entries over budget"""
+    if len(entry["content"]) > IMAGE_CACHE_MEMORY_BYTES // 4:
+        return
+    previous = image_memory_cache.pop(key, None)
+    if previous:
+        image_cache_stats["memory_bytes"] -= len(previous["content"])
+    image_memory_cache[key] = entry
+    image_cache_stats["memory_bytes"] += len(entry["content"])
+    while image_cache_stats["memory_bytes"] > IMAGE_CACHE_MEMORY_BYTES and image_memory_cache:
+        _, evicted = image_memory_cache.popitem(last=False)
+        image_cache_stats["memory_bytes"] -= len(evicted["content"])
+
+def write_image_to_disk(key: str, content: bytes, content_type: str) -> Path:
+    """Atomically write a cache file (runs in a thread)"""
+    IMAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = IMAGE_CACHE_DIR / f"{key}.{IMAGE_EXTENSIONS.get(content_type, 'bin')}"
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, path)
+    return path
+
+# The disk index and byte count are only touched on the event loop; worker threads
+# just do the file I/O. A file can still disappear under a reader (evicted, or
+# removed by hand), so serving opens it first and falls back to the origin.
+
+def evict_disk_images() -> List[Path]:
+    """Drop least recently used entries until the disk cache is under budget; returns the files to delete"""
+    paths = []
+    while image_cache_stats["disk_bytes"] > IMAGE_CACHE_DISK_BYTES and image_disk_index:
+        _, evicted = image_disk_index.popitem(last=False)
+        image_cache_stats["disk_bytes"] -= evicted["size"]
+        paths.append(evicted["path"])
+    return paths
+
+def unlink_image_files(paths: List[Path]):
+    """Delete evicted cache files (runs in a thread)"""
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+def scan_image_cache_dir() -> list:
+    """List cache files as (mtime, path, size), clearing partial writes (runs in a thread)"""
+    if not IMAGE_CACHE_DIR.exists():
+        return []
+    files = []
+    for path in IMAGE_CACHE_DIR.iterdir():
+        if path.suffix == ".tmp":
+            path.unlink(missing_ok=True)
+            continue
+        stat = path.stat()
+        files.append((stat.st_mtime, path, stat.st_size))
+    return files
+
+async def load_image_disk_index():
+    """Rebuild the disk cache index from IMAGE_CACHE_DIR, oldest first"""
+    loop = asyncio.get_running_loop()
+    files = await loop.run_in_executor(None, scan_image_cache_dir)
+    image_disk_index.clear()
+    image_cache_stats["disk_bytes"] = 0
+    for _, path, size in sorted(files):
+        key, _, ext = path.name.partition(".")
+        image_disk_index[key] = {
+            "path": path,
+            "size": size,
+            "content_type": IMAGE_CONTENT_TYPES.get(ext, "application/octet-stream"),
+            "etag": f'"{key[:32]}-{size}"'
+        }
+        image_cache_stats["disk_bytes"] += size
+    await loop.run_in_executor(None, unlink_image_files, evict_disk_images())
+
+async def open_disk_image(key: str, disk_entry: dict):
+    """Open a cached file for serving, or forget it and return None if it is gone.
+    The open handle stays readable even if eviction unlinks the file mid-response."""
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, open, disk_entry["path"], "rb")
+    except FileNotFoundError:
+        if image_disk_index.get(key) is disk_entry:
+            del image_disk_index[key]
+            image_cache_stats["disk_bytes"] -= disk_entry["size"]
+        return None
+
+async def fetch_and_cache_image(url: str, key: str, fmt: str, width: Optional[int], quality: int) -> dict:
+    """Fetch from the origin, transcode, and store in both cache tiers"""
+    async with get_http_client("images").stream("GET", url) as response:
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail="Failed to fetch image")
+        source_type = response.headers.get('content-type', 'image/png').split(';')[0].strip()
+        chunks = []
+        received = 0
+        async for chunk in response.aiter_bytes():
+            received += len(chunk)
+            if received > IMAGE_PROXY_MAX_SOURCE_BYTES:
+                raise HTTPException(status_code=413, detail="Image too large")
+            chunks.append(chunk)
+    source = b"".join(chunks)
+    
+    content, content_type = source, source_type
+    if fmt != "original" or width or quality != IMAGE_DEFAULT_QUALITY:
+        loop = asyncio.get_running_loop()
+        content, content_type = await loop.run_in_executor(
+            get_image_transcode_executor(), transcode_image, source, source_type, fmt, width, quality
+        )
+    
+    entry = {"content": content, "content_type": content_type, "etag": f'"{key[:32]}-{len(content)}"'}
+    remember_image_in_memory(key, entry)
+    
+    try:
+        loop = asyncio.get_running_loop()
+        path = await loop.run_in_executor(None, write_image_to_disk, key, content, content_type)
+        previous = image_disk_index.pop(key, None)
+        if previous:
+            image_cache_stats["disk_bytes"] -= previous["size"]
+        image_disk_index[key] = {"path": path, "size": len(content), "content_type": content_type, "etag": entry["etag"]}
+        image_cache_stats["disk_bytes"] += len(content)
+        evicted = evict_disk_images()
+        if evicted:
+            await loop.run_in_executor(None, unlink_image_files, evicted)
+    except OSError as e:
+        logger.warning(f"Could not write image cache file: {str(e)}")
+    
+    return entry
+
+def iter_image_chunks(content: bytes):
+    for offset in range(0, len(content), IMAGE_STREAM_CHUNK_BYTES):
+        yield content[offset:offset + IMAGE_STREAM_CHUNK_BYTES]
+
+def iter_image_file(image_file):
+    """Stream an open cache file and close it (iterated in Starlette's threadpool)"""
+    with image_file:
+        while chunk := image_file.read(IMAGE_STREAM_CHUNK_BYTES):
+            yield chunk
+
 @api_router.get("/proxy-image")
-async def proxy_image(url: str):
+async def proxy_image(
+    request: Request,
+    url: str,
+    w: Optional[int] = Query(None, ge=16, le=4096),
+    q: int = Query(IMAGE_DEFAULT_QUALITY, ge=30, le=95),
+    format: str = Query("auto", pattern="^(auto|webp|avif|original)$")
+):
     """
     Proxy an image URL with automatic compression to improve loading speed.
-    Compresses images from ~6MB to ~300-500KB without visible quality loss.
+    Transcodes to AVIF/WebP (negotiated from Accept, or forced with ?format=) and
+    optionally resizes to ?w= pixels wide at ?q= quality. Results are cached in
+    memory and on disk, so repeat requests never go back to the origin.
     Returns the image with Access-Control-Allow-Origin header.
     """
     # Whitelist allowed domains for security
@@ -765,29 +1784,63 @@ async def proxy_image(url: str):
     if not is_allowed:
         raise HTTPException(status_code=403, detail=f"Domain not allowed: {domain}")
     
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url)
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail="Failed to fetch image")
-            
-            # Get content type
-            content_type = response.headers.get('content-type', 'image/png')
-            image_content = response.content
-            
-            # Return image with CORS headers and caching
-            return Response(
-                content=image_content,
-                media_type=content_type,
-                headers={
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Methods": "GET",
-                    "Cache-Control": "public, max-age=2592000",  # 30 days cache
-                }
-            )
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching image: {str(e)}")
+    fmt = negotiate_image_format(format, request.headers.get("accept", ""))
+    key = image_cache_key(url, fmt, w, q)
+    
+    # CORS headers and caching
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods": "GET",
+        "Cache-Control": "public, max-age=2592000",  # 30 days cache
+        "Vary": "Accept",
+    }
+    
+    entry = image_memory_cache.get(key)
+    disk_entry = image_file = None
+    if entry:
+        image_memory_cache.move_to_end(key)
+        image_cache_stats["memory_hits"] += 1
+        headers["X-Cache"] = "HIT-MEMORY"
+    else:
+        disk_entry = image_disk_index.get(key)
+        image_file = await open_disk_image(key, disk_entry) if disk_entry else None
+        if image_file:
+            if key in image_disk_index:
+                image_disk_index.move_to_end(key)
+            image_cache_stats["disk_hits"] += 1
+            headers["X-Cache"] = "HIT-DISK"
+        else:
+            disk_entry = None
+            image_cache_stats["misses"] += 1
+            headers["X-Cache"] = "MISS"
+            try:
+                # Concurrent misses for the same image share one origin fetch
+                entry = await single_flight(
+                    f"proxy-image:{key}", lambda: fetch_and_cache_image(url, key, fmt, w, q)
+                )
+            except httpx.RequestError as e:
+                raise HTTPException(status_code=500, detail=f"Error fetching image: {str(e)}")
+    
+    cached = entry or disk_entry
+    headers["ETag"] = cached["etag"]
+    if request.headers.get("if-none-match") == cached["etag"]:
+        image_cache_stats["not_modified"] += 1
+        if image_file:
+            image_file.close()
+        return Response(status_code=304, headers=headers)
+    
+    if disk_entry:
+        return StreamingResponse(
+            iter_image_file(image_file),
+            media_type=disk_entry["content_type"],
+            headers={**headers, "Content-Length": str(disk_entry["size"])}
+        )
+    
+    return StreamingResponse(
+        iter_image_chunks(entry["content"]),
+        media_type=entry["content_type"],
+        headers={**headers, "Content-Length": str(len(entry["content"]))}
+    )
 
 
 @api_router.post("/status", response_model=StatusCheck)
@@ -795,17 +1848,17 @@ async def create_status_check(input: StatusCheckCreate):
     status_dict = input.model_dump()
     status_obj = StatusCheck(**status_dict)
     doc = status_obj.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
     _ = await db.status_checks.insert_one(doc)
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find({}, {"_id": 0}).to_list(1000)
-    for check in status_checks:
-        if isinstance(check['timestamp'], str):
-            check['timestamp'] = datetime.fromisoformat(check['timestamp'])
-    return status_checks
+async def get_status_checks(request: Request, format: str = Query("json", pattern=EXPORT_FORMAT_PATTERN)):
+    if format != "json":
+        cursor = db.status_checks.find({}, {"_id": 0})
+        return stream_export(cursor, format, ["id", "client_name", "timestamp"], "status_checks")
+    
+    status_checks = await db.status_checks.find({}, model_projection(StatusCheck)).to_list(1000)
+    return fast_response(status_checks, request)
 
 
 # ============================================
@@ -849,13 +1902,12 @@ async def subscribe_email(input: EmailSubscriptionCreate):
     )
     
     doc = subscription.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
     
     await db.email_subscriptions.insert_one(doc)
     
     # If this is a giveaway entry, send webhook to n8n
     if input.source == "giveaway_popup":
-        asyncio.create_task(send_n8n_giveaway_webhook(input.email.lower()))
+        await send_n8n_giveaway_webhook(input.email.lower())
     
     return EmailResponse(
         success=True,
@@ -872,7 +1924,7 @@ async def giveaway_entry_webhook(request: Request):
         
         if email:
             # Send to n8n
-            asyncio.create_task(send_n8n_giveaway_webhook(email))
+            await send_n8n_giveaway_webhook(email)
             return {"success": True, "message": "Webhook triggered"}
         
         return {"success": False, "message": "Email required"}
@@ -881,21 +1933,26 @@ async def giveaway_entry_webhook(request: Request):
         return {"success": False, "message": str(e)}
 
 @api_router.get("/emails/list", response_model=List[EmailSubscription])
-async def get_email_subscriptions(source: Optional[str] = None):
+async def get_email_subscriptions(
+    request: Request,
+    source: Optional[str] = None,
+    format: str = Query("json", pattern=EXPORT_FORMAT_PATTERN)
+):
     """
     Get all email subscriptions, optionally filtered by source.
+    Use ?format=ndjson or ?format=csv to stream every subscription without the list cap.
     """
     query = {}
     if source:
         query["source"] = source
     
-    subscriptions = await db.email_subscriptions.find(query, {"_id": 0}).to_list(10000)
+    if format != "json":
+        cursor = db.email_subscriptions.find(query, {"_id": 0})
+        fields = ["id", "email", "source", "product_id", "product_name", "drop", "timestamp", "upsell_sent"]
+        return stream_export(cursor, format, fields, "email_subscriptions")
     
-    for sub in subscriptions:
-        if isinstance(sub.get('timestamp'), str):
-            sub['timestamp'] = datetime.fromisoformat(sub['timestamp'])
-    
-    return subscriptions
+    subscriptions = await db.email_subscriptions.find(query, model_projection(EmailSubscription)).to_list(10000)
+    return fast_response(subscriptions, request)
 
 @api_router.get("/emails/stats")
 async def get_email_stats():
@@ -932,13 +1989,12 @@ async def get_giveaway_entries_for_upsell():
     # Using $or to handle both cases: upsell_sent is False OR upsell_sent field doesn't exist
     query = {
         "source": "giveaway_popup",
-        "timestamp": {
-            "$gte": one_day_ago_start.isoformat(),
-            "$lt": one_day_ago_end.isoformat()
-        },
-        "$or": [
-            {"upsell_sent": False},
-            {"upsell_sent": {"$exists": False}}
+        "$and": [
+            date_range("timestamp", gte=one_day_ago_start, lt=one_day_ago_end),
+            {"$or": [
+                {"upsell_sent": False},
+                {"upsell_sent": {"$exists": False}}
+            ]}
         ]
     }
     
@@ -974,7 +2030,7 @@ async def mark_upsell_sent(request: Request):
         {
             "$set": {
                 "upsell_sent": True,
-                "upsell_sent_at": datetime.now(timezone.utc).isoformat()
+                "upsell_sent_at": datetime.now(timezone.utc)
             }
         }
     )
@@ -1005,7 +2061,7 @@ async def register(user_data: UserRegister, response: Response):
     user = User(
         email=user_data.email.lower(),
         name=user_data.name,
-        password_hash=hash_password(user_data.password),
+        password_hash=await hash_password_async(user_data.password),
         auth_provider="email",
         gymnastics_type=user_data.gymnastics_type,
         gender=user_data.gender,
@@ -1019,24 +2075,24 @@ async def register(user_data: UserRegister, response: Response):
     )
     
     doc = user.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
-    await db.users.insert_one(doc)
+    try:
+        await db.users.insert_one(doc)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration for the same email
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     # Send webhook to n8n for welcome email
-    asyncio.create_task(send_n8n_signup_webhook(
+    await send_n8n_signup_webhook(
         email=user.email,
         name=user.name,
         discount_code=unique_code,
         signup_method="email",
         gymnastics_type=user.gymnastics_type
-    ))
+    )
     
     # Create session
     session = UserSession(user_id=user.user_id)
     session_doc = session.model_dump()
-    session_doc['expires_at'] = session_doc['expires_at'].isoformat()
-    session_doc['created_at'] = session_doc['created_at'].isoformat()
     await db.user_sessions.insert_one(session_doc)
     
     # Set cookie
@@ -1080,14 +2136,12 @@ async def login(credentials: UserLogin, response: Response):
     if user.get('auth_provider') == 'google':
         raise HTTPException(status_code=400, detail="This account uses Google login. Please sign in with Google.")
     
-    if not user.get('password_hash') or not verify_password(credentials.password, user['password_hash']):
+    if not user.get('password_hash') or not await verify_password_async(credentials.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     # Create session
     session = UserSession(user_id=user['user_id'])
     session_doc = session.model_dump()
-    session_doc['expires_at'] = session_doc['expires_at'].isoformat()
-    session_doc['created_at'] = session_doc['created_at'].isoformat()
     await db.user_sessions.insert_one(session_doc)
     
     # Set cookie
@@ -1131,17 +2185,15 @@ async def exchange_session(request: Request, response: Response):
     
     # Call Emergent auth API to get user data
     try:
-        async with httpx.AsyncClient() as client:
-            auth_response = await client.get(
-                "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-                headers={"X-Session-ID": session_id},
-                timeout=10.0
-            )
-            
-            if auth_response.status_code != 200:
-                raise HTTPException(status_code=401, detail="Invalid session")
-            
-            auth_data = auth_response.json()
+        auth_response = await get_http_client("emergent_auth").get(
+            "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
+            headers={"X-Session-ID": session_id}
+        )
+        
+        if auth_response.status_code != 200:
+            raise HTTPException(status_code=401, detail="Invalid session")
+        
+        auth_data = auth_response.json()
     except httpx.RequestError as e:
         logger.error(f"Auth service error: {str(e)}")
         raise HTTPException(status_code=500, detail="Authentication service unavailable")
@@ -1157,10 +2209,11 @@ async def exchange_session(request: Request, response: Response):
             {"$set": {
                 "name": auth_data.get('name', user['name']),
                 "picture": auth_data.get('picture'),
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "updated_at": datetime.now(timezone.utc)
             }}
         )
         user_id = user['user_id']
+        invalidate_session_cache(user_id=user_id)
     else:
         # Generate unique first order discount code for new user
         unique_code = f"WELCOME{uuid.uuid4().hex[:6].upper()}"
@@ -1180,8 +2233,6 @@ async def exchange_session(request: Request, response: Response):
             total_credits_redeemed=0
         )
         doc = new_user.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        doc['updated_at'] = doc['updated_at'].isoformat()
         await db.users.insert_one(doc)
         user_id = new_user.user_id
         user = doc
@@ -1192,8 +2243,6 @@ async def exchange_session(request: Request, response: Response):
     # Create session
     session = UserSession(user_id=user_id)
     session_doc = session.model_dump()
-    session_doc['expires_at'] = session_doc['expires_at'].isoformat()
-    session_doc['created_at'] = session_doc['created_at'].isoformat()
     await db.user_sessions.insert_one(session_doc)
     
     # Set cookie
@@ -1258,6 +2307,7 @@ async def logout(request: Request, response: Response):
     
     if session_token:
         await db.user_sessions.delete_one({"session_token": session_token})
+        invalidate_session_cache(session_token=session_token)
     
     response.delete_cookie(key="session_token", path="/")
     
@@ -1283,7 +2333,7 @@ async def complete_profile(request: Request):
     # Update user profile
     update_data = {
         "gymnastics_type": gymnastics_type,
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "updated_at": datetime.now(timezone.utc)
     }
     
     if age:
@@ -1295,17 +2345,18 @@ async def complete_profile(request: Request):
         {"user_id": user['user_id']},
         {"$set": update_data}
     )
+    invalidate_session_cache(user_id=user['user_id'])
     
     # Now send the welcome email webhook with complete data
     # Only send if this user signed up via Google and hasn't received welcome email yet
     if user.get('auth_provider') == 'google':
-        asyncio.create_task(send_n8n_signup_webhook(
+        await send_n8n_signup_webhook(
             email=user['email'],
             name=user['name'],
             discount_code=user.get('first_order_discount_code', ''),
             signup_method="google",
             gymnastics_type=gymnastics_type
-        ))
+        )
     
     return {
         "success": True,
@@ -1359,11 +2410,12 @@ async def use_first_order_discount(request: Request):
         {
             "$set": {
                 "has_used_first_order_discount": True,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "updated_at": datetime.now(timezone.utc)
             },
             "$inc": {"order_count": 1}
         }
     )
+    invalidate_session_cache(user_id=user['user_id'])
     
     return {"success": True, "message": "First order discount marked as used"}
 
@@ -1407,7 +2459,8 @@ async def get_user_credits(request: Request):
 @api_router.post("/auth/credits/redeem")
 async def redeem_credits(request: Request, redemption: CreditRedemptionRequest):
     """Redeem RAZE credits for a discount code"""
-    user = await get_current_user(request)
+    # Always read the balance fresh - a cached user may predate a redemption on another worker
+    user = await get_current_user(request, use_cache=False)
     
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -1438,12 +2491,13 @@ async def redeem_credits(request: Request, redemption: CreditRedemptionRequest):
         "max_uses": 1,
         "current_uses": 0,
         "is_active": True,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "expires_at": (datetime.now(timezone.utc) + timedelta(days=30)).isoformat(),
+        "created_at": datetime.now(timezone.utc),
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=30),
         "description": f"RAZE Credits Redemption - {tier['label']}"
     }
     
     await db.promo_codes.insert_one(promo)
+    index_promo(promo)
     
     # Deduct credits from user
     new_credits = current_credits - tier["credits"]
@@ -1459,6 +2513,7 @@ async def redeem_credits(request: Request, redemption: CreditRedemptionRequest):
             }
         }
     )
+    invalidate_session_cache(user_id=user["user_id"])
     
     return {
         "success": True,
@@ -1484,20 +2539,14 @@ async def get_user_orders(request: Request):
         {"_id": 0}
     ).sort("created_at", -1).to_list(100)
     
-    for order in orders:
-        if isinstance(order.get('created_at'), str):
-            order['created_at'] = datetime.fromisoformat(order['created_at'])
-        if isinstance(order.get('updated_at'), str):
-            order['updated_at'] = datetime.fromisoformat(order['updated_at'])
-    
-    return orders
+    return fast_response(orders)
 
 
 # ============================================
 # INVENTORY ROUTES
 # ============================================
 
-# Default inventory data (seeded on first call)
+# Default inventory data (seeded at startup)
 DEFAULT_INVENTORY = [
     # Performance T-Shirt - Black (Unisex, XS-L)
     {"product_id": 1, "product_name": "Performance T-Shirt", "color": "Black", "size": "XS", "quantity": 15},
@@ -1526,31 +2575,249 @@ async def seed_inventory():
     """Seed inventory if empty"""
     count = await db.inventory.count_documents({})
     if count == 0:
-        for item in DEFAULT_INVENTORY:
-            item['reserved'] = 0
-            item['low_stock_threshold'] = 5
-            item['updated_at'] = datetime.now(timezone.utc).isoformat()
-            await db.inventory.insert_one(item)
+        now = datetime.now(timezone.utc)
+        await db.inventory.insert_many([
+            {**item, "reserved": 0, "low_stock_threshold": 5, "updated_at": now}
+            for item in DEFAULT_INVENTORY
+        ])
         logger.info(f"Seeded {len(DEFAULT_INVENTORY)} inventory items")
 
+# Inventory reads are served from an in-process snapshot indexed by product and by
+# variant. Writes through this worker refresh the touched variants immediately; other
+# workers' writes are picked up by the TTL reload or, when enabled, a change stream.
+INVENTORY_SNAPSHOT_TTL_SECONDS = float(os.environ.get('INVENTORY_SNAPSHOT_TTL_SECONDS', '10'))
+INVENTORY_CHANGE_STREAM = os.environ.get('INVENTORY_CHANGE_STREAM', 'false').lower() == 'true'
+
+inventory_snapshot = {
+    "variants": {},    # (product_id, color, size) -> entry
+    "by_product": {},  # product_id -> {(color, size): entry}
+    "loaded_at": None,
+}
+
+def inventory_key(item: dict) -> tuple:
+    """Variant key for an inventory document or cart item"""
+    return (item['product_id'], item['color'], item['size'])
+
+def inventory_entry(item: dict) -> dict:
+    """Snapshot entry for an inventory document, with availability precomputed"""
+    item = {k: v for k, v in item.items() if k != "_id"}
+    available = item['quantity'] - item.get('reserved', 0)
+    return {
+        "item": item,
+        "available": available,
+        "in_stock": available > 0,
+        "low_stock": available <= item.get('low_stock_threshold', 5)
+    }
+
+def apply_inventory_document(item: dict):
+    """Insert or replace one variant in the snapshot"""
+    entry = inventory_entry(item)
+    key = inventory_key(item)
+    inventory_snapshot["variants"][key] = entry
+    inventory_snapshot["by_product"].setdefault(key[0], {})[key[1:]] = entry
+
+def drop_inventory_variant(key: tuple):
+    """Remove one variant from the snapshot"""
+    inventory_snapshot["variants"].pop(key, None)
+    product = inventory_snapshot["by_product"].get(key[0])
+    if product is not None:
+        product.pop(key[1:], None)
+        if not product:
+            inventory_snapshot["by_product"].pop(key[0], None)
+
+async def load_inventory_snapshot():
+    """Rebuild the whole snapshot from Mongo"""
+    items = await db.inventory.find({}, {"_id": 0}).to_list(None)
+    variants = {}
+    by_product = {}
+    for item in items:
+        entry = inventory_entry(item)
+        key = inventory_key(item)
+        variants[key] = entry
+        by_product.setdefault(key[0], {})[key[1:]] = entry
+    inventory_snapshot.update(variants=variants, by_product=by_product, loaded_at=asyncio.get_running_loop().time())
+
+async def refresh_inventory_variants(keys):
+    """Re-read the given variants after a write and update the snapshot"""
+    keys = set(keys)
+    if not keys:
+        return
+    items = await db.inventory.find(
+        {"$or": [{"product_id": p, "color": c, "size": s} for p, c, s in keys]},
+        {"_id": 0}
+    ).to_list(None)
+    for item in items:
+        apply_inventory_document(item)
+    for key in keys - {inventory_key(item) for item in items}:
+        drop_inventory_variant(key)
+
+async def get_inventory_snapshot() -> dict:
+    """Current snapshot, reloaded once it is older than the TTL"""
+    loaded_at = inventory_snapshot["loaded_at"]
+    if loaded_at is None or asyncio.get_running_loop().time() - loaded_at > INVENTORY_SNAPSHOT_TTL_SECONDS:
+        await single_flight("inventory_snapshot", load_inventory_snapshot)
+    return inventory_snapshot
+
+async def inventory_change_stream_worker():
+    """Apply inventory changes from other workers as they happen (requires a replica set)"""
+    while True:
+        try:
+            async with db.inventory.watch(full_document="updateLookup") as stream:
+                await load_inventory_snapshot()
+                async for change in stream:
+                    document = change.get("fullDocument")
+                    if change["operationType"] in ("insert", "update", "replace") and document:
+                        apply_inventory_document(document)
+                    else:
+                        await load_inventory_snapshot()
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            logger.warning(f"Inventory change stream unavailable, relying on TTL reloads: {e}")
+            return
+        except Exception as e:
+            logger.error(f"Inventory change stream error: {str(e)}")
+            await asyncio.sleep(5)
+
+# Multi-variant writes go through one bulk_write instead of a round trip per line.
+INVENTORY_IMPORT_MAX_ROWS = 10000
+
+def variant_filter(key: tuple) -> dict:
+    """Query matching one inventory variant"""
+    return {"product_id": key[0], "color": key[1], "size": key[2]}
+
+async def bulk_update_variants(updates: List[tuple], ordered: bool = True, upsert: bool = False,
+                               lookup: bool = True, session=None, raise_on_error: bool = False) -> dict:
+    """Apply (variant key, update) pairs in a single bulk_write and report a result per item.
+    
+    Ordered writes stop at the first failure (later items are "skipped"); unordered
+    writes attempt every item. With lookup, items matching no variant are reported
+    as "not_found" (one extra read). The snapshot is refreshed unless a session is
+    passed, in which case the caller refreshes after the transaction. Inside a
+    transaction (session passed) a write error is raised instead, so the
+    transaction aborts rather than committing a partial write; raise_on_error
+    raises it without one too, for callers that can't act on a partial report.
+    """
+    summary = {"ordered": ordered, "matched": 0, "modified": 0, "upserted": 0, "failed": 0, "results": []}
+    if not updates:
+        return summary
+    
+    existing = None
+    if lookup and not upsert:
+        docs = await db.inventory.find(
+            {"$or": [variant_filter(key) for key, _ in updates]},
+            {"_id": 0, "product_id": 1, "color": 1, "size": 1},
+            session=session
+        ).to_list(None)
+        existing = {inventory_key(doc) for doc in docs}
+    
+    operations = [UpdateOne(variant_filter(key), update, upsert=upsert) for key, update in updates]
+    try:
+        result = await db.inventory.bulk_write(operations, ordered=ordered, session=session)
+        details = result.bulk_api_result
+    except BulkWriteError as e:
+        if session is None and raise_on_error:
+            # Nothing rolls back the items that did apply
+            logger.error(f"Inventory bulk write partly failed outside a transaction: {e.details.get('writeErrors')}")
+        if session is not None or raise_on_error:
+            raise
+        details = e.details
+    
+    write_errors = {error['index']: error.get('errmsg', 'write error') for error in details.get('writeErrors', [])}
+    upserted = {entry['index'] for entry in details.get('upserted', [])}
+    first_error = min(write_errors) if write_errors else None
+    
+    for index, (key, _) in enumerate(updates):
+        item = {"index": index, "product_id": key[0], "color": key[1], "size": key[2], "status": "updated"}
+        if index in write_errors:
+            item.update(status="error", error=write_errors[index])
+        elif ordered and first_error is not None and index > first_error:
+            item["status"] = "skipped"
+        elif index in upserted:
+            item["status"] = "inserted"
+        elif existing is not None and key not in existing:
+            item["status"] = "not_found"
+        summary["results"].append(item)
+    
+    summary.update(
+        matched=details.get('nMatched', 0),
+        modified=details.get('nModified', 0),
+        upserted=details.get('nUpserted', 0),
+        failed=sum(1 for item in summary["results"] if item["status"] in ("error", "skipped", "not_found"))
+    )
+    if session is None:
+        await refresh_inventory_variants(key for key, _ in updates)
+    return summary
+
+def parse_inventory_import(body: bytes, content_type: str) -> List[Dict]:
+    """Rows from a CSV (header: product_id,color,size,quantity[,product_name,low_stock_threshold]) or JSON body"""
+    text = body.decode("utf-8-sig").strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="Empty import body")
+    try:
+        if "json" in content_type or text[0] in "[{":
+            data = json.loads(text)
+            rows = data.get("items") if isinstance(data, dict) else data
+            if not isinstance(rows, list):
+                raise ValueError("expected a list of rows or {\"items\": [...]}")
+        else:
+            rows = list(csv.DictReader(io.StringIO(text)))
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse import: {e}")
+    if len(rows) > INVENTORY_IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"Import is limited to {INVENTORY_IMPORT_MAX_ROWS} rows")
+    return rows
+
+def inventory_import_update(row, mode: str, upsert: bool, now: str) -> tuple:
+    """Validate one import row and build its (variant key, update)"""
+    if not isinstance(row, dict):
+        raise ValueError("row must be an object")
+    try:
+        product_id = int(row['product_id'])
+        quantity = int(row['quantity'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("product_id and quantity must be integers")
+    color = str(row.get('color') or '').strip()
+    size = str(row.get('size') or '').strip()
+    if not color or not size:
+        raise ValueError("color and size are required")
+    if quantity < 0:
+        raise ValueError("quantity must not be negative")
+    
+    update = {"$set": {"updated_at": now}}
+    if mode == "add":
+        update["$inc"] = {"quantity": quantity}
+    else:
+        update["$set"]["quantity"] = quantity
+    
+    on_insert = {"reserved": 0, "low_stock_threshold": 5, "product_name": ""}
+    if row.get('product_name'):
+        update["$set"]["product_name"] = str(row['product_name'])
+        on_insert.pop("product_name")
+    if row.get('low_stock_threshold') not in (None, ''):
+        update["$set"]["low_stock_threshold"] = int(row['low_stock_threshold'])
+        on_insert.pop("low_stock_threshold")
+    if upsert:
+        update["$setOnInsert"] = on_insert
+    
+    return (product_id, color, size), update
+
 @api_router.get("/inventory")
 async def get_inventory():
     """Get all inventory items"""
-    await seed_inventory()
-    items = await db.inventory.find({}, {"_id": 0}).to_list(1000)
-    return items
+    snapshot = await get_inventory_snapshot()
+    return [entry["item"] for entry in snapshot["variants"].values()]
 
 @api_router.get("/inventory/stats")
 async def get_inventory_stats():
     """Get inventory statistics for admin dashboard"""
-    await seed_inventory()
+    snapshot = await get_inventory_snapshot()
+    entries = list(snapshot["variants"].values())
     
-    items = await db.inventory.find({}, {"_id": 0}).to_list(1000)
-    
-    total_items = sum(item['quantity'] for item in items)
-    total_reserved = sum(item.get('reserved', 0) for item in items)
-    low_stock_items = [item for item in items if item['quantity'] - item.get('reserved', 0) <= item.get('low_stock_threshold', 5)]
-    out_of_stock = [item for item in items if item['quantity'] - item.get('reserved', 0) <= 0]
+    total_items = sum(entry["item"]['quantity'] for entry in entries)
+    total_reserved = sum(entry["item"].get('reserved', 0) for entry in entries)
+    low_stock_items = [entry["item"] for entry in entries if entry["low_stock"]]
+    out_of_stock = [entry["item"] for entry in entries if not entry["in_stock"]]
     
     return {
         "total_items": total_items,
@@ -1565,21 +2832,15 @@ async def get_inventory_stats():
 @api_router.get("/inventory/{product_id}")
 async def get_product_inventory(product_id: int):
     """Get inventory for a specific product"""
-    await seed_inventory()
-    items = await db.inventory.find({"product_id": product_id}, {"_id": 0}).to_list(100)
+    snapshot = await get_inventory_snapshot()
     
     # Transform to nested format for frontend
     inventory = {}
-    for item in items:
-        color = item['color']
-        size = item['size']
-        available = item['quantity'] - item.get('reserved', 0)
-        if color not in inventory:
-            inventory[color] = {}
-        inventory[color][size] = {
-            "total": item['quantity'],
-            "available": available,
-            "low_stock": available <= item.get('low_stock_threshold', 5)
+    for (color, size), entry in snapshot["by_product"].get(product_id, {}).items():
+        inventory.setdefault(color, {})[size] = {
+            "total": entry["item"]['quantity'],
+            "available": entry["available"],
+            "low_stock": entry["low_stock"]
         }
     
     return inventory
@@ -1587,20 +2848,16 @@ async def get_product_inventory(product_id: int):
 @api_router.get("/inventory/check/{product_id}/{color}/{size}")
 async def check_stock(product_id: int, color: str, size: str):
     """Check stock for a specific variant"""
-    await seed_inventory()
-    item = await db.inventory.find_one(
-        {"product_id": product_id, "color": color, "size": size},
-        {"_id": 0}
-    )
+    snapshot = await get_inventory_snapshot()
+    entry = snapshot["variants"].get((product_id, color, size))
     
-    if not item:
+    if not entry:
         return {"in_stock": False, "available": 0, "low_stock": True}
     
-    available = item['quantity'] - item.get('reserved', 0)
     return {
-        "in_stock": available > 0,
-        "available": available,
-        "low_stock": available <= item.get('low_stock_threshold', 5)
+        "in_stock": entry["in_stock"],
+        "available": entry["available"],
+        "low_stock": entry["low_stock"]
     }
 
 @api_router.post("/inventory/update")
@@ -1608,85 +2865,697 @@ async def update_inventory(update: InventoryUpdate):
     """Update inventory for a specific variant (admin only)"""
     result = await db.inventory.update_one(
         {"product_id": update.product_id, "color": update.color, "size": update.size},
-        {"$set": {"quantity": update.quantity, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"quantity": update.quantity, "updated_at": datetime.now(timezone.utc)}}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Inventory item not found")
     
+    await refresh_inventory_variants([(update.product_id, update.color, update.size)])
+    
     return {"success": True, "message": "Inventory updated"}
 
 @api_router.post("/inventory/bulk-update")
-async def bulk_update_inventory(updates: InventoryBulkUpdate):
+async def bulk_update_inventory(updates: InventoryBulkUpdate, ordered: bool = False):
     """Bulk update inventory (admin only)"""
-    updated = 0
-    for update in updates.items:
-        result = await db.inventory.update_one(
-            {"product_id": update.product_id, "color": update.color, "size": update.size},
-            {"$set": {"quantity": update.quantity, "updated_at": datetime.now(timezone.utc).isoformat()}}
-        )
-        if result.matched_count > 0:
-            updated += 1
+    now = datetime.now(timezone.utc)
+    result = await bulk_update_variants(
+        [
+            ((u.product_id, u.color, u.size), {"$set": {"quantity": u.quantity, "updated_at": now}})
+            for u in updates.items
+        ],
+        ordered=ordered
+    )
     
-    return {"success": True, "updated": updated}
+    return {"success": result["failed"] == 0, "updated": result["matched"], "results": result["results"]}
 
-@api_router.post("/inventory/reserve")
-async def reserve_inventory(items: List[Dict]):
-    """Reserve inventory during checkout"""
-    reserved_items = []
+@api_router.post("/inventory/import")
+async def import_inventory(
+    request: Request,
+    mode: str = Query("set", pattern="^(set|add)$"),
+    ordered: bool = False,
+    upsert: bool = False
+):
+    """
+    Bulk restock from CSV or JSON (admin only).
+    mode=set overwrites quantities, mode=add increments them; upsert creates missing variants.
+    """
+    await verify_admin(request)
     
-    for item in items:
-        result = await db.inventory.find_one_and_update(
-            {
-                "product_id": item['product_id'],
-                "color": item['color'],
-                "size": item['size'],
-                "$expr": {"$gte": [{"$subtract": ["$quantity", "$reserved"]}, item['quantity']]}
-            },
-            {"$inc": {"reserved": item['quantity']}},
-            return_document=True
-        )
-        
-        if result:
-            reserved_items.append(item)
+    rows = parse_inventory_import(await request.body(), request.headers.get("content-type", ""))
+    now = datetime.now(timezone.utc)
+    
+    updates = []
+    row_indexes = []
+    results = []
+    invalid_at = None
+    for index, row in enumerate(rows):
+        if ordered and invalid_at is not None:
+            results.append({"index": index, "status": "skipped"})
+            continue
+        try:
+            updates.append(inventory_import_update(row, mode, upsert, now))
+            row_indexes.append(index)
+        except ValueError as e:
+            results.append({"index": index, "status": "invalid", "error": str(e)})
+            invalid_at = index if invalid_at is None else invalid_at
+    
+    summary = await bulk_update_variants(updates, ordered=ordered, upsert=upsert)
+    for item, index in zip(summary["results"], row_indexes):
+        item["index"] = index
+        results.append(item)
+    results.sort(key=lambda item: item["index"])
+    
+    failed = sum(1 for item in results if item["status"] in ("invalid", "error", "skipped", "not_found"))
+    return {
+        "success": failed == 0,
+        "mode": mode,
+        "ordered": ordered,
+        "rows": len(rows),
+        "matched": summary["matched"],
+        "modified": summary["modified"],
+        "upserted": summary["upserted"],
+        "failed": failed,
+        "results": results
+    }
+
+# ============================================
+# INVENTORY HOLDS
+# ============================================
+
+# Reservations are recorded in db.inventory_holds: one hold per owner (checkout
+# session) listing the variants it reserved, with a TTL. A sweeper expires stale
+# holds and returns their units, so abandoned checkouts don't drain stock. Variants
+# with no inventory document aren't stock-tracked: their lines are marked untracked
+# and never reserved, released or deducted.
+INVENTORY_HOLD_TTL_SECONDS = int(os.environ.get('INVENTORY_HOLD_TTL_SECONDS', str(30 * 60)))
+INVENTORY_HOLD_SWEEP_SECONDS = float(os.environ.get('INVENTORY_HOLD_SWEEP_SECONDS', '30'))
+
+inventory_transactions_supported: Optional[bool] = None
+
+async def run_inventory_write(operation):
+    """Run operation(session) in a transaction when the deployment supports them, otherwise without one"""
+    global inventory_transactions_supported
+    if inventory_transactions_supported is not False:
+        try:
+            async with await client.start_session() as session:
+                result = await session.with_transaction(operation)
+            inventory_transactions_supported = True
+            return result
+        except (OperationFailure, NotImplementedError) as e:
+            # IllegalOperation (20): standalone mongod, transactions need a replica set
+            if isinstance(e, OperationFailure) and e.code != 20:
+                raise
+            inventory_transactions_supported = False
+            logger.warning("MongoDB transactions unavailable, inventory holds fall back to compensating writes")
+    return await operation(None)
+
+def inventory_hold_lines(items: List[Dict]) -> List[Dict]:
+    """Merge cart lines per variant, sorted so concurrent holds touch variants in the same order"""
+    lines = {}
+    for item in items:
+        key = inventory_key(item)
+        quantity = int(item.get('quantity', 1))
+        if quantity <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be positive")
+        if key in lines:
+            lines[key]['quantity'] += quantity
         else:
-            # Rollback previous reservations
-            for reserved in reserved_items:
-                await db.inventory.update_one(
-                    {"product_id": reserved['product_id'], "color": reserved['color'], "size": reserved['size']},
-                    {"$inc": {"reserved": -reserved['quantity']}}
+            lines[key] = {
+                "product_id": key[0],
+                "color": key[1],
+                "size": key[2],
+                "product_name": item.get('product_name'),
+                "quantity": quantity
+            }
+    return [lines[key] for key in sorted(lines)]
+
+def stock_available_filter(key: tuple, quantity: int) -> dict:
+    """Query matching a variant with at least quantity units not reserved"""
+    return {
+        **variant_filter(key),
+        "$expr": {"$gte": [{"$subtract": ["$quantity", {"$ifNull": ["$reserved", 0]}]}, quantity]}
+    }
+
+def tracked_lines(lines: List[Dict]) -> List[Dict]:
+    """Hold lines whose variant has an inventory document"""
+    return [line for line in lines if not line.get('untracked')]
+
+async def acquire_inventory_hold(items: List[Dict], owner: Optional[str] = None, ttl_seconds: Optional[int] = None) -> dict:
+    """Reserve every line of a cart or none of them, recorded as one expiring hold"""
+    if DROP_MODE_ENABLED:
+        return await allocate_drop_hold(items, owner=owner, ttl_seconds=ttl_seconds)
+    
+    lines = inventory_hold_lines(items)
+    now = datetime.now(timezone.utc)
+    hold = {
+        "id": str(uuid.uuid4()),
+        "owner": owner,
+        "items": lines,
+        "acquired": 0,  # Lines reserved so far; only these are returned on release
+        "state": "active",
+        "expires_at": now + timedelta(seconds=ttl_seconds or INVENTORY_HOLD_TTL_SECONDS),
+        "created_at": now,
+        "updated_at": now
+    }
+    
+    async def acquire(session):
+        await db.inventory_holds.insert_one(dict(hold), session=session)
+        for index, line in enumerate(lines):
+            if line.get('untracked'):
+                # Seen on an earlier attempt of this transaction
+                await db.inventory_holds.update_one({"id": hold['id']}, {"$inc": {"acquired": 1}}, session=session)
+                continue
+            result = await db.inventory.update_one(
+                stock_available_filter(inventory_key(line), line['quantity']),
+                {"$inc": {"reserved": line['quantity']}},
+                session=session
+            )
+            if result.modified_count == 0 and not await db.inventory.find_one(
+                variant_filter(inventory_key(line)), {"_id": 1}, session=session
+            ):
+                line['untracked'] = True
+                await db.inventory_holds.update_one(
+                    {"id": hold['id']},
+                    {"$set": {f"items.{index}.untracked": True}, "$inc": {"acquired": 1}},
+                    session=session
+                )
+                continue
+            if result.modified_count == 0:
+                # Without a transaction nothing rolls back for us, so undo by hand
+                await bulk_update_variants(
+                    [(inventory_key(acquired), {"$inc": {"reserved": -acquired['quantity']}}) for acquired in tracked_lines(lines[:index])],
+                    ordered=False, lookup=False, session=session, raise_on_error=True
+                )
+                await db.inventory_holds.update_one(
+                    {"id": hold['id']},
+                    {"$set": {"state": "failed", "acquired": 0, "updated_at": datetime.now(timezone.utc)}},
+                    session=session
                 )
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Insufficient stock for {item.get('product_name', 'item')} ({item['color']}, {item['size']})"
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Insufficient stock for {line.get('product_name') or 'item'} ({line['color']}, {line['size']})"
+                )
+            await db.inventory_holds.update_one({"id": hold['id']}, {"$inc": {"acquired": 1}}, session=session)
+    
+    try:
+        await run_inventory_write(acquire)
+    finally:
+        await refresh_inventory_variants(inventory_key(line) for line in lines)
+    
+    hold['acquired'] = len(lines)
+    return hold
+
+async def release_inventory_hold(hold_filter: dict, state: str = "released") -> Optional[dict]:
+    """Move one active hold to released/expired and return its units to stock"""
+    async def release(session):
+        hold = await db.inventory_holds.find_one_and_update(
+            {**hold_filter, "state": "active"},
+            {"$set": {"state": state, "updated_at": datetime.now(timezone.utc)}},
+            {"_id": 0},
+            session=session
+        )
+        if not hold:
+            return None
+        await bulk_update_variants(
+            [(inventory_key(line), {"$inc": {"reserved": -line['quantity']}}) for line in tracked_lines(hold['items'][:hold.get('acquired', 0)])],
+            ordered=False, lookup=False, session=session, raise_on_error=True
+        )
+        return hold
+    
+    hold = await run_inventory_write(release)
+    if hold:
+        await refresh_inventory_variants(inventory_key(line) for line in hold['items'])
+    return hold
+
+async def commit_inventory_hold(hold_filter: dict, items: List[Dict]) -> dict:
+    """Convert an active hold into sold units. Lines it doesn't cover (e.g. it expired) are
+    deducted only from unreserved stock; lines that couldn't be are returned as oversold."""
+    async def commit(session):
+        now = datetime.now(timezone.utc)
+        hold = await db.inventory_holds.find_one_and_update(
+            {**hold_filter, "state": "active"},
+            {"$set": {"state": "committed", "updated_at": now}},
+            {"_id": 0},
+            session=session
+        )
+        if hold:
+            reserved_lines = tracked_lines(hold['items'][:hold.get('acquired', 0)])
+            unreserved_lines = tracked_lines(hold['items'][hold.get('acquired', 0):])
+        elif await db.inventory_holds.find_one({**hold_filter, "state": "committed"}, {"_id": 1}, session=session):
+            return None, [], []  # Committed already; deducting again would count the sale twice
+        else:
+            reserved_lines, unreserved_lines = [], inventory_hold_lines(items)
+        await bulk_update_variants(
+            [
+                (inventory_key(line), {"$inc": {"quantity": -line['quantity'], "reserved": -line['quantity']}, "$set": {"updated_at": now}})
+                for line in reserved_lines
+            ],
+            ordered=False, lookup=False, session=session, raise_on_error=True
+        )
+        # Never take units other checkouts are holding, and never go below zero
+        oversold = []
+        for line in unreserved_lines:
+            key = inventory_key(line)
+            result = await db.inventory.update_one(
+                stock_available_filter(key, line['quantity']),
+                {"$inc": {"quantity": -line['quantity']}, "$set": {"updated_at": now}},
+                session=session
             )
+            if result.modified_count == 0 and await db.inventory.find_one(variant_filter(key), {"_id": 1}, session=session):
+                oversold.append(line)
+        return hold, reserved_lines + unreserved_lines, oversold
+    
+    hold, lines, oversold = await run_inventory_write(commit)
+    await refresh_inventory_variants(inventory_key(line) for line in lines)
+    return {"hold": hold, "oversold": oversold}
+
+async def expire_inventory_holds() -> int:
+    """Expire every active hold past its TTL, one claim at a time so workers don't double-release"""
+    expired = 0
+    while await release_inventory_hold({"expires_at": {"$lte": datetime.now(timezone.utc)}}, state="expired"):
+        expired += 1
+    return expired
+
+async def inventory_hold_sweeper():
+    """Background loop returning units from expired holds"""
+    while True:
+        try:
+            expired = await expire_inventory_holds()
+            if expired:
+                logger.info(f"Expired {expired} inventory holds")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Inventory hold sweeper error: {str(e)}")
+        await asyncio.sleep(INVENTORY_HOLD_SWEEP_SECONDS)
+
+def hold_filter_for(hold_id: Optional[str], owner: Optional[str]) -> dict:
+    """Query selecting a hold by id or owner"""
+    if hold_id:
+        return {"id": hold_id}
+    if owner:
+        return {"owner": owner}
+    raise HTTPException(status_code=400, detail="hold_id or owner is required")
+
+@api_router.post("/inventory/reserve")
+async def reserve_inventory(items: List[Dict], owner: Optional[str] = None, ttl_seconds: Optional[int] = Query(None, ge=60, le=24 * 3600)):
+    """Reserve inventory during checkout"""
+    hold = await acquire_inventory_hold(items, owner=owner, ttl_seconds=ttl_seconds)
     
-    return {"success": True, "reserved": len(reserved_items)}
+    return {
+        "success": True,
+        "reserved": len(hold['items']),
+        "hold_id": hold['id'],
+        "expires_at": hold['expires_at'].isoformat()
+    }
 
 @api_router.post("/inventory/release")
-async def release_inventory(items: List[Dict]):
+async def release_inventory(hold_id: Optional[str] = None, owner: Optional[str] = None):
     """Release reserved inventory (e.g., checkout timeout/cancellation)"""
-    for item in items:
-        await db.inventory.update_one(
-            {"product_id": item['product_id'], "color": item['color'], "size": item['size']},
-            {"$inc": {"reserved": -item['quantity']}}
-        )
+    hold = await release_inventory_hold(hold_filter_for(hold_id, owner))
     
-    return {"success": True}
+    return {"success": True, "released": hold is not None}
 
 @api_router.post("/inventory/commit")
-async def commit_inventory(items: List[Dict]):
+async def commit_inventory(hold_id: Optional[str] = None, owner: Optional[str] = None, items: Optional[List[Dict]] = Body(None)):
     """Commit reserved inventory after successful payment"""
-    for item in items:
-        await db.inventory.update_one(
-            {"product_id": item['product_id'], "color": item['color'], "size": item['size']},
-            {
-                "$inc": {"quantity": -item['quantity'], "reserved": -item['quantity']},
-                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+    result = await commit_inventory_hold(hold_filter_for(hold_id, owner), items or [])
+    
+    return {
+        "success": True,
+        "committed": result['hold'] is not None,
+        "oversold": [{k: line[k] for k in ("product_id", "color", "size", "quantity")} for line in result['oversold']]
+    }
+
+
+# ============================================
+# DROP MODE
+# ============================================
+
+# During a drop every reservation for a hot variant would serialize on its single
+# inventory document. In drop mode each worker leases blocks of units (moving them
+# into `reserved` with one conditional update) into an in-memory pool per variant
+# and allocates from it without touching Mongo. Allocated holds are persisted by a
+# group commit: one insert_many for everything allocated in the last few ms.
+#
+# Accounting: inventory.reserved covers active holds plus units still pooled. A
+# lease's pooled units are leased - returned - allocated, so a stale worker's pool
+# can be handed back without trusting its memory. A flush adds to `allocated` with
+# an update conditional on the lease still being active, so it either lands before
+# reconciliation flips the lease or is refused - never counted on both sides. Every
+# two-step write is ordered so a crash in between leaks units (stay reserved)
+# rather than returning them twice, which keeps the allocator from overselling.
+DROP_MODE_ENABLED = os.environ.get('DROP_MODE_ENABLED', 'false').lower() == 'true'
+DROP_MODE_LEASE_UNITS = int(os.environ.get('DROP_MODE_LEASE_UNITS', '20'))
+DROP_MODE_FLUSH_SECONDS = float(os.environ.get('DROP_MODE_FLUSH_SECONDS', '0.005'))
+DROP_MODE_HEARTBEAT_SECONDS = 5
+DROP_MODE_LEASE_STALE_SECONDS = 30
+DROP_MODE_IDLE_RETURN_SECONDS = 60  # Idle pools go back to stock so other workers can sell them
+
+DROP_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+drop_pools: Dict[tuple, dict] = {}  # variant key -> {"lease_id", "available", "leased", "last_used"}
+drop_lease_locks: Dict[tuple, asyncio.Lock] = {}
+drop_pending_holds: List[tuple] = []  # (hold, future) waiting for the next group commit
+drop_flush_wakeup = asyncio.Event()
+drop_stats = {"allocated": 0, "rejected": 0, "leases": 0, "leased_units": 0, "flushes": 0, "returned_units": 0}
+
+def drop_pool(key: tuple) -> dict:
+    """This worker's token pool for a variant"""
+    pool = drop_pools.get(key)
+    if pool is None:
+        pool = drop_pools[key] = {
+            "lease_id": f"{DROP_WORKER_ID}:{uuid.uuid4().hex[:8]}",
+            "available": 0,
+            "leased": 0,
+            "last_used": asyncio.get_running_loop().time()
+        }
+    return pool
+
+async def lease_drop_units(key: tuple, wanted: int) -> bool:
+    """Move a block of available units for a variant into this worker's pool; False once stock is exhausted"""
+    lock = drop_lease_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        pool = drop_pool(key)
+        if pool["available"] >= wanted:
+            return True  # Topped up while we waited for the lock
+        units = max(DROP_MODE_LEASE_UNITS, wanted - pool["available"])
+        
+        for _ in range(3):
+            result = await db.inventory.update_one(
+                {
+                    **variant_filter(key),
+                    "$expr": {"$gte": [{"$subtract": ["$quantity", {"$ifNull": ["$reserved", 0]}]}, units]}
+                },
+                {"$inc": {"reserved": units}}
+            )
+            if result.modified_count:
+                break
+            # Not enough for a full block: take whatever is left
+            current = await db.inventory.find_one(variant_filter(key), {"_id": 0})
+            remaining = current['quantity'] - current.get('reserved', 0) if current else 0
+            if remaining <= 0:
+                return False
+            units = remaining
+        else:
+            return True  # Lost the race three times; stock may still be there
+        await refresh_inventory_variants([key])
+        
+        now = datetime.now(timezone.utc)
+        lease_update = {
+            "$inc": {"leased": units},
+            "$set": {"heartbeat_at": now},
+            "$setOnInsert": {
+                "worker_id": DROP_WORKER_ID,
+                "product_id": key[0],
+                "color": key[1],
+                "size": key[2],
+                "state": "active",
+                "returned": 0,
+                "allocated": 0,
+                "created_at": now
             }
+        }
+        try:
+            await db.drop_leases.update_one({"id": pool["lease_id"], "state": "active"}, lease_update, upsert=True)
+        except DuplicateKeyError:
+            # Our lease was reclaimed as stale; whatever the pool still counts is no longer ours
+            del drop_pools[key]
+            pool = drop_pool(key)
+            await db.drop_leases.update_one({"id": pool["lease_id"]}, lease_update, upsert=True)
+        pool["available"] += units
+        pool["leased"] += units
+        drop_stats["leases"] += 1
+        drop_stats["leased_units"] += units
+        return True
+
+async def allocate_drop_hold(items: List[Dict], owner: Optional[str] = None, ttl_seconds: Optional[int] = None) -> dict:
+    """Drop-mode acquire_inventory_hold: allocate from in-memory pools, persist via group commit"""
+    lines = inventory_hold_lines(items)
+    # Only variants missing from the snapshot cost a read to confirm they're untracked
+    unknown = [inventory_key(line) for line in lines if inventory_key(line) not in inventory_snapshot["variants"]]
+    if unknown:
+        docs = await db.inventory.find({"$or": [variant_filter(key) for key in unknown]}, {"_id": 0, "product_id": 1, "color": 1, "size": 1}).to_list(None)
+        untracked = set(unknown) - {inventory_key(doc) for doc in docs}
+        for line in lines:
+            if inventory_key(line) in untracked:
+                line['untracked'] = True
+    tracked = tracked_lines(lines)
+    keys = [inventory_key(line) for line in tracked]
+    
+    for attempt in range(50):
+        # Check and take every line with no await in between, so the cart is all-or-nothing
+        short = [(key, line['quantity']) for key, line in zip(keys, tracked) if drop_pool(key)["available"] < line['quantity']]
+        if not short:
+            loop_time = asyncio.get_running_loop().time()
+            for key, line in zip(keys, tracked):
+                pool = drop_pools[key]
+                pool["available"] -= line['quantity']
+                pool["last_used"] = loop_time
+                line['lease_id'] = pool["lease_id"]
+            break
+        # Other requests may drain a fresh lease before we get back here, so keep
+        # topping up until the variant itself runs out
+        more = await asyncio.gather(*(lease_drop_units(key, quantity) for key, quantity in short))
+        if not all(more):
+            break
+    if short:
+        drop_stats["rejected"] += 1
+        line = tracked[keys.index(short[0][0])]
+        raise HTTPException(
+            status_code=400,
+            detail=f"Insufficient stock for {line.get('product_name') or 'item'} ({line['color']}, {line['size']})"
         )
     
-    return {"success": True}
+    now = datetime.now(timezone.utc)
+    hold = {
+        "id": str(uuid.uuid4()),
+        "owner": owner,
+        "items": lines,
+        "acquired": len(lines),
+        "state": "active",
+        "expires_at": now + timedelta(seconds=ttl_seconds or INVENTORY_HOLD_TTL_SECONDS),
+        "created_at": now,
+        "updated_at": now
+    }
+    future = asyncio.get_running_loop().create_future()
+    drop_pending_holds.append((hold, future))
+    drop_flush_wakeup.set()
+    await future
+    drop_stats["allocated"] += 1
+    return hold
+
+async def allocate_from_drop_leases(lines: List[Dict]) -> set:
+    """Count the lines' units as allocated on their leases, each only while still active; returns the leases that took them"""
+    units: Dict[str, int] = {}
+    for line in lines:
+        units[line['lease_id']] = units.get(line['lease_id'], 0) + line['quantity']
+    lease_ids = list(units)
+    results = await asyncio.gather(*(
+        db.drop_leases.update_one({"id": lease_id, "state": "active"}, {"$inc": {"allocated": units[lease_id]}})
+        for lease_id in lease_ids
+    ))
+    return {lease_id for lease_id, result in zip(lease_ids, results) if result.matched_count}
+
+async def unallocate_drop_lines(lines: List[Dict]):
+    """Give units that never reached a stored hold back to their lease and pool"""
+    for line in lines:
+        result = await db.drop_leases.update_one(
+            {"id": line['lease_id'], "state": "active"}, {"$inc": {"allocated": -line['quantity']}}
+        )
+        pool = drop_pools.get(inventory_key(line))
+        # A lease reclaimed meanwhile counted them as held: leave them leaked rather than sell them twice
+        if result.matched_count and pool and pool["lease_id"] == line['lease_id']:
+            pool["available"] += line['quantity']
+
+async def flush_drop_holds():
+    """Persist every pending drop-mode hold with one insert_many"""
+    batch = drop_pending_holds[:]
+    drop_pending_holds.clear()
+    if not batch:
+        return
+    
+    # Holds drawn from a lease that was reclaimed meanwhile would be counted twice
+    active = await allocate_from_drop_leases([line for hold, _ in batch for line in tracked_lines(hold['items'])])
+    
+    accepted = []
+    for hold, future in batch:
+        lines = tracked_lines(hold['items'])
+        if all(line['lease_id'] in active for line in lines):
+            accepted.append((hold, future))
+            continue
+        await unallocate_drop_lines([line for line in lines if line['lease_id'] in active])
+        for line in lines:
+            pool = drop_pools.get(inventory_key(line))
+            if line['lease_id'] not in active and pool and pool["lease_id"] == line['lease_id']:
+                pool["available"] = 0
+        future.set_exception(HTTPException(status_code=409, detail="Reservation expired, please try again"))
+    if not accepted:
+        return
+    
+    failed = set()
+    try:
+        await db.inventory_holds.insert_many([dict(hold) for hold, _ in accepted], ordered=False)
+    except BulkWriteError as e:
+        failed = {error['index'] for error in e.details.get('writeErrors', [])}
+        logger.error(f"Drop-mode hold flush failed for {len(failed)} of {len(accepted)} holds")
+    except Exception as e:
+        failed = set(range(len(accepted)))
+        logger.error(f"Drop-mode hold flush failed: {str(e)}")
+    
+    drop_stats["flushes"] += 1
+    for index, (hold, future) in enumerate(accepted):
+        if index not in failed:
+            future.set_result(True)
+            continue
+        # Units were never handed out, so they go back to the pool they came from
+        await unallocate_drop_lines(tracked_lines(hold['items']))
+        future.set_exception(HTTPException(status_code=503, detail="Could not reserve stock, please try again"))
+
+async def drop_mode_flusher():
+    """Background loop batching allocations into group commits"""
+    while True:
+        await drop_flush_wakeup.wait()
+        await asyncio.sleep(DROP_MODE_FLUSH_SECONDS)  # Let a batch build up
+        drop_flush_wakeup.clear()
+        try:
+            await flush_drop_holds()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Drop-mode flusher error: {str(e)}")
+
+async def return_drop_units(key: tuple):
+    """Hand a pool's unallocated units back to stock"""
+    pool = drop_pools.get(key)
+    if not pool or pool["available"] <= 0:
+        return
+    units = pool["available"]
+    pool["available"] = 0
+    # Record the return before releasing the units: a crash in between leaks them instead of double-releasing
+    await db.drop_leases.update_one({"id": pool["lease_id"]}, {"$inc": {"returned": units}})
+    await db.inventory.update_one(variant_filter(key), {"$inc": {"reserved": -units}})
+    drop_stats["returned_units"] += units
+    await refresh_inventory_variants([key])
+
+async def reconcile_drop_leases() -> dict:
+    """Reclaim pooled units from leases whose worker stopped heartbeating"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=DROP_MODE_LEASE_STALE_SECONDS)
+    reclaimed = {"leases": 0, "units": 0}
+    while True:
+        lease = await db.drop_leases.find_one_and_update(
+            {"state": "active", "heartbeat_at": {"$lt": cutoff}},
+            {"$set": {"state": "reclaiming"}},
+            {"_id": 0}
+        )
+        if not lease:
+            break
+        held = await db.inventory_holds.aggregate([
+            {"$match": {"items.lease_id": lease['id']}},
+            {"$unwind": "$items"},
+            {"$match": {"items.lease_id": lease['id']}},
+            {"$group": {"_id": None, "units": {"$sum": "$items.quantity"}}}
+        ]).to_list(1)
+        # The lease's own counter is final once it left "active"; the stored holds
+        # cover leases from before it existed. The larger count can only leak units
+        allocated = max(lease.get('allocated', 0), held[0]['units'] if held else 0)
+        remaining = lease['leased'] - lease.get('returned', 0) - allocated
+        await db.drop_leases.update_one(
+            {"id": lease['id']},
+            {"$set": {"state": "closed"}, "$inc": {"returned": max(remaining, 0)}}
+        )
+        if remaining > 0:
+            key = (lease['product_id'], lease['color'], lease['size'])
+            await db.inventory.update_one(variant_filter(key), {"$inc": {"reserved": -remaining}})
+            await refresh_inventory_variants([key])
+            reclaimed["units"] += remaining
+        reclaimed["leases"] += 1
+    return reclaimed
+
+async def drop_mode_maintenance():
+    """Heartbeat this worker's leases, return idle pools and reclaim stale leases"""
+    while True:
+        try:
+            await db.drop_leases.update_many(
+                {"worker_id": DROP_WORKER_ID, "state": "active"},
+                {"$set": {"heartbeat_at": datetime.now(timezone.utc)}}
+            )
+            # Stop selling from pools whose lease another worker reclaimed while we were stalled
+            reclaimed_ids = set(await db.drop_leases.distinct("id", {"worker_id": DROP_WORKER_ID, "state": {"$ne": "active"}}))
+            for key, pool in list(drop_pools.items()):
+                if pool["lease_id"] in reclaimed_ids:
+                    del drop_pools[key]
+            idle_before = asyncio.get_running_loop().time() - DROP_MODE_IDLE_RETURN_SECONDS
+            for key, pool in list(drop_pools.items()):
+                if pool["available"] and pool["last_used"] < idle_before:
+                    await return_drop_units(key)
+            reclaimed = await reconcile_drop_leases()
+            if reclaimed["leases"]:
+                logger.info(f"Reclaimed {reclaimed['units']} units from {reclaimed['leases']} stale drop leases")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Drop-mode maintenance error: {str(e)}")
+        await asyncio.sleep(DROP_MODE_HEARTBEAT_SECONDS)
+
+async def reconcile_drop_leases_at_startup():
+    """Reclaim leases left by workers that died, also once drop mode has been switched off"""
+    try:
+        for attempt in range(2):
+            reclaimed = await reconcile_drop_leases()
+            if reclaimed["leases"]:
+                logger.info(f"Reclaimed {reclaimed['units']} units from {reclaimed['leases']} stale drop leases")
+            if attempt or not await db.drop_leases.count_documents({"state": "active"}):
+                break
+            # Leases from a worker that crashed just before this restart aren't stale yet
+            await asyncio.sleep(DROP_MODE_LEASE_STALE_SECONDS)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Drop lease reconciliation failed: {str(e)}")
+
+async def close_drop_pools():
+    """Persist pending holds and return every pool (graceful shutdown)"""
+    await flush_drop_holds()
+    for key in list(drop_pools):
+        await return_drop_units(key)
+    await db.drop_leases.update_many({"worker_id": DROP_WORKER_ID, "state": "active"}, {"$set": {"state": "closed"}})
+
+@api_router.get("/admin/drop-mode")
+async def get_drop_mode_status(request: Request):
+    """Drop-mode allocator state for this worker plus leases across workers"""
+    await verify_admin(request)
+    
+    leases = await db.drop_leases.aggregate([
+        {"$match": {"state": "active"}},
+        {"$group": {
+            "_id": "$worker_id",
+            "leases": {"$sum": 1},
+            "leased": {"$sum": "$leased"},
+            "returned": {"$sum": "$returned"},
+            "heartbeat_at": {"$max": "$heartbeat_at"}
+        }}
+    ]).to_list(None)
+    
+    return {
+        "enabled": DROP_MODE_ENABLED,
+        "worker_id": DROP_WORKER_ID,
+        "lease_units": DROP_MODE_LEASE_UNITS,
+        "stats": drop_stats,
+        "pending_holds": len(drop_pending_holds),
+        "pools": [
+            {"product_id": key[0], "color": key[1], "size": key[2], "available": pool["available"], "leased": pool["leased"]}
+            for key, pool in drop_pools.items()
+        ],
+        "active_leases": [{"worker_id": entry.pop("_id"), **entry} for entry in leases]
+    }
+
+@api_router.post("/admin/drop-mode/reconcile")
+async def reconcile_drop_mode(request: Request):
+    """Reclaim units held by leases of workers that stopped heartbeating"""
+    await verify_admin(request)
+    return {"success": True, **(await reconcile_drop_leases())}
 
 
 # ============================================
@@ -1697,43 +3566,107 @@ async def seed_promo_codes():
     """Seed default promo codes if none exist"""
     count = await db.promo_codes.count_documents({})
     if count == 0:
-        for code_data in DEFAULT_PROMO_CODES:
-            code_data['uses'] = 0
-            code_data['active'] = True
-            code_data['expires_at'] = None
-            code_data['created_at'] = datetime.now(timezone.utc).isoformat()
-            await db.promo_codes.insert_one(code_data)
+        now = datetime.now(timezone.utc)
+        await db.promo_codes.insert_many([
+            {**code_data, "uses": 0, "active": True, "expires_at": None, "created_at": now}
+            for code_data in DEFAULT_PROMO_CODES
+        ])
         logger.info(f"Seeded {len(DEFAULT_PROMO_CODES)} promo codes")
 
+# Promo codes are validated against an in-process index (code -> normalized entry).
+# Writes through this worker update it immediately; the whole index is reloaded once
+# it is older than PROMO_INDEX_RELOAD_SECONDS to pick up other workers' changes.
+# Codes not in the index are looked up in Mongo, and misses are remembered briefly
+# so mistyped codes don't hit the database on every keystroke.
+PROMO_INDEX_RELOAD_SECONDS = float(os.environ.get('PROMO_INDEX_RELOAD_SECONDS', '30'))
+PROMO_NEGATIVE_CACHE_SECONDS = 5
+
+promo_index: Dict[str, dict] = {}
+promo_index_state = {"loaded_at": None}
+promo_index_misses: TTLCache = TTLCache(maxsize=10000, ttl=PROMO_NEGATIVE_CACHE_SECONDS)
+
+def normalize_promo(doc: dict) -> dict:
+    """Index entry for a promo document, covering both field-name schemas (credit
+    redemptions write is_active/current_uses/min_order_value) and parsing expires_at once"""
+    expires_at = as_utc(doc.get('expires_at'))
+    return {
+        "code": doc['code'],
+        "discount_type": doc.get('discount_type', 'percentage'),
+        "discount_value": doc['discount_value'],
+        "min_order": doc.get('min_order', doc.get('min_order_value', 0)) or 0,
+        "max_uses": doc.get('max_uses'),
+        "uses": doc.get('uses', doc.get('current_uses', 0)) or 0,
+        "active": doc.get('active', doc.get('is_active', True)),
+        "expires_at": expires_at,
+        "usage_shards": doc.get('usage_shards') or 0
+    }
+
+def index_promo(doc: dict):
+    """Add or replace one code in the index"""
+    entry = normalize_promo(doc)
+    promo_index[entry['code']] = entry
+    promo_index_misses.pop(entry['code'], None)
+
+async def load_promo_index():
+    """Rebuild the index from Mongo"""
+    docs = await db.promo_codes.find({}, {"_id": 0}).to_list(None)
+    fresh = {}
+    for doc in docs:
+        entry = normalize_promo(doc)
+        fresh[entry['code']] = entry
+    promo_index.clear()
+    promo_index.update(fresh)
+    promo_index_misses.clear()
+    promo_index_state["loaded_at"] = asyncio.get_running_loop().time()
+
+async def refresh_promo(code: str) -> Optional[dict]:
+    """Re-read one code after a write and update the index"""
+    doc = await db.promo_codes.find_one({"code": code}, {"_id": 0})
+    if doc:
+        index_promo(doc)
+        return promo_index[code]
+    promo_index.pop(code, None)
+    return None
+
+async def get_promo(code: str) -> Optional[dict]:
+    """Index entry for a code (None if it doesn't exist)"""
+    loaded_at = promo_index_state["loaded_at"]
+    if loaded_at is None or asyncio.get_running_loop().time() - loaded_at > PROMO_INDEX_RELOAD_SECONDS:
+        await single_flight("promo_index", load_promo_index)
+    
+    entry = promo_index.get(code)
+    if entry or code in promo_index_misses:
+        return entry
+    
+    # Created by another worker since the last reload?
+    entry = await refresh_promo(code)
+    if entry is None:
+        promo_index_misses[code] = True
+    return entry
+
 @api_router.post("/promo/validate")
 async def validate_promo_code(data: PromoCodeValidate):
     """Validate a promo code and return discount info"""
-    await seed_promo_codes()
-    
     code = data.code.upper().strip()
     
-    promo = await db.promo_codes.find_one({"code": code}, {"_id": 0})
+    promo = await get_promo(code)
     
     if not promo:
         raise HTTPException(status_code=400, detail="Invalid promo code")
     
-    if not promo.get('active', True):
+    if not promo['active']:
         raise HTTPException(status_code=400, detail="This promo code is no longer active")
     
     # Check expiry
-    if promo.get('expires_at'):
-        expires = promo['expires_at']
-        if isinstance(expires, str):
-            expires = datetime.fromisoformat(expires)
-        if expires < datetime.now(timezone.utc):
-            raise HTTPException(status_code=400, detail="This promo code has expired")
+    if promo['expires_at'] and promo['expires_at'] < datetime.now(timezone.utc):
+        raise HTTPException(status_code=400, detail="This promo code has expired")
     
     # Check max uses
-    if promo.get('max_uses') and promo.get('uses', 0) >= promo['max_uses']:
+    if promo['max_uses'] is not None and promo['uses'] >= promo['max_uses']:
         raise HTTPException(status_code=400, detail="This promo code has reached its usage limit")
     
     # Check minimum order
-    if data.subtotal < promo.get('min_order', 0):
+    if data.subtotal < promo['min_order']:
         raise HTTPException(
             status_code=400, 
             detail=f"Minimum order of ${promo['min_order']:.2f} required for this code"
@@ -1754,25 +3687,176 @@ async def validate_promo_code(data: PromoCodeValidate):
         "discount_value": promo['discount_value'],
         "discount_amount": round(discount_amount, 2),
         "discount_display": discount_display,
-        "min_order": promo.get('min_order', 0)
+        "min_order": promo['min_order']
     }
 
-@api_router.post("/promo/use")
-async def use_promo_code(data: PromoCodeValidate):
-    """Mark a promo code as used (increment usage counter)"""
-    code = data.code.upper().strip()
+# Usage is consumed with a conditional $inc, so max_uses holds exactly however many
+# checkouts race for the last use. Codes with usage_shards > 1 count on that many
+# promo_usage_shards documents instead, each capped at its share of the remaining
+# uses; consumers start at a random shard so a viral code doesn't serialize on one
+# document. A background roll-up folds shard totals back into promo_codes.uses.
+PROMO_USAGE_ROLLUP_SECONDS = float(os.environ.get('PROMO_USAGE_ROLLUP_SECONDS', '10'))
+PROMO_MAX_USAGE_SHARDS = 64
+
+def promo_under_limit(uses_field: str, cap_field: str) -> dict:
+    """Filter matching documents whose counter is still below its cap (or uncapped)"""
+    return {"$or": [
+        {cap_field: None},
+        {"$expr": {"$lt": [{"$ifNull": [f"${uses_field}", 0]}, f"${cap_field}"]}}
+    ]}
+
+async def consume_promo_use(code: str, usage_shards: int) -> Optional[int]:
+    """Count one use if the code is under its limit. Returns the shard counted on
+    (-1 for the code document itself), or None when no use is left."""
+    if not usage_shards:
+        result = await db.promo_codes.update_one(
+            {"code": code, "usage_shards": {"$in": [None, 0]}, **promo_under_limit("uses", "max_uses")},
+            {"$inc": {"uses": 1}}
+        )
+        if result.modified_count:
+            return -1
+        # Sharded by another worker since our index was loaded?
+        promo = await db.promo_codes.find_one({"code": code}, {"_id": 0, "usage_shards": 1})
+        usage_shards = (promo or {}).get("usage_shards") or 0
+        if not usage_shards:
+            return None
+    
+    start = random.randrange(usage_shards)
+    for offset in range(usage_shards):
+        shard = (start + offset) % usage_shards
+        result = await db.promo_usage_shards.update_one(
+            {"code": code, "shard": shard, **promo_under_limit("uses", "cap")},
+            {"$inc": {"uses": 1}}
+        )
+        if result.modified_count:
+            return shard
+    return None
+
+def split_promo_caps(remaining: Optional[int], shards: int) -> List[Optional[int]]:
+    """Per-shard caps summing exactly to the remaining uses (None = unlimited)"""
+    if remaining is None:
+        return [None] * shards
+    base, extra = divmod(max(remaining, 0), shards)
+    return [base + (1 if shard < extra else 0) for shard in range(shards)]
+
+async def shard_promo_usage(code: str, shards: int):
+    """Move a code's usage counting onto shard counters"""
+    for _ in range(10):
+        promo = await db.promo_codes.find_one({"code": code}, {"_id": 0})
+        if not promo:
+            raise HTTPException(status_code=404, detail="Promo code not found")
+        if promo.get('usage_shards'):
+            raise HTTPException(status_code=400, detail="Promo code usage is already sharded")
+        
+        uses = promo.get('uses', promo.get('current_uses', 0)) or 0
+        remaining = promo['max_uses'] - uses if promo.get('max_uses') is not None else None
+        await db.promo_usage_shards.delete_many({"code": code})
+        await db.promo_usage_shards.insert_many([
+            {"code": code, "shard": shard, "uses": 0, "cap": cap}
+            for shard, cap in enumerate(split_promo_caps(remaining, shards))
+        ])
+        
+        # Only flip if nobody consumed a use since we read it, so caps stay exact
+        result = await db.promo_codes.update_one(
+            {"code": code, "usage_shards": {"$in": [None, 0]}, "uses": promo.get('uses')},
+            {"$set": {"usage_shards": shards, "uses": uses, "base_uses": uses}}
+        )
+        if result.modified_count:
+            await refresh_promo(code)
+            return
+    raise HTTPException(status_code=409, detail="Promo code is too busy to reshard, try again")
+
+async def promo_shard_totals(codes: Optional[List[str]] = None) -> Dict[str, int]:
+    """Uses counted on shard counters, per code"""
+    pipeline = [{"$match": {"code": {"$in": codes}}}] if codes else []
+    pipeline.append({"$group": {"_id": "$code", "uses": {"$sum": "$uses"}}})
+    totals = await db.promo_usage_shards.aggregate(pipeline).to_list(None)
+    return {total["_id"]: total["uses"] for total in totals}
+
+async def rollup_promo_usage() -> int:
+    """Fold shard counters into promo_codes.uses. Returns the number of codes updated."""
+    updated = 0
+    for code, shard_uses in (await promo_shard_totals()).items():
+        promo = await db.promo_codes.find_one({"code": code, "usage_shards": {"$gt": 0}}, {"_id": 0})
+        if not promo:
+            continue
+        uses = (promo.get('base_uses') or 0) + shard_uses
+        if promo.get('uses') != uses:
+            # Sharded codes are never $inc'd directly, so a plain $set can't lose uses
+            await db.promo_codes.update_one({"code": code}, {"$set": {"uses": uses}})
+            await refresh_promo(code)
+            updated += 1
+    return updated
+
+async def promo_usage_rollup_worker():
+    """Background loop rolling up sharded promo usage"""
+    while True:
+        try:
+            await rollup_promo_usage()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Promo usage roll-up error: {str(e)}")
+        await asyncio.sleep(PROMO_USAGE_ROLLUP_SECONDS)
+
+async def redeem_promo_code(code: str, email: Optional[str] = None, subtotal: float = 0,
+                            reference: Optional[str] = None) -> dict:
+    """Consume one use of a promo code and log the redemption. Returns the
+    redemption record, which return_promo_use takes to undo it."""
+    code = code.upper().strip()
+    
+    promo = await get_promo(code)
+    if not promo or not promo['active']:
+        raise HTTPException(status_code=400, detail="Invalid promo code")
+    if promo['expires_at'] and promo['expires_at'] < datetime.now(timezone.utc):
+        raise HTTPException(status_code=400, detail="This promo code has expired")
     
-    result = await db.promo_codes.update_one(
-        {"code": code},
-        {"$inc": {"uses": 1}}
-    )
+    shard = await consume_promo_use(code, promo['usage_shards'])
+    if shard is None:
+        raise HTTPException(status_code=400, detail="This promo code has reached its usage limit")
+    promo['uses'] += 1
     
-    return {"success": result.modified_count > 0}
+    redemption = {
+        "id": str(uuid.uuid4()),
+        "code": code,
+        "email": email.lower() if email else None,
+        "reference": reference,
+        "subtotal": subtotal,
+        "shard": shard,
+        "created_at": datetime.now(timezone.utc)
+    }
+    try:
+        await db.promo_redemptions.insert_one(dict(redemption))
+    except Exception as e:
+        # The use is already counted; a missing log line shouldn't fail the checkout
+        logger.error(f"Failed to log redemption of {code}: {str(e)}")
+    
+    return redemption
+
+async def return_promo_use(redemption: dict):
+    """Give back a use whose checkout never reached payment and drop its log line"""
+    code, shard = redemption['code'], redemption['shard']
+    if shard >= 0:
+        await db.promo_usage_shards.update_one({"code": code, "shard": shard, "uses": {"$gt": 0}}, {"$inc": {"uses": -1}})
+    else:
+        result = await db.promo_codes.update_one(
+            {"code": code, "usage_shards": {"$in": [None, 0]}, "uses": {"$gt": 0}}, {"$inc": {"uses": -1}}
+        )
+        if not result.modified_count:
+            # Sharded since: the use was carried over into base_uses
+            await db.promo_codes.update_one({"code": code, "base_uses": {"$gt": 0}}, {"$inc": {"base_uses": -1, "uses": -1}})
+    await db.promo_redemptions.delete_one({"id": redemption['id']})
+    await refresh_promo(code)
+
+@api_router.post("/promo/use")
+async def use_promo_code(data: PromoCodeUse):
+    """Consume one use of a promo code and log the redemption"""
+    await redeem_promo_code(data.code, email=data.email, subtotal=data.subtotal, reference=data.reference)
+    return {"success": True}
 
 @api_router.get("/promo/list")
 async def list_promo_codes():
     """List all promo codes (admin)"""
-    await seed_promo_codes()
     codes = await db.promo_codes.find({}, {"_id": 0}).to_list(100)
     return codes
 
@@ -1786,6 +3870,11 @@ async def create_promo_code(data: PromoCodeCreate):
     if existing:
         raise HTTPException(status_code=400, detail="Promo code already exists")
     
+    try:
+        expires_at = as_utc(data.expires_at)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="expires_at must be an ISO 8601 date")
+    
     promo = {
         "code": code,
         "discount_type": data.discount_type,
@@ -1794,17 +3883,30 @@ async def create_promo_code(data: PromoCodeCreate):
         "max_uses": data.max_uses,
         "uses": 0,
         "active": True,
-        "expires_at": data.expires_at,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "expires_at": expires_at,
+        "created_at": datetime.now(timezone.utc)
     }
     
     await db.promo_codes.insert_one(promo)
+    index_promo(promo)
+    
+    if data.usage_shards > 1:
+        await shard_promo_usage(code, data.usage_shards)
     
     return {"success": True, "code": code}
 
 @api_router.patch("/promo/{code}")
-async def update_promo_code(code: str, active: Optional[bool] = None):
-    """Enable/disable a promo code (admin)"""
+async def update_promo_code(
+    code: str,
+    active: Optional[bool] = None,
+    usage_shards: Optional[int] = Query(None, ge=2, le=PROMO_MAX_USAGE_SHARDS)
+):
+    """Enable/disable a promo code, or shard its usage counter (admin)"""
+    if usage_shards is not None:
+        await shard_promo_usage(code.upper(), usage_shards)
+        if active is None:
+            return {"success": True}
+    
     update_data = {}
     if active is not None:
         update_data['active'] = active
@@ -1816,6 +3918,7 @@ async def update_promo_code(code: str, active: Optional[bool] = None):
         {"code": code.upper()},
         {"$set": update_data}
     )
+    await refresh_promo(code.upper())
     
     return {"success": result.modified_count > 0}
 
@@ -1823,6 +3926,8 @@ async def update_promo_code(code: str, active: Optional[bool] = None):
 async def delete_promo_code(code: str):
     """Delete a promo code (admin)"""
     result = await db.promo_codes.delete_one({"code": code.upper()})
+    promo_index.pop(code.upper(), None)
+    await db.promo_usage_shards.delete_many({"code": code.upper()})
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Promo code not found")
@@ -1830,6 +3935,138 @@ async def delete_promo_code(code: str):
     return {"success": True, "message": f"Promo code {code.upper()} deleted"}
 
 
+# ============================================
+# ORDER ROLLUPS
+# ============================================
+
+# orders_rollup holds one document per (creation day, current status) with order,
+# revenue and item-unit totals. Order writes $inc the affected buckets, so stats read
+# O(days) documents instead of scanning orders. If a process dies between an order
+# write and its rollup update the totals drift; `python manage.py rebuild-orders-rollup`
+# (or POST /admin/orders/rollup/rebuild) recomputes them from the orders collection.
+ORDER_STATUSES = ["pending", "confirmed", "processing", "shipped", "delivered", "cancelled"]
+
+def order_rollup_day(created_at) -> str:
+    """UTC day bucket (YYYY-MM-DD) for an order's created_at"""
+    return as_utc(created_at).strftime("%Y-%m-%d")
+
+def order_rollup_delta(order: dict, sign: int) -> dict:
+    """$inc adding (sign=1) or removing (sign=-1) one order from its bucket"""
+    return {
+        "orders": sign,
+        "revenue": sign * float(order.get('total', 0) or 0),
+        "item_units": sign * sum(int(item.get('quantity', 0) or 0) for item in order.get('items', []))
+    }
+
+async def record_order_rollup(order: dict, old_status: Optional[str], new_status: Optional[str]):
+    """Move an order between status buckets (None = created / removed)"""
+    if old_status == new_status:
+        return
+    day = order_rollup_day(order['created_at'])
+    now = datetime.now(timezone.utc)
+    operations = []
+    for status, sign in ((old_status, -1), (new_status, 1)):
+        if status is None:
+            continue
+        operations.append(UpdateOne(
+            {"_id": f"{day}|{status}"},
+            {"$inc": order_rollup_delta(order, sign), "$set": {"day": day, "status": status, "updated_at": now}},
+            upsert=True
+        ))
+    try:
+        await db.orders_rollup.bulk_write(operations, ordered=False)
+    except Exception as e:
+        # The order write already happened; a rebuild repairs the drift
+        logger.error(f"Failed to update orders rollup for {order.get('id')}: {str(e)}")
+
+async def rebuild_orders_rollup() -> int:
+    """Recompute orders_rollup from the orders collection. Returns the bucket count.
+    Buckets are replaced in place and stale ones deleted afterwards, so readers never
+    see an empty rollup and concurrent rebuilds converge. Orders written while this
+    runs may be counted twice or not at all, so run it when order traffic is quiet."""
+    buckets: Dict[str, dict] = {}
+    cursor = db.orders.find({}, {"_id": 0, "created_at": 1, "status": 1, "total": 1, "items.quantity": 1})
+    async for order in cursor:
+        day = order_rollup_day(order['created_at'])
+        status = order.get('status', 'pending')
+        bucket = buckets.setdefault(f"{day}|{status}", {
+            "_id": f"{day}|{status}", "day": day, "status": status,
+            "orders": 0, "revenue": 0.0, "item_units": 0
+        })
+        for field, value in order_rollup_delta(order, 1).items():
+            bucket[field] += value
+    
+    now = datetime.now(timezone.utc)
+    if buckets:
+        await db.orders_rollup.bulk_write([
+            ReplaceOne({"_id": bucket_id}, {**bucket, "updated_at": now}, upsert=True)
+            for bucket_id, bucket in buckets.items()
+        ], ordered=False)
+    await db.orders_rollup.delete_many({"_id": {"$nin": list(buckets)}})
+    logger.info(f"Rebuilt orders rollup: {len(buckets)} day/status buckets")
+    return len(buckets)
+
+ORDERS_ROLLUP_BACKFILL = "orders_rollup_backfill"
+ORDERS_ROLLUP_BACKFILL_LEASE_SECONDS = 600
+
+async def backfill_orders_rollup() -> bool:
+    """First start after upgrading: one worker rebuilds the rollup from existing orders,
+    claimed in schema_migrations (a crashed worker's claim lapses after the lease)"""
+    if await db.orders_rollup.find_one({}) or not await db.orders.find_one({}):
+        return False
+    now = datetime.now(timezone.utc)
+    try:
+        await db.schema_migrations.update_one(
+            {"_id": ORDERS_ROLLUP_BACKFILL, "state": "running", "claimed_until": {"$lt": now}},
+            {"$set": {"state": "running", "claimed_until": now + timedelta(seconds=ORDERS_ROLLUP_BACKFILL_LEASE_SECONDS)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False  # Done already, or another worker is on it
+    
+    buckets = await rebuild_orders_rollup()
+    await db.schema_migrations.update_one(
+        {"_id": ORDERS_ROLLUP_BACKFILL},
+        {"$set": {"state": "completed", "buckets": buckets, "completed_at": datetime.now(timezone.utc)}}
+    )
+    return True
+
+def summarize_order_buckets(buckets: List[dict]) -> dict:
+    """Totals for a set of rollup buckets; revenue and AOV exclude cancelled orders"""
+    by_status = {status: 0 for status in ORDER_STATUSES}
+    orders = revenue = item_units = paid_orders = 0
+    for bucket in buckets:
+        by_status[bucket['status']] = by_status.get(bucket['status'], 0) + bucket['orders']
+        orders += bucket['orders']
+        if bucket['status'] != "cancelled":
+            paid_orders += bucket['orders']
+            revenue += bucket['revenue']
+            item_units += bucket['item_units']
+    return {
+        "orders": orders,
+        "by_status": by_status,
+        "revenue": round(revenue, 2),
+        "aov": round(revenue / paid_orders, 2) if paid_orders else 0,
+        "item_units": item_units
+    }
+
+async def order_rollup_series(start_day: Optional[str] = None, end_day: Optional[str] = None) -> List[dict]:
+    """Per-day totals between two days (inclusive), oldest first"""
+    query = {}
+    if start_day or end_day:
+        query["day"] = {}
+        if start_day:
+            query["day"]["$gte"] = start_day
+        if end_day:
+            query["day"]["$lte"] = end_day
+    buckets = await db.orders_rollup.find(query).sort("day", ASCENDING).to_list(None)
+    
+    days: Dict[str, List[dict]] = {}
+    for bucket in buckets:
+        days.setdefault(bucket['day'], []).append(bucket)
+    return [{"day": day, **summarize_order_buckets(day_buckets)} for day, day_buckets in days.items()]
+
+
 # ============================================
 # ORDER ROUTES
 # ============================================
@@ -1907,13 +4144,12 @@ async def create_order(input: OrderCreate):
     )
     
     doc = order.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
     # Convert nested models to dicts
     doc['items'] = [item.model_dump() if hasattr(item, 'model_dump') else item for item in doc['items']]
     doc['shipping'] = doc['shipping'].model_dump() if hasattr(doc['shipping'], 'model_dump') else doc['shipping']
     
     await db.orders.insert_one(doc)
+    await record_order_rollup(doc, None, doc['status'])
     
     return OrderResponse(
         success=True,
@@ -1924,6 +4160,7 @@ async def create_order(input: OrderCreate):
 
 @api_router.get("/orders", response_model=List[Order])
 async def get_orders(
+    request: Request,
     status: Optional[str] = None,
     email: Optional[str] = None,
     limit: int = 100,
@@ -1939,47 +4176,30 @@ async def get_orders(
     if email:
         query["shipping.email"] = email.lower()
     
-    orders = await db.orders.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    
-    for order in orders:
-        if isinstance(order.get('created_at'), str):
-            order['created_at'] = datetime.fromisoformat(order['created_at'])
-        if isinstance(order.get('updated_at'), str):
-            order['updated_at'] = datetime.fromisoformat(order['updated_at'])
-    
-    return orders
+    orders = await db.orders.find(query, model_projection(Order)).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    return fast_response(orders, request)
 
 @api_router.get("/orders/stats")
-async def get_order_stats():
+async def get_order_stats(days: Optional[int] = Query(None, ge=1, le=366)):
     """
-    Get order statistics.
+    Get order statistics from the daily rollups.
+    Pass days=N to also get a per-day series for the last N days.
     """
-    total = await db.orders.count_documents({})
-    pending = await db.orders.count_documents({"status": "pending"})
-    confirmed = await db.orders.count_documents({"status": "confirmed"})
-    processing = await db.orders.count_documents({"status": "processing"})
-    shipped = await db.orders.count_documents({"status": "shipped"})
-    delivered = await db.orders.count_documents({"status": "delivered"})
-    cancelled = await db.orders.count_documents({"status": "cancelled"})
-    
-    # Calculate revenue
-    pipeline = [
-        {"$match": {"status": {"$nin": ["cancelled"]}}},
-        {"$group": {"_id": None, "total_revenue": {"$sum": "$total"}}}
-    ]
-    revenue_result = await db.orders.aggregate(pipeline).to_list(1)
-    total_revenue = revenue_result[0]["total_revenue"] if revenue_result else 0
-    
-    return {
-        "total_orders": total,
-        "pending": pending,
-        "confirmed": confirmed,
-        "processing": processing,
-        "shipped": shipped,
-        "delivered": delivered,
-        "cancelled": cancelled,
-        "total_revenue": round(total_revenue, 2)
+    totals = summarize_order_buckets(await db.orders_rollup.find({}).to_list(None))
+    
+    stats = {
+        "total_orders": totals["orders"],
+        **totals["by_status"],
+        "total_revenue": totals["revenue"],
+        "aov": totals["aov"],
+        "item_units": totals["item_units"]
     }
+    
+    if days:
+        start_day = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        stats["series"] = await order_rollup_series(start_day)
+    
+    return stats
 
 @api_router.get("/orders/{order_id}", response_model=Order)
 async def get_order(order_id: str):
@@ -1987,21 +4207,16 @@ async def get_order(order_id: str):
     Get a specific order by ID or order number.
     """
     # Try by ID first
-    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    order = await db.orders.find_one({"id": order_id}, model_projection(Order))
     
     # If not found, try by order_number
     if not order:
-        order = await db.orders.find_one({"order_number": order_id}, {"_id": 0})
+        order = await db.orders.find_one({"order_number": order_id}, model_projection(Order))
     
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    if isinstance(order.get('created_at'), str):
-        order['created_at'] = datetime.fromisoformat(order['created_at'])
-    if isinstance(order.get('updated_at'), str):
-        order['updated_at'] = datetime.fromisoformat(order['updated_at'])
-    
-    return order
+    return fast_response(order)
 
 @api_router.patch("/orders/{order_id}", response_model=OrderResponse)
 async def update_order(order_id: str, update: OrderUpdate):
@@ -2018,19 +4233,18 @@ async def update_order(order_id: str, update: OrderUpdate):
         raise HTTPException(status_code=404, detail="Order not found")
     
     # Build update
-    update_data = {"updated_at": datetime.now(timezone.utc).isoformat()}
+    update_data = {"updated_at": datetime.now(timezone.utc)}
     
     if update.status:
-        valid_statuses = ["pending", "confirmed", "processing", "shipped", "delivered", "cancelled"]
-        if update.status not in valid_statuses:
-            raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {valid_statuses}")
+        if update.status not in ORDER_STATUSES:
+            raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {ORDER_STATUSES}")
         update_data["status"] = update.status
         
         # Add timestamp for status changes
         if update.status == "shipped" and not order.get("shipped_at"):
-            update_data["shipped_at"] = datetime.now(timezone.utc).isoformat()
+            update_data["shipped_at"] = datetime.now(timezone.utc)
         elif update.status == "delivered" and not order.get("delivered_at"):
-            update_data["delivered_at"] = datetime.now(timezone.utc).isoformat()
+            update_data["delivered_at"] = datetime.now(timezone.utc)
             
             # Award RAZE credits when order is delivered
             # $1 spent = 1 credit (based on order total, rounded down)
@@ -2053,6 +4267,7 @@ async def update_order(order_id: str, update: OrderUpdate):
                                 "$set": {"updated_at": datetime.now(timezone.utc)}
                             }
                         )
+                        invalidate_session_cache(email=customer_email)
                         update_data["credits_awarded"] = credits_to_award
                         print(f"Awarded {credits_to_award} RAZE credits to {customer_email}")
     
@@ -2069,18 +4284,17 @@ async def update_order(order_id: str, update: OrderUpdate):
     if "estimated_delivery" in body:
         update_data["estimated_delivery"] = body["estimated_delivery"]
     
-    # Update in database
-    await db.orders.update_one(
+    # Update in database; the pre-update document tells us which transition actually happened
+    previous = await db.orders.find_one_and_update(
         {"id": order["id"]},
-        {"$set": update_data}
+        {"$set": update_data},
+        projection={"_id": 0, "status": 1, "created_at": 1, "total": 1, "items": 1}
     )
+    if previous and "status" in update_data:
+        await record_order_rollup(previous, previous.get('status'), update_data["status"])
     
     # Get updated order
     updated_order = await db.orders.find_one({"id": order["id"]}, {"_id": 0})
-    if isinstance(updated_order.get('created_at'), str):
-        updated_order['created_at'] = datetime.fromisoformat(updated_order['created_at'])
-    if isinstance(updated_order.get('updated_at'), str):
-        updated_order['updated_at'] = datetime.fromisoformat(updated_order['updated_at'])
     
     return OrderResponse(
         success=True,
@@ -2099,20 +4313,13 @@ async def create_checkout_session(checkout_data: CheckoutRequest, request: Reque
     """
     Create a Stripe checkout session.
     """
-    stripe_api_key = os.environ.get("STRIPE_API_KEY")
-    if not stripe_api_key:
-        raise HTTPException(status_code=500, detail="Stripe API key not configured")
+    stripe_checkout = get_stripe_checkout(request)
     
     # Build success and cancel URLs from frontend origin
     origin_url = checkout_data.origin_url.rstrip('/')
     success_url = f"{origin_url}/checkout/success?session_id={{CHECKOUT_SESSION_ID}}"
     cancel_url = f"{origin_url}/cart"
     
-    # Initialize Stripe checkout
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
-    
     # Create metadata for the order
     metadata = {
         "customer_email": checkout_data.shipping.email,
@@ -2131,12 +4338,33 @@ async def create_checkout_session(checkout_data: CheckoutRequest, request: Reque
         metadata=metadata
     )
     
+    # Hold stock for the cart until payment completes or the hold expires
+    # Holds are kept short so abandoned checkouts don't drain a drop; a customer who pays
+    # after theirs lapsed is still charged, and commit flags the order if stock ran out
+    hold = await acquire_inventory_hold([item.model_dump() for item in checkout_data.items])
+    
+    # The promo use is only taken once the stock is held, and given back if the session
+    # can't be created, so failed checkouts don't burn a capped code's uses
+    redemption = None
+    if checkout_data.promo_code:
+        try:
+            redemption = await redeem_promo_code(
+                checkout_data.promo_code, email=checkout_data.shipping.email, subtotal=checkout_data.subtotal
+            )
+        except Exception:
+            await release_inventory_hold({"id": hold['id']})
+            raise
+    
     try:
         session: CheckoutSessionResponse = await stripe_checkout.create_checkout_session(checkout_request)
+        await db.inventory_holds.update_one({"id": hold['id']}, {"$set": {"owner": session.session_id}})
+        if redemption:
+            await db.promo_redemptions.update_one({"id": redemption['id']}, {"$set": {"reference": session.session_id}})
         
         # Store order data temporarily for later retrieval
         pending_order = {
             "session_id": session.session_id,
+            "hold_id": hold['id'],
             "items": [item.model_dump() for item in checkout_data.items],
             "shipping": checkout_data.shipping.model_dump(),
             "subtotal": checkout_data.subtotal,
@@ -2144,7 +4372,7 @@ async def create_checkout_session(checkout_data: CheckoutRequest, request: Reque
             "discount_description": checkout_data.discount_description,
             "shipping_cost": checkout_data.shipping_cost,
             "total": checkout_data.total,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
         await db.pending_orders.insert_one(pending_order)
         
@@ -2158,8 +4386,6 @@ async def create_checkout_session(checkout_data: CheckoutRequest, request: Reque
             metadata=metadata
         )
         tx_doc = transaction.model_dump()
-        tx_doc['created_at'] = tx_doc['created_at'].isoformat()
-        tx_doc['updated_at'] = tx_doc['updated_at'].isoformat()
         await db.payment_transactions.insert_one(tx_doc)
         
         return {
@@ -2170,159 +4396,407 @@ async def create_checkout_session(checkout_data: CheckoutRequest, request: Reque
         
     except Exception as e:
         logger.error(f"Failed to create checkout session: {str(e)}")
+        await release_inventory_hold({"id": hold['id']})
+        if redemption:
+            await return_promo_use(redemption)
         raise HTTPException(status_code=500, detail=f"Failed to create checkout session: {str(e)}")
 
 
+# Checkout status polls resolve through one single-flight lookup per session, and
+# terminal results (paid with an order, expired) are cached so repeat polls never reach
+# Stripe again. Orders are created by an upsert on stripe_session_id (unique index).
+# The side effects after the insert run as resumable finalization steps: each is
+# recorded on the order (`finalization`) once done, one finalizer at a time holds a
+# lease on the order, and whoever comes next (the Stripe event retry, a later poll)
+# picks up at the first unfinished step. Orders without the field count as finalized.
+CHECKOUT_STATUS_CACHE_TTL_SECONDS = int(os.environ.get('CHECKOUT_STATUS_CACHE_TTL_SECONDS', '3600'))
+checkout_status_cache: TTLCache = TTLCache(maxsize=10000, ttl=CHECKOUT_STATUS_CACHE_TTL_SECONDS)
+# Keyed by webhook URL, which comes from the request's Host header, so it is bounded
+stripe_checkout_clients: TTLCache = TTLCache(maxsize=32, ttl=3600)
+
+def get_stripe_checkout(request: Request) -> StripeCheckout:
+    """Shared StripeCheckout client for this host's webhook URL"""
+    stripe_api_key = os.environ.get("STRIPE_API_KEY")
+    if not stripe_api_key:
+        raise HTTPException(status_code=500, detail="Stripe API key not configured")
+    
+    webhook_url = f"{str(request.base_url).rstrip('/')}/api/webhook/stripe"
+    stripe_checkout = stripe_checkout_clients.get(webhook_url)
+    if stripe_checkout is None:
+        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+        stripe_checkout_clients[webhook_url] = stripe_checkout
+    return stripe_checkout
+
+def paid_checkout_result(order: dict, status: str = "complete") -> dict:
+    return {
+        "success": True,
+        "status": status,
+        "payment_status": "paid",
+        "order_number": order.get("order_number"),
+        "order_id": order.get("id")
+    }
+
+FINALIZE_LEASE_SECONDS = 60
+FINALIZATION_STEPS = ["rollup", "payment_transaction", "pending_order", "inventory", "confirmation_email"]
+
+async def run_finalization_step(step: str, order: dict):
+    """Run one post-insert side effect for a new order"""
+    session_id = order['stripe_session_id']
+    if step == "rollup":
+        await record_order_rollup(order, None, "confirmed")
+    elif step == "payment_transaction":
+        await db.payment_transactions.update_one({"session_id": session_id}, {"$set": {"order_id": order['id']}})
+    elif step == "pending_order":
+        await db.pending_orders.delete_one({"session_id": session_id})
+    elif step == "inventory":
+        # The checkout hold becomes a sale (or unreserved stock is deducted if it expired)
+        committed = await commit_inventory_hold({"owner": session_id}, order['items'])
+        if committed['oversold']:
+            # Paid after the hold lapsed and the units were sold elsewhere: someone has to decide
+            await db.orders.update_one({"id": order['id']}, {"$set": {"needs_review": True}})
+            logger.warning(
+                f"Order {order['order_number']} needs review: no stock left for "
+                + ", ".join(f"{line['quantity']}x {line['product_id']} {line['color']} {line['size']}" for line in committed['oversold'])
+            )
+    elif step == "confirmation_email":
+        await send_order_confirmation_email(order)
+
+async def resume_order_finalization(order_id: str) -> bool:
+    """Run an order's unfinished finalization steps. Returns False if another
+    finalizer holds the order (its steps may still be running)."""
+    now = datetime.now(timezone.utc)
+    order = await db.orders.find_one_and_update(
+        {
+            "id": order_id,
+            "finalized": False,
+            "$or": [{"finalize_lease_until": None}, {"finalize_lease_until": {"$lte": now}}]
+        },
+        {"$set": {"finalize_lease_until": now + timedelta(seconds=FINALIZE_LEASE_SECONDS)}},
+        {"_id": 0}
+    )
+    if not order:
+        current = await db.orders.find_one({"id": order_id}, {"_id": 0, "finalized": 1})
+        return bool(current) and current.get("finalized", True)
+    
+    done = order.get("finalization") or {}
+    try:
+        for step in FINALIZATION_STEPS:
+            if done.get(step):
+                continue
+            await run_finalization_step(step, order)
+            await db.orders.update_one({"id": order_id}, {"$set": {f"finalization.{step}": datetime.now(timezone.utc)}})
+    except Exception:
+        # Let the next attempt take over straight away
+        await db.orders.update_one({"id": order_id}, {"$unset": {"finalize_lease_until": ""}})
+        raise
+    
+    await db.orders.update_one({"id": order_id}, {"$set": {"finalized": True}, "$unset": {"finalize_lease_until": ""}})
+    return True
+
+async def finalize_checkout_session(session_id: str) -> Optional[dict]:
+    """Create the order for a paid session and finish its side effects (idempotent).
+    Returns the order's id, order_number and whether finalization is complete, or
+    None if there is neither an order nor a pending order for it."""
+    projection = {"_id": 0, "id": 1, "order_number": 1, "finalized": 1}
+    order = await db.orders.find_one({"stripe_session_id": session_id}, projection)
+    
+    if not order:
+        pending = await db.pending_orders.find_one({"session_id": session_id}, {"_id": 0})
+        if pending:
+            doc = Order(
+                items=[OrderItem(**item) for item in pending['items']],
+                shipping=ShippingAddress(**pending['shipping']),
+                subtotal=pending['subtotal'],
+                discount=pending['discount'],
+                discount_description=pending.get('discount_description'),
+                shipping_cost=pending['shipping_cost'],
+                total=pending['total'],
+                status="confirmed"
+            ).model_dump()
+            doc.update(stripe_session_id=session_id, finalized=False, finalization={})
+            try:
+                await db.orders.update_one({"stripe_session_id": session_id}, {"$setOnInsert": doc}, upsert=True)
+            except DuplicateKeyError:
+                pass  # Concurrent upserts both missed and the unique index rejected ours
+        # Also covers finalization by another worker between our two reads
+        order = await db.orders.find_one({"stripe_session_id": session_id}, projection)
+        if not order:
+            return None
+    
+    finalized = order.get("finalized", True) or await resume_order_finalization(order['id'])
+    return {"id": order['id'], "order_number": order['order_number'], "finalized": finalized}
+
+async def dedupe_stripe_session_orders() -> int:
+    """Archive duplicate orders for a Stripe session (left by the old polling race) to
+    orders_duplicates, keeping the earliest. Returns the number archived."""
+    groups = await db.orders.aggregate([
+        {"$match": {"stripe_session_id": {"$type": "string"}}},
+        {"$sort": {"created_at": 1}},
+        {"$group": {"_id": "$stripe_session_id", "ids": {"$push": "$id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True).to_list(None)
+    
+    archived = 0
+    now = datetime.now(timezone.utc)
+    for group in groups:
+        keep, duplicates = group['ids'][0], group['ids'][1:]
+        docs = await db.orders.find({"id": {"$in": duplicates}, "stripe_session_id": group['_id']}).to_list(None)
+        if not docs:
+            continue
+        # Archive before deleting (upserts, so a re-run after a crash in between is safe)
+        await db.orders_duplicates.bulk_write([
+            UpdateOne(
+                {"_id": doc['_id']},
+                {"$set": {**{k: v for k, v in doc.items() if k != "_id"}, "duplicate_of": keep, "archived_at": now}},
+                upsert=True
+            )
+            for doc in docs
+        ])
+        await db.orders.delete_many({"_id": {"$in": [doc['_id'] for doc in docs]}})
+        archived += len(docs)
+        logger.warning(f"Archived {len(docs)} duplicate orders for Stripe session {group['_id']} (kept {keep})")
+    
+    if archived:
+        await rebuild_orders_rollup()
+    return archived
+
+INDEX_PREREQUISITES[("orders", "stripe_session_id_unique")] = dedupe_stripe_session_orders
+
+async def resolve_checkout_status(session_id: str, stripe_checkout: StripeCheckout) -> dict:
+    """Look up a session's status (creating its order once paid) and cache terminal results"""
+    # A session with an order needs no Stripe round trip (just any unfinished finalization)
+    if await db.orders.find_one({"stripe_session_id": session_id}, {"_id": 1}):
+        order = await finalize_checkout_session(session_id)
+        result = paid_checkout_result(order)
+        if order['finalized']:
+            checkout_status_cache[session_id] = result
+        return result
+    
+    status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
+    
+    # Update payment transaction
+    await db.payment_transactions.update_one(
+        {"session_id": session_id},
+        {"$set": {
+            "status": status.status,
+            "payment_status": status.payment_status,
+            "updated_at": datetime.now(timezone.utc)
+        }}
+    )
+    
+    # If paid, create the order
+    if status.payment_status == "paid":
+        order = await finalize_checkout_session(session_id)
+        if order:
+            result = paid_checkout_result(order, status.status)
+            if order['finalized']:
+                checkout_status_cache[session_id] = result
+            return result
+    
+    result = {
+        "success": True,
+        "status": status.status,
+        "payment_status": status.payment_status
+    }
+    
+    # Stripe gave up on the session, so there is no reason to keep holding its stock
+    if status.status == "expired":
+        await release_inventory_hold({"owner": session_id}, state="expired")
+        checkout_status_cache[session_id] = result
+    
+    return result
+
 @api_router.get("/checkout/status/{session_id}")
 async def get_checkout_status(session_id: str, request: Request):
     """
     Get the status of a checkout session and create order if paid.
     """
-    stripe_api_key = os.environ.get("STRIPE_API_KEY")
-    if not stripe_api_key:
-        raise HTTPException(status_code=500, detail="Stripe API key not configured")
+    cached = checkout_status_cache.get(session_id)
+    if cached:
+        return cached
     
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+    stripe_checkout = get_stripe_checkout(request)
     
     try:
-        status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
-        
-        # Update payment transaction
-        await db.payment_transactions.update_one(
-            {"session_id": session_id},
-            {"$set": {
-                "status": status.status,
-                "payment_status": status.payment_status,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }}
+        # Concurrent polls for the same session share one lookup
+        return await single_flight(
+            f"checkout_status:{session_id}",
+            lambda: resolve_checkout_status(session_id, stripe_checkout)
         )
-        
-        # If paid, create the order
-        if status.payment_status == "paid":
-            # Check if order already created for this session
-            existing_order = await db.orders.find_one({"stripe_session_id": session_id}, {"_id": 0})
-            
-            if not existing_order:
-                # Get pending order data
-                pending = await db.pending_orders.find_one({"session_id": session_id}, {"_id": 0})
-                
-                if pending:
-                    # Create the order
-                    order = Order(
-                        items=[OrderItem(**item) for item in pending['items']],
-                        shipping=ShippingAddress(**pending['shipping']),
-                        subtotal=pending['subtotal'],
-                        discount=pending['discount'],
-                        discount_description=pending.get('discount_description'),
-                        shipping_cost=pending['shipping_cost'],
-                        total=pending['total'],
-                        status="confirmed"
-                    )
-                    
-                    doc = order.model_dump()
-                    doc['stripe_session_id'] = session_id
-                    doc['created_at'] = doc['created_at'].isoformat()
-                    doc['updated_at'] = doc['updated_at'].isoformat()
-                    doc['items'] = [item.model_dump() if hasattr(item, 'model_dump') else item for item in doc['items']]
-                    doc['shipping'] = doc['shipping'].model_dump() if hasattr(doc['shipping'], 'model_dump') else doc['shipping']
-                    
-                    await db.orders.insert_one(doc)
-                    
-                    # Update payment transaction with order ID
-                    await db.payment_transactions.update_one(
-                        {"session_id": session_id},
-                        {"$set": {"order_id": order.id}}
-                    )
-                    
-                    # Clean up pending order
-                    await db.pending_orders.delete_one({"session_id": session_id})
-                    
-                    # Commit inventory (deduct from stock)
-                    inventory_items = [
-                        {
-                            "product_id": item.get("product_id"),
-                            "color": item.get("color"),
-                            "size": item.get("size"),
-                            "quantity": item.get("quantity", 1)
-                        }
-                        for item in order.items
-                    ]
-                    for inv_item in inventory_items:
-                        await db.inventory.update_one(
-                            {"product_id": inv_item['product_id'], "color": inv_item['color'], "size": inv_item['size']},
-                            {
-                                "$inc": {"quantity": -inv_item['quantity']},
-                                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
-                            }
-                        )
-                    
-                    # Send order confirmation email (non-blocking)
-                    asyncio.create_task(send_order_confirmation_email(doc))
-                    
-                    return {
-                        "success": True,
-                        "status": status.status,
-                        "payment_status": status.payment_status,
-                        "order_number": order.order_number,
-                        "order_id": order.id
-                    }
-            else:
-                return {
-                    "success": True,
-                    "status": status.status,
-                    "payment_status": status.payment_status,
-                    "order_number": existing_order.get("order_number"),
-                    "order_id": existing_order.get("id")
-                }
-        
-        return {
-            "success": True,
-            "status": status.status,
-            "payment_status": status.payment_status
-        }
-        
     except Exception as e:
         logger.error(f"Failed to get checkout status: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get checkout status: {str(e)}")
 
 
+# Stripe webhooks are verified, recorded in db.stripe_events under the Stripe event id
+# and acknowledged straight away; a redelivered event hits the unique _id and is not
+# processed again. stripe_event_worker does the slow part (payment transaction, order,
+# stock commit, confirmation email) and retries with backoff, so orders are finalized
+# whether or not the customer's browser ever polls /checkout/status. With
+# STRIPE_LOCAL_EVENTS=1, POST /webhook/stripe/local enqueues unsigned events for tests
+# and local development.
+STRIPE_EVENT_MAX_ATTEMPTS = int(os.environ.get('STRIPE_EVENT_MAX_ATTEMPTS', '8'))
+STRIPE_EVENT_POLL_SECONDS = float(os.environ.get('STRIPE_EVENT_POLL_SECONDS', '5'))
+STRIPE_EVENT_LEASE_SECONDS = 60  # Events are retried if a worker dies mid-processing
+STRIPE_LOCAL_EVENTS = os.environ.get('STRIPE_LOCAL_EVENTS', '').lower() in ('1', 'true', 'yes')
+
+stripe_event_wakeup = asyncio.Event()
+
+class LocalStripeEvent(BaseModel):
+    session_id: str
+    event_type: str = "checkout.session.completed"
+    payment_status: str = "paid"
+    event_id: Optional[str] = None
+
+async def record_stripe_event(event_id: str, event_type: str, session_id: Optional[str],
+                              payment_status: Optional[str], source: str = "stripe") -> bool:
+    """Queue a verified event for the worker. Returns False if it was already recorded."""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.stripe_events.insert_one({
+            "_id": event_id,
+            "type": event_type,
+            "session_id": session_id,
+            "payment_status": payment_status,
+            "source": source,
+            "status": "pending",  # pending, processing, done, dead
+            "attempts": 0,
+            "received_at": now,
+            "next_attempt_at": now
+        })
+    except DuplicateKeyError:
+        return False
+    stripe_event_wakeup.set()
+    return True
+
+async def process_stripe_event(event: dict):
+    """Apply one event: update the payment transaction, then finalize or release the session"""
+    session_id = event.get("session_id")
+    if not session_id:
+        return
+
+    await db.payment_transactions.update_one(
+        {"session_id": session_id},
+        {"$set": {
+            "status": event["type"],
+            "payment_status": event.get("payment_status"),
+            "updated_at": datetime.now(timezone.utc)
+        }}
+    )
+
+    if event.get("payment_status") == "paid":
+        order = await finalize_checkout_session(session_id)
+        if not order:
+            logger.warning(f"Stripe event {event['_id']}: no pending order for paid session {session_id}")
+        elif not order['finalized']:
+            # Another finalizer holds the order; retry so a crashed one is picked up after its lease
+            raise RuntimeError(f"order {order['order_number']} is still being finalized")
+        else:
+            checkout_status_cache[session_id] = paid_checkout_result(order)
+    elif event["type"] == "checkout.session.expired":
+        await release_inventory_hold({"owner": session_id}, state="expired")
+
+async def claim_stripe_event() -> Optional[dict]:
+    """Lease the next due event (returned as it was before the lease, so its attempts
+    + 1 is the attempt this lease counted)"""
+    now = datetime.now(timezone.utc)
+    # An event whose processing keeps outliving its lease still runs out of attempts
+    await db.stripe_events.update_many(
+        {"status": "processing", "lease_expires_at": {"$lte": now}, "attempts": {"$gte": STRIPE_EVENT_MAX_ATTEMPTS}},
+        {"$set": {"status": "dead", "dead_at": now, "last_error": "lease expired during processing"},
+         "$unset": {"lease_expires_at": ""}}
+    )
+    return await db.stripe_events.find_one_and_update(
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "processing", "lease_expires_at": {"$lte": now}, "attempts": {"$lt": STRIPE_EVENT_MAX_ATTEMPTS}}
+        ]},
+        {"$set": {"status": "processing", "lease_expires_at": now + timedelta(seconds=STRIPE_EVENT_LEASE_SECONDS)},
+         "$inc": {"attempts": 1}},
+        sort=[("next_attempt_at", 1)]
+    )
+
+async def handle_stripe_event(event: dict):
+    """Process a claimed event and record the outcome"""
+    try:
+        await process_stripe_event(event)
+        update = {"status": "done", "processed_at": datetime.now(timezone.utc)}
+    except Exception as e:
+        attempts = event.get("attempts", 0) + 1
+        now = datetime.now(timezone.utc)
+        if attempts >= STRIPE_EVENT_MAX_ATTEMPTS:
+            update = {"status": "dead", "dead_at": now}
+            logger.error(f"Stripe event {event['_id']} ({event['type']}) dead-lettered after {attempts} attempts: {str(e)}")
+        else:
+            update = {"status": "pending", "next_attempt_at": now + timedelta(seconds=webhook_backoff_seconds(attempts))}
+            logger.warning(f"Stripe event {event['_id']} ({event['type']}) attempt {attempts} failed: {str(e)}")
+        update.update(attempts=attempts, last_error=str(e))
+
+    await db.stripe_events.update_one(
+        {"_id": event["_id"]},
+        {"$set": update, "$unset": {"lease_expires_at": ""}}
+    )
+
+async def stripe_event_worker():
+    """Background loop finalizing checkouts from recorded Stripe events"""
+    while True:
+        try:
+            event = await claim_stripe_event()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Stripe event claim failed: {str(e)}")
+            await asyncio.sleep(STRIPE_EVENT_POLL_SECONDS)
+            continue
+
+        if not event:
+            stripe_event_wakeup.clear()
+            try:
+                await asyncio.wait_for(stripe_event_wakeup.wait(), timeout=STRIPE_EVENT_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        await handle_stripe_event(event)
+
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
     """
-    Handle Stripe webhooks.
+    Handle Stripe webhooks: verify, record for the event worker and acknowledge.
     """
-    stripe_api_key = os.environ.get("STRIPE_API_KEY")
-    if not stripe_api_key:
-        raise HTTPException(status_code=500, detail="Stripe API key not configured")
-    
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
-    
+    stripe_checkout = get_stripe_checkout(request)
+
+    body = await request.body()
+    signature = request.headers.get("Stripe-Signature", "")
     try:
-        body = await request.body()
-        signature = request.headers.get("Stripe-Signature", "")
-        
         webhook_response = await stripe_checkout.handle_webhook(body, signature)
-        
-        # Update payment transaction based on webhook
-        if webhook_response.session_id:
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {"$set": {
-                    "status": webhook_response.event_type,
-                    "payment_status": webhook_response.payment_status,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
-        
-        return {"success": True, "event_type": webhook_response.event_type}
-        
     except Exception as e:
-        logger.error(f"Webhook error: {str(e)}")
-        return {"success": False, "error": str(e)}
+        logger.warning(f"Rejected Stripe webhook: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid Stripe webhook")
+
+    if not webhook_response.event_id:
+        raise HTTPException(status_code=400, detail="Stripe webhook has no event id")
+
+    # Not caught: if the event can't be recorded, a 500 makes Stripe redeliver it
+    recorded = await record_stripe_event(
+        webhook_response.event_id,
+        webhook_response.event_type,
+        webhook_response.session_id,
+        webhook_response.payment_status
+    )
+
+    return {"success": True, "event_type": webhook_response.event_type, "duplicate": not recorded}
+
+@api_router.post("/webhook/stripe/local")
+async def local_stripe_webhook(event: LocalStripeEvent):
+    """Enqueue an unsigned Stripe event (only with STRIPE_LOCAL_EVENTS enabled)"""
+    if not STRIPE_LOCAL_EVENTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    event_id = event.event_id or f"evt_local_{uuid.uuid4().hex}"
+    recorded = await record_stripe_event(event_id, event.event_type, event.session_id, event.payment_status, source="local")
+
+    return {"success": True, "event_id": event_id, "event_type": event.event_type, "duplicate": not recorded}
 
 
 # ============================================
@@ -2331,6 +4805,48 @@ async def stripe_webhook(request: Request):
 
 # Waitlist configuration
 WAITLIST_LIMIT = 100  # Limited spots
+WAITLIST_INSERT_ATTEMPTS = 3  # Access codes drawn before a join gives up
+
+# Spots are handed out from a counter document (db.counters, _id "waitlist") so
+# capacity checks are one atomic update instead of a count per join:
+# {"taken": spots in use, "next_position": next position to assign}
+WAITLIST_COUNTER_ID = "waitlist"
+
+async def sync_waitlist_counter(force: bool = False) -> dict:
+    """Create the counter from the waitlist collection (or recount it when forced)"""
+    taken = await db.waitlist.count_documents({})
+    last = await db.waitlist.find({}, {"_id": 0, "position": 1}).sort("position", -1).limit(1).to_list(1)
+    next_position = (last[0].get("position") or 0) + 1 if last else 1
+    if force:
+        update = {"$set": {"taken": taken}, "$max": {"next_position": next_position}}
+    else:
+        update = {"$setOnInsert": {"taken": taken, "next_position": next_position}}
+    return await db.counters.find_one_and_update(
+        {"_id": WAITLIST_COUNTER_ID}, update, upsert=True, return_document=True
+    )
+
+async def get_waitlist_counter() -> dict:
+    """Current waitlist counter document"""
+    counter = await db.counters.find_one({"_id": WAITLIST_COUNTER_ID})
+    return counter or await sync_waitlist_counter()
+
+async def claim_waitlist_slot() -> Optional[int]:
+    """Take one spot if any are left; returns the assigned position or None when full"""
+    for _ in range(2):
+        counter = await db.counters.find_one_and_update(
+            {"_id": WAITLIST_COUNTER_ID, "taken": {"$lt": WAITLIST_LIMIT}},
+            {"$inc": {"taken": 1, "next_position": 1}}
+        )
+        if counter:
+            return counter["next_position"]
+        if await db.counters.count_documents({"_id": WAITLIST_COUNTER_ID}):
+            return None
+        await sync_waitlist_counter()
+    return None
+
+async def release_waitlist_slot():
+    """Give back a spot claimed for an entry that was not inserted"""
+    await db.counters.update_one({"_id": WAITLIST_COUNTER_ID}, {"$inc": {"taken": -1}})
 
 @api_router.post("/waitlist/check")
 async def check_waitlist_entry(check: WaitlistCheckRequest):
@@ -2360,8 +4876,8 @@ async def get_waitlist_stats():
     Get live waitlist statistics for display.
     """
     try:
-        # Count total waitlist entries
-        total_waitlist = await db.waitlist.count_documents({})
+        counter = await get_waitlist_counter()
+        total_waitlist = counter["taken"]
         
         # Add base count for display (makes it look more impressive)
         display_count = total_waitlist + 2847
@@ -2400,6 +4916,69 @@ def sizes_to_string(sizes: dict) -> str:
     return ", ".join([f"{size} x{qty}" for size, qty in sizes.items()])
 
 
+async def update_waitlist_entry(entry: WaitlistEntry, existing: dict, new_sizes: dict) -> WaitlistResponse:
+    """Answer a join for an email/product/variant that is already on the waitlist,
+    merging the new sizes into it when force_add is set"""
+    if not entry.force_add:
+        # Return existing info without modifying
+        return WaitlistResponse(
+            success=True,
+            message="You're already on the waitlist for this item!",
+            access_code=existing.get("access_code"),
+            total_items=existing.get("size", ""),
+            is_update=False
+        )
+    
+    # Merge sizes with existing entry
+    existing_sizes = existing.get("sizes", {})
+    if not existing_sizes:
+        # Parse existing size string into dict
+        existing_size_str = existing.get("size", "")
+        parts = existing_size_str.split(", ")
+        for part in parts:
+            if " x" in part:
+                size_part, qty_part = part.rsplit(" x", 1)
+                existing_sizes[size_part.strip()] = int(qty_part)
+            elif part.strip():
+                existing_sizes[part.strip()] = 1
+    
+    # Merge sizes
+    merged_sizes = merge_sizes(existing_sizes, [{"size": k, "quantity": v} for k, v in new_sizes.items()])
+    merged_size_string = sizes_to_string(merged_sizes)
+    
+    # Update existing entry (keep original position)
+    await db.waitlist.update_one(
+        {"_id": existing["_id"]} if "_id" in existing else {"id": existing["id"]},
+        {"$set": {
+            "sizes": merged_sizes,
+            "size": merged_size_string,
+            "updated_at": datetime.now(timezone.utc)
+        }}
+    )
+    
+    access_code = existing.get("access_code")
+    
+    # Send webhook to n8n for waitlist update email
+    product_image = entry.image or existing.get("image", "")
+    await send_n8n_waitlist_webhook(
+        email=entry.email,
+        product_name=entry.product_name,
+        product_variant=entry.variant,
+        product_image=product_image,
+        sizes=merged_sizes,
+        access_code=access_code,
+        is_update=True
+    )
+    
+    return WaitlistResponse(
+        success=True,
+        message=f"Your waitlist updated! Total items: {merged_size_string}",
+        access_code=access_code,
+        total_items=merged_size_string,
+        is_update=True
+    )
+
+
 @api_router.post("/waitlist/join", response_model=WaitlistResponse)
 async def join_waitlist(entry: WaitlistEntry):
     """
@@ -2436,79 +5015,18 @@ async def join_waitlist(entry: WaitlistEntry):
                 else:
                     new_sizes[part.strip()] = 1
         
-        if existing:
-            if not entry.force_add:
-                # Return existing info without modifying
-                return WaitlistResponse(
-                    success=True,
-                    message="You're already on the waitlist for this item!",
-                    access_code=existing.get("access_code"),
-                    total_items=existing.get("size", ""),
-                    is_update=False
-                )
-            
-            # Merge sizes with existing entry
-            existing_sizes = existing.get("sizes", {})
-            if not existing_sizes:
-                # Parse existing size string into dict
-                existing_size_str = existing.get("size", "")
-                parts = existing_size_str.split(", ")
-                for part in parts:
-                    if " x" in part:
-                        size_part, qty_part = part.rsplit(" x", 1)
-                        existing_sizes[size_part.strip()] = int(qty_part)
-                    elif part.strip():
-                        existing_sizes[part.strip()] = 1
-            
-            # Merge sizes
-            merged_sizes = merge_sizes(existing_sizes, [{"size": k, "quantity": v} for k, v in new_sizes.items()])
-            merged_size_string = sizes_to_string(merged_sizes)
-            
-            # Update existing entry (keep original position)
-            await db.waitlist.update_one(
-                {"_id": existing["_id"]} if "_id" in existing else {"id": existing["id"]},
-                {"$set": {
-                    "sizes": merged_sizes,
-                    "size": merged_size_string,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
-            
-            access_code = existing.get("access_code")
-            
-            # Send webhook to n8n for waitlist update email
-            product_image = entry.image or existing.get("image", "")
-            asyncio.create_task(send_n8n_waitlist_webhook(
-                email=entry.email,
-                product_name=entry.product_name,
-                product_variant=entry.variant,
-                product_image=product_image,
-                sizes=merged_sizes,
-                access_code=access_code,
-                is_update=True
-            ))
-            
-            return WaitlistResponse(
-                success=True,
-                message=f"Your waitlist updated! Total items: {merged_size_string}",
-                access_code=access_code,
-                total_items=merged_size_string,
-                is_update=True
-            )
-        
-        # NEW ENTRY - Check waitlist limit
-        total_count = await db.waitlist.count_documents({})
+        if existing:
+            return await update_waitlist_entry(entry, existing, new_sizes)
+        
+        # NEW ENTRY - Claim a spot (fails once the waitlist is full)
+        position = await claim_waitlist_slot()
         
-        if total_count >= WAITLIST_LIMIT:
+        if position is None:
             return WaitlistResponse(
                 success=False,
                 message="Sorry, the waitlist is full! Follow us on Instagram for future drops."
             )
         
-        # Generate unique access code for this user
-        access_code = f"RAZE-{secrets.token_hex(4).upper()}"
-        position = total_count + 1
-        
         # Convert new_sizes to string
         size_string = sizes_to_string(new_sizes)
         
@@ -2523,17 +5041,41 @@ async def join_waitlist(entry: WaitlistEntry):
             "sizes": new_sizes,  # Store structured sizes dict
             "image": entry.image,  # Store product image URL
             "position": position,
-            "access_code": access_code,
-            "created_at": datetime.now(timezone.utc).isoformat(),
+            "created_at": datetime.now(timezone.utc),
             "notified": False,
             "purchased": False
         }
         
-        await db.waitlist.insert_one(waitlist_entry)
+        for _ in range(WAITLIST_INSERT_ATTEMPTS):
+            # Generate unique access code for this user
+            access_code = f"RAZE-{secrets.token_hex(4).upper()}"
+            waitlist_entry["access_code"] = access_code
+            waitlist_entry.pop("_id", None)  # Set by a failed insert_one
+            try:
+                await db.waitlist.insert_one(waitlist_entry)
+                break
+            except DuplicateKeyError:
+                # Either a concurrent join for the same email/product/variant won the
+                # race - give the spot back and answer from its entry - or the access
+                # code collided and another one is drawn
+                existing = await db.waitlist.find_one({
+                    "email": entry.email.lower(),
+                    "product_id": entry.product_id,
+                    "variant": entry.variant
+                })
+                if existing:
+                    await release_waitlist_slot()
+                    return await update_waitlist_entry(entry, existing, new_sizes)
+            except Exception:
+                await release_waitlist_slot()
+                raise
+        else:
+            await release_waitlist_slot()
+            raise RuntimeError(f"No unused access code after {WAITLIST_INSERT_ATTEMPTS} attempts")
         
         # Send webhook to n8n for waitlist confirmation email
         product_image = entry.image or ""
-        asyncio.create_task(send_n8n_waitlist_webhook(
+        await send_n8n_waitlist_webhook(
             email=entry.email,
             product_name=entry.product_name,
             product_variant=entry.variant,
@@ -2541,7 +5083,7 @@ async def join_waitlist(entry: WaitlistEntry):
             sizes=new_sizes,
             access_code=access_code,
             is_update=False
-        ))
+        )
         
         return WaitlistResponse(
             success=True,
@@ -2558,7 +5100,8 @@ async def join_waitlist(entry: WaitlistEntry):
 @api_router.get("/waitlist/status")
 async def get_waitlist_status():
     """Get current waitlist status (spots remaining)"""
-    total_count = await db.waitlist.count_documents({})
+    counter = await get_waitlist_counter()
+    total_count = counter["taken"]
     spots_remaining = max(0, WAITLIST_LIMIT - total_count)
     
     return {
@@ -2568,6 +5111,13 @@ async def get_waitlist_status():
         "is_full": spots_remaining == 0
     }
 
+@api_router.post("/admin/waitlist/counter/resync")
+async def resync_waitlist_counter(request: Request):
+    """Recount the waitlist spot counter (e.g. after entries were removed by hand)"""
+    await verify_admin(request)
+    counter = await sync_waitlist_counter(force=True)
+    return {"success": True, "taken": counter["taken"], "next_position": counter["next_position"]}
+
 @api_router.get("/waitlist/verify/{access_code}")
 async def verify_access_code(access_code: str):
     """Verify if an access code is valid for purchasing"""
@@ -2588,8 +5138,16 @@ async def verify_access_code(access_code: str):
     }
 
 @api_router.get("/waitlist/admin")
-async def get_all_waitlist_entries():
-    """Admin: Get all waitlist entries"""
+async def get_all_waitlist_entries(format: str = Query("json", pattern=EXPORT_FORMAT_PATTERN)):
+    """Admin: Get all waitlist entries (?format=ndjson|csv streams every entry)"""
+    if format != "json":
+        cursor = db.waitlist.find({}, {"_id": 0}).sort("position", 1)
+        fields = [
+            "position", "id", "email", "product_id", "product_name", "variant", "size", "sizes",
+            "access_code", "created_at", "notified", "purchased"
+        ]
+        return stream_export(cursor, format, fields, "waitlist")
+    
     entries = await db.waitlist.find({}, {"_id": 0}).sort("position", 1).to_list(1000)
     return {
         "total": len(entries),
@@ -2597,6 +5155,226 @@ async def get_all_waitlist_entries():
     }
 
 
+# ============================================
+# SHIPPO GATEWAY
+# ============================================
+
+# The Shippo SDK is synchronous (requests under the hood), so every call runs on a
+# dedicated thread pool instead of blocking the event loop for a carrier round trip.
+# Each operation has its own concurrency limit and the pool has a thread for every
+# slot, so a burst of rate quotes can't starve label purchases and no call's timeout
+# is spent queueing for a thread; a slot is held until the SDK call actually returns,
+# even when the caller has already timed out. Failures surface as ShippingGatewayError, which the
+# API renders as a structured JSON error. SHIPPO_FAKE=1 swaps in FakeShippo, an
+# offline stand-in with canned rates, labels and tracking for tests and local dev.
+SHIPPO_TIMEOUT_SECONDS = float(os.environ.get('SHIPPO_TIMEOUT_SECONDS', '15'))
+SHIPPO_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('SHIPPO_QUEUE_TIMEOUT_SECONDS', '5'))
+SHIPPO_CONCURRENCY = {
+    "rates": int(os.environ.get('SHIPPO_RATES_CONCURRENCY', '6')),
+    "label": int(os.environ.get('SHIPPO_LABEL_CONCURRENCY', '2')),
+    "tracking": int(os.environ.get('SHIPPO_TRACKING_CONCURRENCY', '4')),
+}
+SHIPPO_WORKERS = sum(SHIPPO_CONCURRENCY.values())
+SHIPPO_FAKE = os.environ.get('SHIPPO_FAKE', '').lower() in ('1', 'true', 'yes')
+SHIPPO_FAKE_LATENCY_SECONDS = float(os.environ.get('SHIPPO_FAKE_LATENCY_SECONDS', '0.2'))
+
+shippo_executor = ThreadPoolExecutor(max_workers=SHIPPO_WORKERS, thread_name_prefix="shippo")
+shippo_slots = {operation: asyncio.Semaphore(limit) for operation, limit in SHIPPO_CONCURRENCY.items()}
+shippo_stats = {
+    operation: {"calls": 0, "in_flight": 0, "errors": 0, "timeouts": 0, "rejected": 0, "total_seconds": 0.0}
+    for operation in SHIPPO_CONCURRENCY
+}
+
+class ShippingGatewayError(Exception):
+    """A Shippo call that failed, timed out or could not be scheduled"""
+
+    STATUS_CODES = {"not_configured": 503, "busy": 503, "timeout": 504, "carrier_error": 502}
+
+    def __init__(self, operation: str, kind: str, message: str):
+        super().__init__(message)
+        self.operation = operation
+        self.kind = kind
+        self.message = message
+        self.status_code = self.STATUS_CODES.get(kind, 502)
+
+@app.exception_handler(ShippingGatewayError)
+async def shipping_gateway_error_handler(request: Request, exc: ShippingGatewayError):
+    headers = {"Retry-After": "5"} if exc.kind == "busy" else None
+    return ORJSONResponse(
+        status_code=exc.status_code,
+        content={"success": False, "error": exc.kind, "operation": exc.operation, "message": exc.message},
+        headers=headers
+    )
+
+class FakeShippo:
+    """Offline Shippo stand-in exposing the SDK calls used here (blocks like the real one)"""
+
+    SERVICES = [
+        ("USPS", "Ground Advantage", "5.95", 5, "3-5 business days"),
+        ("USPS", "Priority Mail", "9.45", 2, "1-3 business days"),
+        ("UPS", "Next Day Air Saver", "32.10", 1, "Next business day"),
+    ]
+
+    def __init__(self, latency: float = SHIPPO_FAKE_LATENCY_SECONDS):
+        self.latency = latency
+        self.shipments = SimpleNamespace(create=self._create_shipment)
+        self.transactions = SimpleNamespace(create=self._create_transaction)
+        self.track = SimpleNamespace(get_status=self._get_status)
+
+    def _rate(self, index: int):
+        provider, service, amount, days, terms = self.SERVICES[index]
+        return SimpleNamespace(
+            object_id=f"fake_rate_{index}", provider=provider, servicelevel=SimpleNamespace(name=service),
+            amount=amount, currency="USD", estimated_days=days, duration_terms=terms
+        )
+
+    def _create_shipment(self, request):
+        time.sleep(self.latency)
+        return SimpleNamespace(rates=[self._rate(index) for index in range(len(self.SERVICES))])
+
+    def _create_transaction(self, request):
+        time.sleep(self.latency)
+        if not request.rate.startswith("fake_rate_"):
+            return SimpleNamespace(status="ERROR", messages=[f"Unknown rate {request.rate}"], rate=None)
+        rate = self._rate(int(request.rate.rsplit("_", 1)[1]) % len(self.SERVICES))
+        tracking_number = f"FAKE{secrets.token_hex(8).upper()}"
+        return SimpleNamespace(
+            status="SUCCESS", messages=[], rate=rate, tracking_number=tracking_number,
+            label_url=f"https://shippo-fake.local/labels/{tracking_number}.pdf"
+        )
+
+    def _get_status(self, carrier: str, tracking_number: str):
+        time.sleep(self.latency)
+        event = SimpleNamespace(
+            status="TRANSIT", status_details="In transit to destination",
+            status_date=datetime.now(timezone.utc).isoformat(), location=SimpleNamespace(city="San Francisco")
+        )
+        return SimpleNamespace(
+            tracking_number=tracking_number, carrier=carrier, tracking_status=event,
+            eta=(datetime.now(timezone.utc) + timedelta(days=2)).isoformat(), tracking_history=[event]
+        )
+
+if SHIPPO_FAKE:
+    shippo_client = FakeShippo()
+
+async def call_shippo(operation: str, method: str, *args, **kwargs):
+    """Run a blocking Shippo SDK method (e.g. "shipments.create") on the Shippo pool with a slot and timeout"""
+    if not shippo_client:
+        raise ShippingGatewayError(operation, "not_configured", "Shipping service not configured")
+    resource, name = method.split(".")
+    func = getattr(getattr(shippo_client, resource), name)
+
+    stats = shippo_stats[operation]
+    slots = shippo_slots[operation]
+    try:
+        await asyncio.wait_for(slots.acquire(), timeout=SHIPPO_QUEUE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        stats["rejected"] += 1
+        raise ShippingGatewayError(operation, "busy", "Shipping service is busy, please retry")
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    stats["calls"] += 1
+    stats["in_flight"] += 1
+
+    def release(_):
+        stats["in_flight"] -= 1
+        stats["total_seconds"] += loop.time() - started
+        slots.release()
+
+    future = loop.run_in_executor(shippo_executor, functools.partial(func, *args, **kwargs))
+    future.add_done_callback(release)
+    try:
+        # shield: on timeout the thread keeps running and holds its slot until it returns
+        return await asyncio.wait_for(asyncio.shield(future), timeout=SHIPPO_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        stats["timeouts"] += 1
+        raise ShippingGatewayError(operation, "timeout", f"Shippo did not respond within {SHIPPO_TIMEOUT_SECONDS:g}s")
+    except Exception as e:
+        stats["errors"] += 1
+        raise ShippingGatewayError(operation, "carrier_error", str(e)) from e
+
+def get_shippo_stats() -> Dict[str, dict]:
+    """Per-operation Shippo call counters"""
+    return {
+        operation: {
+            "max_concurrency": SHIPPO_CONCURRENCY[operation],
+            **{key: value for key, value in stats.items() if key != "total_seconds"},
+            "avg_ms": round(stats["total_seconds"] / stats["calls"] * 1000, 1) if stats["calls"] else 0
+        }
+        for operation, stats in shippo_stats.items()
+    }
+
+
+# Rate quotes are cached so re-rendering checkout doesn't create a new Shippo shipment
+# (a multi-second carrier round trip) for an unchanged address and parcel. The key is the
+# normalized destination (country, postal code, state, city, plus the street lines at
+# the default "address" precision) and the parcel dimensions and weight. With
+# SHIPPING_QUOTE_PRECISION=zone the street is left out and customers in the same
+# postal area share quotes; the shared rate ids belong to whoever was quoted first, so
+# labels must be bought from a fresh quote. Concurrent identical quotes share one call.
+SHIPPING_QUOTE_CACHE_TTL_SECONDS = int(os.environ.get('SHIPPING_QUOTE_CACHE_TTL_SECONDS', '900'))
+SHIPPING_QUOTE_CACHE_SIZE = int(os.environ.get('SHIPPING_QUOTE_CACHE_SIZE', '5000'))
+SHIPPING_QUOTE_PRECISION = os.environ.get('SHIPPING_QUOTE_PRECISION', 'address').lower()  # address or zone
+
+shipping_quote_cache: TTLCache = TTLCache(maxsize=SHIPPING_QUOTE_CACHE_SIZE, ttl=SHIPPING_QUOTE_CACHE_TTL_SECONDS)
+shipping_quote_stats = {"hits": 0, "misses": 0, "carrier_calls": 0, "empty": 0}
+
+def normalize_quote_text(value: Optional[str]) -> str:
+    """Casefold and collapse whitespace/punctuation so "Main St." and "main st" match"""
+    return " ".join((value or "").replace(".", " ").replace(",", " ").replace("#", " ").casefold().split())
+
+def shipping_quote_key(request: ShippingRateRequest) -> str:
+    """Cache key for a rate quote: normalized destination plus parcel"""
+    address = request.address_to
+    country = address.country.strip().upper()
+    postal_code = "".join(address.postal_code.split()).upper()
+    if country == "US":
+        postal_code = postal_code.split("-")[0][:5]  # ZIP+4 doesn't change rates
+    parts = [country, postal_code, address.state.strip().upper(), normalize_quote_text(address.city)]
+    if SHIPPING_QUOTE_PRECISION != "zone":
+        parts += [normalize_quote_text(address.address_line1), normalize_quote_text(address.address_line2)]
+    parts += [f"{value:g}" for value in (
+        round(request.length, 2), round(request.width, 2), round(request.height, 2), round(request.weight, 3)
+    )]
+    return "|".join(parts)
+
+async def quote_shipping_rates(key: str, address_to: dict, parcel: dict) -> List[ShippingRate]:
+    """Create a Shippo shipment for the quote and cache its rates, cheapest first"""
+    shipping_quote_stats["carrier_calls"] += 1
+    shipment = await call_shippo(
+        "rates",
+        "shipments.create",
+        shippo.components.ShipmentCreateRequest(
+            address_from=shippo.components.AddressCreateRequest(**RAZE_ADDRESS),
+            address_to=shippo.components.AddressCreateRequest(**address_to),
+            parcels=[shippo.components.ParcelCreateRequest(**parcel)],
+            async_=False
+        )
+    )
+
+    rates = []
+    if shipment and shipment.rates:
+        for rate in shipment.rates:
+            rates.append(ShippingRate(
+                object_id=rate.object_id,
+                provider=rate.provider or "Unknown",
+                service_level=rate.servicelevel.name if rate.servicelevel else "Standard",
+                amount=float(rate.amount) if rate.amount else 0,
+                currency=rate.currency or "USD",
+                estimated_days=rate.estimated_days,
+                duration_terms=rate.duration_terms
+            ))
+    rates.sort(key=lambda x: x.amount)
+
+    # No rates usually means a bad address the customer is about to fix; don't cache it
+    if rates:
+        shipping_quote_cache[key] = rates
+    else:
+        shipping_quote_stats["empty"] += 1
+    return rates
+
+
 # ============================================
 # SHIPPING ROUTES (Shippo)
 # ============================================
@@ -2606,9 +5384,6 @@ async def get_shipping_rates(request: ShippingRateRequest):
     """
     Get available shipping rates from Shippo for a destination address.
     """
-    if not shippo_client:
-        raise HTTPException(status_code=500, detail="Shipping service not configured")
-    
     try:
         # Create address_to object
         address_to = {
@@ -2633,39 +5408,24 @@ async def get_shipping_rates(request: ShippingRateRequest):
             "mass_unit": "lb"
         }
         
-        # Create shipment to get rates
-        shipment = shippo_client.shipments.create(
-            shippo.components.ShipmentCreateRequest(
-                address_from=shippo.components.AddressCreateRequest(**RAZE_ADDRESS),
-                address_to=shippo.components.AddressCreateRequest(**address_to),
-                parcels=[shippo.components.ParcelCreateRequest(**parcel)],
-                async_=False
-            )
-        )
-        
-        # Parse rates from response
-        rates = []
-        if shipment and shipment.rates:
-            for rate in shipment.rates:
-                rates.append(ShippingRate(
-                    object_id=rate.object_id,
-                    provider=rate.provider or "Unknown",
-                    service_level=rate.servicelevel.name if rate.servicelevel else "Standard",
-                    amount=float(rate.amount) if rate.amount else 0,
-                    currency=rate.currency or "USD",
-                    estimated_days=rate.estimated_days,
-                    duration_terms=rate.duration_terms
-                ))
-        
-        # Sort by price
-        rates.sort(key=lambda x: x.amount)
+        key = shipping_quote_key(request)
+        rates = shipping_quote_cache.get(key)
+        cached = rates is not None
+        if cached:
+            shipping_quote_stats["hits"] += 1
+        else:
+            shipping_quote_stats["misses"] += 1
+            rates = await single_flight(f"shipping_quote:{key}", lambda: quote_shipping_rates(key, address_to, parcel))
         
         return ShippingRatesResponse(
             success=True,
             rates=rates,
+            cached=cached,
             message=f"Found {len(rates)} shipping options"
         )
         
+    except ShippingGatewayError:
+        raise
     except Exception as e:
         logger.error(f"Error getting shipping rates: {str(e)}")
         return ShippingRatesResponse(
@@ -2679,12 +5439,11 @@ async def create_shipping_label(request: CreateLabelRequest):
     """
     Create a shipping label for a selected rate.
     """
-    if not shippo_client:
-        raise HTTPException(status_code=500, detail="Shipping service not configured")
-    
     try:
         # Purchase the label/transaction
-        transaction = shippo_client.transactions.create(
+        transaction = await call_shippo(
+            "label",
+            "transactions.create",
             shippo.components.TransactionCreateRequest(
                 rate=request.rate_id,
                 label_file_type=shippo.components.LabelFileTypeEnum.PDF_4X6,
@@ -2694,16 +5453,19 @@ async def create_shipping_label(request: CreateLabelRequest):
         
         if transaction.status == "SUCCESS":
             # Update the order with tracking info
-            await db.orders.update_one(
+            previous = await db.orders.find_one_and_update(
                 {"id": request.order_id},
                 {"$set": {
                     "tracking_number": transaction.tracking_number,
                     "label_url": transaction.label_url,
                     "carrier": transaction.rate.provider if transaction.rate else None,
                     "status": "processing",
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
+                    "updated_at": datetime.now(timezone.utc)
+                }},
+                projection={"_id": 0, "status": 1, "created_at": 1, "total": 1, "items": 1}
             )
+            if previous:
+                await record_order_rollup(previous, previous.get('status'), "processing")
             
             return ShippingLabelResponse(
                 success=True,
@@ -2718,6 +5480,11 @@ async def create_shipping_label(request: CreateLabelRequest):
                 message=f"Label creation failed: {transaction.messages}"
             )
         
+    except ShippingGatewayError as e:
+        if e.kind == "timeout":
+            # The purchase may still complete on Shippo's side; buying again could double-charge
+            e.message += "; the label may still have been purchased, check Shippo before retrying"
+        raise
     except Exception as e:
         logger.error(f"Error creating label: {str(e)}")
         return ShippingLabelResponse(
@@ -2730,11 +5497,10 @@ async def get_tracking_status(carrier: str, tracking_number: str):
     """
     Get tracking status for a shipment.
     """
-    if not shippo_client:
-        raise HTTPException(status_code=500, detail="Shipping service not configured")
-    
     try:
-        tracking = shippo_client.track.get_status(
+        tracking = await call_shippo(
+            "tracking",
+            "track.get_status",
             carrier=carrier.lower(),
             tracking_number=tracking_number
         )
@@ -2758,6 +5524,8 @@ async def get_tracking_status(carrier: str, tracking_number: str):
             ]
         }
         
+    except ShippingGatewayError:
+        raise
     except Exception as e:
         logger.error(f"Error getting tracking: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Error getting tracking: {str(e)}")
@@ -2838,18 +5606,19 @@ async def get_admin_stats(request: Request):
     
     total_users = await db.users.count_documents({})
     total_subscribers = await db.email_subscriptions.count_documents({})
-    total_orders = await db.orders.count_documents({})
+    order_buckets = await db.orders_rollup.find({}, {"orders": 1}).to_list(None)
+    total_orders = sum(bucket['orders'] for bucket in order_buckets)
     total_waitlist = await db.waitlist.count_documents({})
     
     # Get giveaway entries count (subscribers from giveaway popup)
     total_giveaway = await db.email_subscriptions.count_documents({"source": "giveaway_popup"})
     
     # Get recent signups (last 7 days)
-    week_ago = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
-    recent_users = await db.users.count_documents({"created_at": {"$gte": week_ago}})
-    recent_subscribers = await db.email_subscriptions.count_documents({"timestamp": {"$gte": week_ago}})
-    recent_giveaway = await db.email_subscriptions.count_documents({"source": "giveaway_popup", "timestamp": {"$gte": week_ago}})
-    recent_waitlist = await db.waitlist.count_documents({"created_at": {"$gte": week_ago}})
+    week_ago = datetime.now(timezone.utc) - timedelta(days=7)
+    recent_users = await db.users.count_documents(date_range("created_at", gte=week_ago))
+    recent_subscribers = await db.email_subscriptions.count_documents(date_range("timestamp", gte=week_ago))
+    recent_giveaway = await db.email_subscriptions.count_documents({"source": "giveaway_popup", **date_range("timestamp", gte=week_ago)})
+    recent_waitlist = await db.waitlist.count_documents(date_range("created_at", gte=week_ago))
     
     return {
         "total_users": total_users,
@@ -2863,27 +5632,109 @@ async def get_admin_stats(request: Request):
         "recent_waitlist_7d": recent_waitlist
     }
 
+# Admin listings page by (sort field, id) keyset. Pass the returned next_cursor back
+# as ?cursor= to fetch the following page without skipping over earlier documents.
+PAGE_COUNT_MODE_PATTERN = "^(exact|estimated|cached|none)$"
+PAGE_COUNT_CACHE_TTL_SECONDS = 30
+page_count_cache: TTLCache = TTLCache(maxsize=256, ttl=PAGE_COUNT_CACHE_TTL_SECONDS)
+
+def encode_page_cursor(sort_value, id_value) -> str:
+    """Encode the last row's (sort value, id) as an opaque continuation token"""
+    if isinstance(sort_value, datetime):
+        sort_value = {"$date": sort_value.isoformat()}
+    raw = json.dumps({"v": sort_value, "id": id_value}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_page_cursor(token: str):
+    """Decode a continuation token back into (sort value, id)"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        data = json.loads(raw)
+        sort_value = data["v"]
+        if isinstance(sort_value, dict) and "$date" in sort_value:
+            sort_value = datetime.fromisoformat(sort_value["$date"])
+        return sort_value, data["id"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def count_listing(collection, query: dict, mode: str) -> Optional[int]:
+    """Count a listing: exact, estimated (collection metadata), cached (exact, reused for 30s) or none"""
+    if mode == "none":
+        return None
+    if mode == "estimated" and not query:
+        return await collection.estimated_document_count()
+    if mode == "cached":
+        key = f"{collection.name}:{json.dumps(query, sort_keys=True, default=str)}"
+        if key not in page_count_cache:
+            page_count_cache[key] = await collection.count_documents(query)
+        return page_count_cache[key]
+    return await collection.count_documents(query)
+
+async def list_page(collection, query: dict, projection: dict, sort_field: str, id_field: str,
+                    skip: int, limit: int, cursor: Optional[str], count_mode: str) -> dict:
+    """Fetch one page sorted by (sort_field, id_field) descending, by keyset cursor or skip"""
+    page_query = query
+    if cursor:
+        sort_value, id_value = decode_page_cursor(cursor)
+        after = {"$or": [
+            {sort_field: {"$lt": sort_value}},
+            {sort_field: sort_value, id_field: {"$lt": id_value}}
+        ]}
+        if isinstance(sort_value, datetime) and date_storage["legacy_strings"]:
+            # Legacy string dates sort below every BSON date, so they all come after a date cursor
+            after["$or"].append({sort_field: {"$type": "string"}})
+        page_query = {"$and": [query, after]} if query else after
+        skip = 0
+    
+    find = collection.find(page_query, projection).sort([(sort_field, -1), (id_field, -1)])
+    if skip:
+        find = find.skip(skip)
+    items, total = await asyncio.gather(
+        find.limit(limit).to_list(limit),
+        count_listing(collection, query, count_mode)
+    )
+    
+    next_cursor = None
+    if limit and len(items) == limit:
+        last = items[-1]
+        next_cursor = encode_page_cursor(last.get(sort_field), last.get(id_field))
+    
+    return {"items": items, "total": total, "skip": skip, "limit": limit, "next_cursor": next_cursor}
+
 @api_router.get("/admin/users")
-async def get_all_users(request: Request, skip: int = 0, limit: int = 100):
+async def get_all_users(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    count: str = Query("cached", pattern=PAGE_COUNT_MODE_PATTERN)
+):
     """Get all registered users"""
     await verify_admin(request)
     
-    users = await db.users.find(
-        {}, 
-        {"_id": 0, "password_hash": 0}  # Exclude sensitive data
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    
-    total = await db.users.count_documents({})
+    page = await list_page(
+        db.users, {},
+        {"_id": 0, "password_hash": 0},  # Exclude sensitive data
+        "created_at", "user_id", skip, limit, cursor, count
+    )
     
-    return {
-        "users": users,
-        "total": total,
-        "skip": skip,
-        "limit": limit
-    }
+    return fast_response({
+        "users": page["items"],
+        "total": page["total"],
+        "skip": page["skip"],
+        "limit": limit,
+        "next_cursor": page["next_cursor"]
+    }, request)
 
 @api_router.get("/admin/subscribers")
-async def get_all_subscribers(request: Request, source: Optional[str] = None, skip: int = 0, limit: int = 100):
+async def get_all_subscribers(
+    request: Request,
+    source: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    count: str = Query("cached", pattern=PAGE_COUNT_MODE_PATTERN)
+):
     """Get all email subscribers"""
     await verify_admin(request)
     
@@ -2891,56 +5742,100 @@ async def get_all_subscribers(request: Request, source: Optional[str] = None, sk
     if source:
         query["source"] = source
     
-    subscribers = await db.email_subscriptions.find(
-        query, 
-        {"_id": 0}
-    ).sort("timestamp", -1).skip(skip).limit(limit).to_list(limit)
-    
-    total = await db.email_subscriptions.count_documents(query)
+    page = await list_page(db.email_subscriptions, query, {"_id": 0}, "timestamp", "id", skip, limit, cursor, count)
     
-    return {
-        "subscribers": subscribers,
-        "total": total,
-        "skip": skip,
-        "limit": limit
-    }
+    return fast_response({
+        "subscribers": page["items"],
+        "total": page["total"],
+        "skip": page["skip"],
+        "limit": limit,
+        "next_cursor": page["next_cursor"]
+    }, request)
 
 @api_router.get("/admin/waitlist")
-async def get_all_waitlist(request: Request, skip: int = 0, limit: int = 100):
+async def get_all_waitlist(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    count: str = Query("cached", pattern=PAGE_COUNT_MODE_PATTERN)
+):
     """Get all waitlist entries"""
     await verify_admin(request)
     
-    entries = await db.waitlist.find(
-        {}, 
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    
-    total = await db.waitlist.count_documents({})
+    page = await list_page(db.waitlist, {}, {"_id": 0}, "created_at", "id", skip, limit, cursor, count)
     
-    return {
-        "waitlist": entries,
-        "total": total,
-        "skip": skip,
-        "limit": limit
-    }
+    return fast_response({
+        "waitlist": page["items"],
+        "total": page["total"],
+        "skip": page["skip"],
+        "limit": limit,
+        "next_cursor": page["next_cursor"]
+    }, request)
 
 @api_router.get("/admin/orders")
-async def get_all_orders(request: Request, skip: int = 0, limit: int = 100):
+async def get_all_orders(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    count: str = Query("cached", pattern=PAGE_COUNT_MODE_PATTERN)
+):
     """Get all orders"""
     await verify_admin(request)
     
-    orders = await db.orders.find(
-        {}, 
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    page = await list_page(db.orders, {}, {"_id": 0}, "created_at", "id", skip, limit, cursor, count)
+    
+    return fast_response({
+        "orders": page["items"],
+        "total": page["total"],
+        "skip": page["skip"],
+        "limit": limit,
+        "next_cursor": page["next_cursor"]
+    }, request)
+
+@api_router.post("/admin/orders/rollup/rebuild")
+async def rebuild_orders_rollup_endpoint(request: Request):
+    """Recompute the order analytics rollups from the orders collection"""
+    await verify_admin(request)
     
-    total = await db.orders.count_documents({})
+    buckets = await rebuild_orders_rollup()
+    return {"success": True, "buckets": buckets}
+
+@api_router.get("/promo/{code}/redemptions")
+async def list_promo_redemptions(
+    code: str,
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    count: str = Query("cached", pattern=PAGE_COUNT_MODE_PATTERN)
+):
+    """Redemption log for one promo code, newest first (admin)"""
+    await verify_admin(request)
+    code = code.upper()
+    
+    promo = await db.promo_codes.find_one({"code": code}, {"_id": 0})
+    if not promo:
+        raise HTTPException(status_code=404, detail="Promo code not found")
+    
+    uses = promo.get('uses', promo.get('current_uses', 0)) or 0
+    if promo.get('usage_shards'):
+        # Live total rather than the last roll-up
+        uses = (promo.get('base_uses') or 0) + (await promo_shard_totals([code])).get(code, 0)
+    
+    page = await list_page(db.promo_redemptions, {"code": code}, {"_id": 0}, "created_at", "id", skip, limit, cursor, count)
     
     return {
-        "orders": orders,
-        "total": total,
-        "skip": skip,
-        "limit": limit
+        "code": code,
+        "uses": uses,
+        "max_uses": promo.get('max_uses'),
+        "usage_shards": promo.get('usage_shards') or 0,
+        "redemptions": page["items"],
+        "total": page["total"],
+        "skip": page["skip"],
+        "limit": limit,
+        "next_cursor": page["next_cursor"]
     }
 
 @api_router.post("/admin/send-bulk-email")
@@ -2988,32 +5883,31 @@ async def send_bulk_email(request: Request, email_request: BulkEmailRequest):
     }
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                N8N_BULK_EMAIL_WEBHOOK_URL,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=30.0
-            )
-            
-            if response.status_code == 200:
-                logger.info(f"Bulk email webhook sent for {len(emails)} recipients")
-                return {
-                    "success": True,
-                    "message": f"Bulk email request sent to n8n",
-                    "sent_count": len(emails),
-                    "failed_count": 0,
-                    "total_recipients": len(emails)
-                }
-            else:
-                logger.error(f"Bulk email webhook returned status {response.status_code}")
-                return {
-                    "success": False,
-                    "message": f"Webhook failed with status {response.status_code}",
-                    "sent_count": 0,
-                    "failed_count": len(emails),
-                    "total_recipients": len(emails)
-                }
+        response = await get_http_client("n8n").post(
+            N8N_BULK_EMAIL_WEBHOOK_URL,
+            json=payload,
+            headers={"Content-Type": "application/json"},
+            timeout=30.0  # Large recipient lists take longer than a normal webhook
+        )
+        
+        if response.status_code == 200:
+            logger.info(f"Bulk email webhook sent for {len(emails)} recipients")
+            return {
+                "success": True,
+                "message": f"Bulk email request sent to n8n",
+                "sent_count": len(emails),
+                "failed_count": 0,
+                "total_recipients": len(emails)
+            }
+        else:
+            logger.error(f"Bulk email webhook returned status {response.status_code}")
+            return {
+                "success": False,
+                "message": f"Webhook failed with status {response.status_code}",
+                "sent_count": 0,
+                "failed_count": len(emails),
+                "total_recipients": len(emails)
+            }
     except Exception as e:
         logger.error(f"Failed to send bulk email webhook: {str(e)}")
         return {
@@ -3024,6 +5918,185 @@ async def send_bulk_email(request: Request, email_request: BulkEmailRequest):
             "total_recipients": len(emails)
         }
 
+@api_router.get("/admin/metrics/password-hashing")
+async def get_password_hashing_metrics(request: Request):
+    """Get password hashing pool queue depth and throughput"""
+    await verify_admin(request)
+    
+    completed = password_hash_stats["completed"]
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "max_concurrency": PASSWORD_HASH_MAX_CONCURRENCY,
+        "queue_depth": password_hash_stats["queued"],
+        "running": password_hash_stats["running"],
+        "peak_queue_depth": password_hash_stats["peak_queued"],
+        "completed": completed,
+        "avg_wait_ms": round(password_hash_stats["total_wait_seconds"] / completed * 1000, 2) if completed else 0
+    }
+
+@api_router.get("/admin/metrics/http-pools")
+async def get_http_pool_metrics(request: Request):
+    """Get outbound HTTP connection pool statistics per upstream"""
+    await verify_admin(request)
+    
+    return {"pools": get_http_pool_stats()}
+
+@api_router.get("/admin/metrics/shippo")
+async def get_shippo_metrics(request: Request):
+    """Get Shippo gateway concurrency, timeouts and latency per operation"""
+    await verify_admin(request)
+    
+    return {
+        "workers": SHIPPO_WORKERS,
+        "timeout_seconds": SHIPPO_TIMEOUT_SECONDS,
+        "fake": SHIPPO_FAKE,
+        "operations": get_shippo_stats()
+    }
+
+@api_router.get("/admin/webhooks/outbox")
+async def get_webhook_outbox_stats(request: Request):
+    """Get webhook outbox backlog depth and recent delivery latency"""
+    await verify_admin(request)
+    
+    by_status = await db.webhook_outbox.aggregate([
+        {"$group": {"_id": {"endpoint": "$endpoint", "status": "$status"}, "count": {"$sum": 1}}}
+    ]).to_list(100)
+    
+    endpoints = {}
+    totals = {"pending": 0, "in_flight": 0, "delivered": 0, "dead": 0}
+    for row in by_status:
+        endpoint = endpoints.setdefault(row["_id"]["endpoint"], {"pending": 0, "in_flight": 0, "delivered": 0, "dead": 0})
+        endpoint[row["_id"]["status"]] = row["count"]
+        totals[row["_id"]["status"]] = totals.get(row["_id"]["status"], 0) + row["count"]
+    
+    oldest_pending_age_seconds = None
+    oldest = await db.webhook_outbox.find_one(
+        {"status": {"$in": ["pending", "in_flight"]}}, {"_id": 0, "created_at": 1}, sort=[("created_at", 1)]
+    )
+    if oldest:
+        created_at = oldest["created_at"]
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        oldest_pending_age_seconds = round((datetime.now(timezone.utc) - created_at).total_seconds(), 1)
+    
+    # Delivery latency (enqueue -> delivered) over the most recent deliveries
+    recent = await db.webhook_outbox.aggregate([
+        {"$match": {"status": "delivered"}},
+        {"$sort": {"delivered_at": -1}},
+        {"$limit": 500},
+        {"$project": {"_id": 0, "latency_ms": {"$subtract": ["$delivered_at", "$created_at"]}}}
+    ]).to_list(500)
+    latencies = sorted(row["latency_ms"] for row in recent)
+    latency = None
+    if latencies:
+        latency = {
+            "samples": len(latencies),
+            "p50_ms": latencies[len(latencies) // 2],
+            "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "max_ms": latencies[-1]
+        }
+    
+    return {
+        "backlog": totals["pending"] + totals["in_flight"],
+        "totals": totals,
+        "endpoints": endpoints,
+        "oldest_pending_age_seconds": oldest_pending_age_seconds,
+        "delivery_latency": latency,
+        "in_flight_deliveries": len(webhook_outbox_deliveries),
+        "concurrency": WEBHOOK_OUTBOX_CONCURRENCY,
+        "batch_endpoints": sorted(WEBHOOK_OUTBOX_BATCH_ENDPOINTS)
+    }
+
+@api_router.post("/admin/webhooks/outbox/retry-dead")
+async def retry_dead_webhooks(request: Request, endpoint: Optional[str] = None):
+    """Move dead-lettered webhooks back to pending"""
+    await verify_admin(request)
+    
+    query = {"status": "dead"}
+    if endpoint:
+        query["endpoint"] = endpoint
+    
+    result = await db.webhook_outbox.update_many(
+        query,
+        {"$set": {"status": "pending", "attempts": 0, "next_attempt_at": datetime.now(timezone.utc)}}
+    )
+    webhook_outbox_wakeup.set()
+    
+    return {"success": True, "requeued": result.modified_count}
+
+@api_router.get("/admin/metrics/shipping-quotes")
+async def get_shipping_quote_metrics(request: Request):
+    """Get shipping rate quote cache hit rate and size"""
+    await verify_admin(request)
+    
+    requests_total = shipping_quote_stats["hits"] + shipping_quote_stats["misses"]
+    return {
+        **shipping_quote_stats,
+        "entries": len(shipping_quote_cache),
+        "max_entries": SHIPPING_QUOTE_CACHE_SIZE,
+        "ttl_seconds": SHIPPING_QUOTE_CACHE_TTL_SECONDS,
+        "precision": SHIPPING_QUOTE_PRECISION,
+        "hit_rate": round(shipping_quote_stats["hits"] / requests_total, 4) if requests_total else None
+    }
+
+@api_router.get("/admin/metrics/image-cache")
+async def get_image_cache_metrics(request: Request):
+    """Get proxy image cache hit rates and sizes"""
+    await verify_admin(request)
+    
+    requests_total = image_cache_stats["memory_hits"] + image_cache_stats["disk_hits"] + image_cache_stats["misses"]
+    return {
+        **image_cache_stats,
+        "memory_entries": len(image_memory_cache),
+        "disk_entries": len(image_disk_index),
+        "memory_budget_bytes": IMAGE_CACHE_MEMORY_BYTES,
+        "disk_budget_bytes": IMAGE_CACHE_DISK_BYTES,
+        "hit_rate": round((requests_total - image_cache_stats["misses"]) / requests_total, 4) if requests_total else None,
+        "avif_supported": IMAGE_AVIF_SUPPORTED,
+        "webp_supported": IMAGE_WEBP_SUPPORTED
+    }
+
+@api_router.get("/admin/indexes")
+async def get_index_usage(request: Request):
+    """Report index usage ($indexStats) and missing registered indexes per collection"""
+    await verify_admin(request)
+    
+    collections = {}
+    for collection_name, indexes in INDEX_REGISTRY.items():
+        stats = await db[collection_name].aggregate([{"$indexStats": {}}]).to_list(100)
+        present = {stat["name"] for stat in stats}
+        collections[collection_name] = {
+            "indexes": [
+                {
+                    "name": stat["name"],
+                    "key": stat.get("key"),
+                    "ops": stat.get("accesses", {}).get("ops", 0),
+                    "since": stat.get("accesses", {}).get("since")
+                }
+                for stat in stats
+            ],
+            "missing": [index.document["name"] for index in indexes if index.document["name"] not in present]
+        }
+    
+    return {"collections": collections}
+
+@api_router.get("/admin/indexes/verify")
+async def verify_indexes(request: Request):
+    """Explain each hot query and report any collection scans (503 if there are any, for health checks)"""
+    await verify_admin(request)
+    
+    results = await verify_hot_query_plans()
+    collscans = [result["name"] for result in results if result["collscan"]]
+    
+    return ORJSONResponse(
+        status_code=503 if collscans else 200,
+        content={
+            "success": not collscans,
+            "collscans": collscans,
+            "queries": results
+        }
+    )
+
 @api_router.delete("/admin/subscriber/{email}")
 async def delete_subscriber(request: Request, email: str):
     """Delete a subscriber"""
@@ -3046,6 +6119,7 @@ async def delete_user(request: Request, user_id: str):
     
     # Delete user
     result = await db.users.delete_one({"user_id": user_id})
+    invalidate_session_cache(user_id=user_id)
     
     return {
         "success": True,
@@ -3079,9 +6153,153 @@ else:
 # LIVE VISITOR TRACKING
 # ============================================
 
-# In-memory storage for active visitors (with last activity timestamp)
-active_visitors: Dict[str, datetime] = {}
 VISITOR_TIMEOUT_SECONDS = 60  # Consider visitor inactive after 60 seconds
+VISITOR_WHEEL_SLOT_SECONDS = 1  # Expiry granularity of the timing wheel
+VISITOR_TRACKER_BACKEND = os.environ.get('VISITOR_TRACKER_BACKEND', 'local')  # "local" or "mongo" (shared by all workers)
+VISITOR_FLUSH_SECONDS = 5  # Mongo backend: how often buffered heartbeats are written
+VISITOR_COUNT_CACHE_SECONDS = 5  # Mongo backend: how long a shared count is reused
+VISITOR_HISTORY_MINUTES = 24 * 60
+
+class LocalVisitorTracker:
+    """
+    In-process visitor presence on a timing wheel: visitors sit in the slot of
+    their last heartbeat and whole slots expire at once, so heartbeats and counts
+    are O(1) (expiry is amortized O(1) per visitor). Counts only this worker.
+    """
+    
+    def __init__(self, timeout_seconds: int = VISITOR_TIMEOUT_SECONDS, slot_seconds: int = VISITOR_WHEEL_SLOT_SECONDS):
+        self.timeout_slots = max(1, timeout_seconds // slot_seconds)
+        self.slot_seconds = slot_seconds
+        self.slots: Dict[int, set] = {}
+        self.last_slot: Dict[str, int] = {}
+        self.oldest_slot: Optional[int] = None
+    
+    def current_slot(self) -> int:
+        return int(datetime.now(timezone.utc).timestamp()) // self.slot_seconds
+    
+    def expire(self) -> int:
+        """Drop every slot older than the timeout; returns the current slot"""
+        now = self.current_slot()
+        cutoff = now - self.timeout_slots
+        if self.oldest_slot is not None:
+            if cutoff - self.oldest_slot > len(self.slots):
+                # Long idle gap: walk the populated slots instead of every empty one
+                stale = [slot for slot in self.slots if slot < cutoff]
+            else:
+                stale = range(self.oldest_slot, cutoff)
+            for slot in stale:
+                for visitor_id in self.slots.pop(slot, ()):
+                    del self.last_slot[visitor_id]
+            self.oldest_slot = max(self.oldest_slot, cutoff)
+        return now
+    
+    async def heartbeat(self, visitor_id: str):
+        now = self.expire()
+        previous = self.last_slot.get(visitor_id)
+        if previous == now:
+            return
+        if previous is not None:
+            self.slots[previous].discard(visitor_id)
+        self.slots.setdefault(now, set()).add(visitor_id)
+        self.last_slot[visitor_id] = now
+        if self.oldest_slot is None:
+            self.oldest_slot = now
+    
+    async def count(self) -> int:
+        self.expire()
+        return len(self.last_slot)
+    
+    async def visitors(self, limit: int = 1000) -> List[dict]:
+        self.expire()
+        return [
+            {"id": visitor_id, "last_seen": datetime.fromtimestamp(slot * self.slot_seconds, timezone.utc).isoformat()}
+            for visitor_id, slot in islice(self.last_slot.items(), limit)
+        ]
+    
+    async def flush(self):
+        pass
+
+class MongoVisitorTracker(LocalVisitorTracker):
+    """
+    Presence shared by every worker through db.visitor_presence. Heartbeats go to
+    the local wheel and are written in one bulk upsert every few seconds; counts
+    are a cached count of documents seen within the timeout. A TTL index removes
+    expired documents.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self.pending: Dict[str, datetime] = {}
+        self.cached_count: Optional[int] = None
+        self.counted_at = 0.0
+    
+    async def heartbeat(self, visitor_id: str):
+        await super().heartbeat(visitor_id)
+        self.pending[visitor_id] = datetime.now(timezone.utc)
+    
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        try:
+            await db.visitor_presence.bulk_write(
+                [UpdateOne({"_id": visitor_id}, {"$max": {"last_seen": seen}}, upsert=True) for visitor_id, seen in batch.items()],
+                ordered=False
+            )
+        except Exception:
+            for visitor_id, seen in batch.items():
+                self.pending.setdefault(visitor_id, seen)
+            raise
+    
+    async def load_count(self) -> int:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=VISITOR_TIMEOUT_SECONDS)
+        self.cached_count = await db.visitor_presence.count_documents({"last_seen": {"$gte": cutoff}})
+        self.counted_at = asyncio.get_running_loop().time()
+        return self.cached_count
+    
+    async def count(self) -> int:
+        if self.cached_count is None or asyncio.get_running_loop().time() - self.counted_at > VISITOR_COUNT_CACHE_SECONDS:
+            await single_flight("visitor_count", self.load_count)
+        return self.cached_count
+    
+    async def visitors(self, limit: int = 1000) -> List[dict]:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=VISITOR_TIMEOUT_SECONDS)
+        docs = await db.visitor_presence.find({"last_seen": {"$gte": cutoff}}).limit(limit).to_list(limit)
+        return [
+            {"id": doc["_id"], "last_seen": doc["last_seen"].replace(tzinfo=doc["last_seen"].tzinfo or timezone.utc).isoformat()}
+            for doc in docs
+        ]
+
+visitor_tracker = MongoVisitorTracker() if VISITOR_TRACKER_BACKEND == "mongo" else LocalVisitorTracker()
+
+# Per-minute concurrency history (ring buffer) and all-time peak, sampled by visitor_tracker_worker
+visitor_history: deque = deque(maxlen=VISITOR_HISTORY_MINUTES)
+visitor_peak = {"count": 0, "at": None}
+
+def record_visitor_sample(count: int):
+    """Fold a count sample into the per-minute series and the peak"""
+    now = datetime.now(timezone.utc)
+    minute = now.replace(second=0, microsecond=0).isoformat()
+    if visitor_history and visitor_history[-1]["minute"] == minute:
+        entry = visitor_history[-1]
+        entry["peak"] = max(entry["peak"], count)
+        entry["last"] = count
+    else:
+        visitor_history.append({"minute": minute, "peak": count, "last": count})
+    if count > visitor_peak["count"]:
+        visitor_peak.update(count=count, at=now.isoformat())
+
+async def visitor_tracker_worker():
+    """Flush buffered heartbeats and sample the count for the history"""
+    while True:
+        try:
+            await visitor_tracker.flush()
+            record_visitor_sample(await visitor_tracker.count())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Visitor tracker error: {str(e)}")
+        await asyncio.sleep(VISITOR_FLUSH_SECONDS)
 
 @api_router.post("/visitors/heartbeat")
 async def visitor_heartbeat(request: Request):
@@ -3091,31 +6309,17 @@ async def visitor_heartbeat(request: Request):
     if not visitor_id:
         visitor_id = str(uuid.uuid4())
     
-    # Update last activity
-    active_visitors[visitor_id] = datetime.now(timezone.utc)
-    
-    # Clean up inactive visitors
-    cutoff = datetime.now(timezone.utc) - timedelta(seconds=VISITOR_TIMEOUT_SECONDS)
-    inactive = [vid for vid, last_seen in active_visitors.items() if last_seen < cutoff]
-    for vid in inactive:
-        del active_visitors[vid]
+    await visitor_tracker.heartbeat(visitor_id)
     
     return {"visitor_id": visitor_id, "active": True}
 
 @api_router.get("/visitors/count")
 async def get_visitor_count():
     """Get current live visitor count (admin only endpoint but count is public for owner)"""
-    # Clean up inactive visitors first
-    cutoff = datetime.now(timezone.utc) - timedelta(seconds=VISITOR_TIMEOUT_SECONDS)
-    inactive = [vid for vid, last_seen in active_visitors.items() if last_seen < cutoff]
-    for vid in inactive:
-        del active_visitors[vid]
-    
-    return {"count": len(active_visitors), "timestamp": datetime.now(timezone.utc).isoformat()}
+    return {"count": await visitor_tracker.count(), "timestamp": datetime.now(timezone.utc).isoformat()}
 
-@api_router.get("/admin/visitors")
-async def admin_get_visitors(admin_token: str = Cookie(default=None)):
-    """Get detailed visitor info (admin only)"""
+async def verify_admin_cookie(admin_token: Optional[str]):
+    """Admin check for endpoints authenticated by the admin_token cookie"""
     if not admin_token:
         raise HTTPException(status_code=401, detail="Admin authentication required")
     
@@ -3123,19 +6327,176 @@ async def admin_get_visitors(admin_token: str = Cookie(default=None)):
     session = await db.admin_sessions.find_one({"token": admin_token})
     if not session:
         raise HTTPException(status_code=401, detail="Invalid admin session")
-    
-    # Clean up inactive visitors
-    cutoff = datetime.now(timezone.utc) - timedelta(seconds=VISITOR_TIMEOUT_SECONDS)
-    inactive = [vid for vid, last_seen in active_visitors.items() if last_seen < cutoff]
-    for vid in inactive:
-        del active_visitors[vid]
+
+@api_router.get("/admin/visitors")
+async def admin_get_visitors(admin_token: str = Cookie(default=None)):
+    """Get detailed visitor info (admin only)"""
+    await verify_admin_cookie(admin_token)
     
     return {
-        "count": len(active_visitors),
-        "visitors": [{"id": vid, "last_seen": last_seen.isoformat()} for vid, last_seen in active_visitors.items()],
+        "count": await visitor_tracker.count(),
+        "visitors": await visitor_tracker.visitors(),
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
 
+@api_router.get("/admin/visitors/history")
+async def admin_get_visitor_history(minutes: int = Query(60, ge=1, le=VISITOR_HISTORY_MINUTES), admin_token: str = Cookie(default=None)):
+    """Per-minute peak concurrent visitors and the all-time peak (admin only)"""
+    await verify_admin_cookie(admin_token)
+    
+    return {
+        "backend": VISITOR_TRACKER_BACKEND,
+        "peak": visitor_peak,
+        "series": list(visitor_history)[-minutes:]
+    }
+
+# ============================================
+# LIVE EVENTS (SSE)
+# ============================================
+
+# /events/live streams visitor count, waitlist spots and per-variant stock to every
+# connected client. The hub computes one snapshot per tick and encodes it once;
+# each subscriber only holds the latest tick number (Queue(maxsize=1)), so a slow
+# client skips ticks and catches up with a full snapshot instead of a backlog.
+LIVE_EVENTS_TICK_SECONDS = float(os.environ.get('LIVE_EVENTS_TICK_SECONDS', '2'))
+LIVE_EVENTS_KEEPALIVE_SECONDS = 15
+LIVE_EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('LIVE_EVENTS_MAX_SUBSCRIBERS', '20000'))
+
+live_subscribers: set = set()
+live_state = {
+    "seq": 0,
+    "snapshot": None,    # Last published state
+    "full_frame": None,  # (seq, encoded "snapshot" event)
+    "diff_frame": None,  # Encoded "update" event taking seq - 1 to seq
+}
+live_stats = {"ticks": 0, "published": 0, "compute_seconds": 0.0}
+
+def encode_live_frame(event: str, seq: int, data: dict) -> bytes:
+    """One SSE frame"""
+    return f"id: {seq}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+async def compute_live_snapshot() -> dict:
+    """Everything the live stream publishes, computed once for all subscribers"""
+    visitors, waitlist_stats, waitlist_status, inventory = await asyncio.gather(
+        get_visitor_count(), get_waitlist_stats(), get_waitlist_status(), get_inventory_snapshot()
+    )
+    return {
+        "visitors": visitors["count"],
+        "waitlist": {
+            "total_waitlist": waitlist_stats["total_waitlist"],
+            "progress": waitlist_stats["progress"],
+            "spots_taken": waitlist_status["spots_taken"],
+            "spots_remaining": waitlist_status["spots_remaining"],
+            "is_full": waitlist_status["is_full"]
+        },
+        "stock": {
+            f"{key[0]}:{key[1]}:{key[2]}": {"available": entry["available"], "low_stock": entry["low_stock"]}
+            for key, entry in inventory["variants"].items()
+        }
+    }
+
+def diff_live_snapshot(previous: dict, current: dict) -> dict:
+    """Fields of current that changed since previous (stock diffed per variant)"""
+    changes = {key: value for key, value in current.items() if key != "stock" and previous.get(key) != value}
+    stock = {
+        variant: value for variant, value in current["stock"].items()
+        if previous["stock"].get(variant) != value
+    }
+    stock.update({variant: None for variant in previous["stock"] if variant not in current["stock"]})
+    if stock:
+        changes["stock"] = stock
+    return changes
+
+def live_full_frame() -> bytes:
+    """Full snapshot frame for the current tick, encoded at most once per tick"""
+    seq = live_state["seq"]
+    cached = live_state["full_frame"]
+    if cached is None or cached[0] != seq:
+        cached = live_state["full_frame"] = (seq, encode_live_frame("snapshot", seq, live_state["snapshot"]))
+    return cached[1]
+
+async def publish_live_tick():
+    """Compute the snapshot and wake subscribers if anything changed"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    snapshot = await compute_live_snapshot()
+    live_stats["ticks"] += 1
+    live_stats["compute_seconds"] += loop.time() - started
+    
+    previous = live_state["snapshot"]
+    changes = diff_live_snapshot(previous, snapshot) if previous else snapshot
+    if previous and not changes:
+        return
+    
+    seq = live_state["seq"] + 1
+    live_state.update(
+        seq=seq,
+        snapshot=snapshot,
+        diff_frame=encode_live_frame("update", seq, changes)
+    )
+    live_stats["published"] += 1
+    for queue in live_subscribers:
+        if queue.full():
+            queue.get_nowait()  # Drop the stale tick, the subscriber will get a full snapshot
+        queue.put_nowait(seq)
+
+async def live_events_hub():
+    """Background loop publishing one tick at a time while anyone is subscribed"""
+    while True:
+        try:
+            if live_subscribers:
+                await publish_live_tick()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Live events hub error: {str(e)}")
+        await asyncio.sleep(LIVE_EVENTS_TICK_SECONDS)
+
+async def iter_live_events(queue: asyncio.Queue):
+    """Frames for one subscriber: a snapshot first, then diffs (or a snapshot after skipped ticks)"""
+    live_subscribers.add(queue)
+    try:
+        if live_state["snapshot"] is None:
+            await single_flight("live_snapshot", publish_live_tick)
+        last_seq = live_state["seq"]
+        yield f"retry: {int(LIVE_EVENTS_TICK_SECONDS * 1000) * 2}\n".encode() + live_full_frame()
+        while True:
+            try:
+                seq = await asyncio.wait_for(queue.get(), LIVE_EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if seq == last_seq + 1 and seq == live_state["seq"]:
+                yield live_state["diff_frame"]
+            elif seq > last_seq:
+                yield live_full_frame()
+            last_seq = live_state["seq"]
+    finally:
+        live_subscribers.discard(queue)
+
+@api_router.get("/events/live")
+async def live_events():
+    """Server-Sent Events stream of visitor count, waitlist spots and stock changes"""
+    if len(live_subscribers) >= LIVE_EVENTS_MAX_SUBSCRIBERS:
+        raise HTTPException(status_code=503, detail="Too many live subscribers, poll instead")
+    
+    return StreamingResponse(
+        iter_live_events(asyncio.Queue(maxsize=1)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/admin/metrics/live-events")
+async def get_live_events_metrics(request: Request):
+    """Subscriber count and per-tick compute cost of the live events hub"""
+    await verify_admin(request)
+    return {
+        "subscribers": len(live_subscribers),
+        "seq": live_state["seq"],
+        "tick_seconds": LIVE_EVENTS_TICK_SECONDS,
+        **live_stats
+    }
+
 # ============================================
 # ABANDONED CART PROCESSING
 # ============================================
@@ -3186,67 +6547,67 @@ async def process_abandoned_carts():
         # Get all unrecovered abandoned carts
         carts = await db.abandoned_carts.find({"recovered": False}).to_list(1000)
         
-        async with httpx.AsyncClient() as client:
-            for cart in carts:
-                created_at = cart.get("created_at", now)
-                hours_since_abandoned = (now - created_at).total_seconds() / 3600
-                
-                # Email 1: After 1 hour
-                if hours_since_abandoned >= 1 and not cart.get("email_1_sent"):
-                    payload = {
-                        "email": cart["email"],
-                        "cart_items": cart["cart_items"],
-                        "cart_total": cart["cart_total"],
-                        "email_sequence": 1,
-                        "timestamp": now.isoformat()
-                    }
-                    try:
-                        await client.post(WEBHOOK_ABANDONED_CART_1, json=payload, timeout=10.0)
-                        await db.abandoned_carts.update_one(
-                            {"id": cart["id"]},
-                            {"$set": {"email_1_sent": True, "email_1_sent_at": now}}
-                        )
-                        results["email_1"] += 1
-                    except Exception as e:
-                        logging.error(f"Failed to send abandoned cart email 1 for {cart['email']}: {e}")
-                
-                # Email 2: After 24 hours
-                elif hours_since_abandoned >= 24 and cart.get("email_1_sent") and not cart.get("email_2_sent"):
-                    payload = {
-                        "email": cart["email"],
-                        "cart_items": cart["cart_items"],
-                        "cart_total": cart["cart_total"],
-                        "email_sequence": 2,
-                        "timestamp": now.isoformat()
-                    }
-                    try:
-                        await client.post(WEBHOOK_ABANDONED_CART_2, json=payload, timeout=10.0)
-                        await db.abandoned_carts.update_one(
-                            {"id": cart["id"]},
-                            {"$set": {"email_2_sent": True, "email_2_sent_at": now}}
-                        )
-                        results["email_2"] += 1
-                    except Exception as e:
-                        logging.error(f"Failed to send abandoned cart email 2 for {cart['email']}: {e}")
-                
-                # Email 3: After 72 hours (3 days)
-                elif hours_since_abandoned >= 72 and cart.get("email_2_sent") and not cart.get("email_3_sent"):
-                    payload = {
-                        "email": cart["email"],
-                        "cart_items": cart["cart_items"],
-                        "cart_total": cart["cart_total"],
-                        "email_sequence": 3,
-                        "timestamp": now.isoformat()
-                    }
-                    try:
-                        await client.post(WEBHOOK_ABANDONED_CART_3, json=payload, timeout=10.0)
-                        await db.abandoned_carts.update_one(
-                            {"id": cart["id"]},
-                            {"$set": {"email_3_sent": True, "email_3_sent_at": now}}
-                        )
-                        results["email_3"] += 1
-                    except Exception as e:
-                        logging.error(f"Failed to send abandoned cart email 3 for {cart['email']}: {e}")
+        http_client = get_http_client("n8n")
+        for cart in carts:
+            created_at = cart.get("created_at", now)
+            hours_since_abandoned = (now - created_at).total_seconds() / 3600
+            
+            # Email 1: After 1 hour
+            if hours_since_abandoned >= 1 and not cart.get("email_1_sent"):
+                payload = {
+                    "email": cart["email"],
+                    "cart_items": cart["cart_items"],
+                    "cart_total": cart["cart_total"],
+                    "email_sequence": 1,
+                    "timestamp": now.isoformat()
+                }
+                try:
+                    await http_client.post(WEBHOOK_ABANDONED_CART_1, json=payload)
+                    await db.abandoned_carts.update_one(
+                        {"id": cart["id"]},
+                        {"$set": {"email_1_sent": True, "email_1_sent_at": now}}
+                    )
+                    results["email_1"] += 1
+                except Exception as e:
+                    logging.error(f"Failed to send abandoned cart email 1 for {cart['email']}: {e}")
+            
+            # Email 2: After 24 hours
+            elif hours_since_abandoned >= 24 and cart.get("email_1_sent") and not cart.get("email_2_sent"):
+                payload = {
+                    "email": cart["email"],
+                    "cart_items": cart["cart_items"],
+                    "cart_total": cart["cart_total"],
+                    "email_sequence": 2,
+                    "timestamp": now.isoformat()
+                }
+                try:
+                    await http_client.post(WEBHOOK_ABANDONED_CART_2, json=payload)
+                    await db.abandoned_carts.update_one(
+                        {"id": cart["id"]},
+                        {"$set": {"email_2_sent": True, "email_2_sent_at": now}}
+                    )
+                    results["email_2"] += 1
+                except Exception as e:
+                    logging.error(f"Failed to send abandoned cart email 2 for {cart['email']}: {e}")
+            
+            # Email 3: After 72 hours (3 days)
+            elif hours_since_abandoned >= 72 and cart.get("email_2_sent") and not cart.get("email_3_sent"):
+                payload = {
+                    "email": cart["email"],
+                    "cart_items": cart["cart_items"],
+                    "cart_total": cart["cart_total"],
+                    "email_sequence": 3,
+                    "timestamp": now.isoformat()
+                }
+                try:
+                    await http_client.post(WEBHOOK_ABANDONED_CART_3, json=payload)
+                    await db.abandoned_carts.update_one(
+                        {"id": cart["id"]},
+                        {"$set": {"email_3_sent": True, "email_3_sent_at": now}}
+                    )
+                    results["email_3"] += 1
+                except Exception as e:
+                    logging.error(f"Failed to send abandoned cart email 3 for {cart['email']}: {e}")
         
         return {
             "success": True,
@@ -3280,6 +6641,83 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_indexes():
+    failures = await ensure_indexes()
+    if failures:
+        logger.warning(f"Index bootstrap finished with failures: {failures}")
+    unique_failures = unique_index_failures(failures)
+    if unique_failures:
+        raise RuntimeError(f"Unique indexes could not be built: {', '.join(unique_failures)}")
+
+@app.on_event("startup")
+async def startup_http_clients():
+    for name in HTTP_UPSTREAMS:
+        get_http_client(name)
+
+@app.on_event("startup")
+async def startup_shippo():
+    if SHIPPO_FAKE:
+        logger.warning("SHIPPO_FAKE is set: shipping rates, labels and tracking are simulated")
+
+@app.on_event("startup")
+async def startup_image_cache():
+    await load_image_disk_index()
+
+@app.on_event("startup")
+async def startup_inventory():
+    await seed_inventory()
+    await load_inventory_snapshot()
+
+@app.on_event("startup")
+async def startup_date_storage():
+    await load_date_storage_state()
+
+@app.on_event("startup")
+async def startup_orders_rollup():
+    await backfill_orders_rollup()
+
+@app.on_event("startup")
+async def startup_promo_codes():
+    await seed_promo_codes()
+    await load_promo_index()
+
+@app.on_event("startup")
+async def startup_waitlist_counter():
+    await sync_waitlist_counter()
+
+@app.on_event("startup")
+async def startup_background_tasks():
+    start_background_task("webhook_outbox", webhook_outbox_worker())
+    start_background_task("inventory_hold_sweeper", inventory_hold_sweeper())
+    start_background_task("live_events", live_events_hub())
+    start_background_task("visitor_tracker", visitor_tracker_worker())
+    start_background_task("promo_usage_rollup", promo_usage_rollup_worker())
+    start_background_task("stripe_events", stripe_event_worker())
+    start_background_task("drop_lease_reconcile", reconcile_drop_leases_at_startup())
+    if DROP_MODE_ENABLED:
+        start_background_task("drop_mode_flusher", drop_mode_flusher())
+        start_background_task("drop_mode_maintenance", drop_mode_maintenance())
+    if INVENTORY_CHANGE_STREAM:
+        start_background_task("inventory_change_stream", inventory_change_stream_worker())
+
+@app.on_event("shutdown")
+async def shutdown_drop_mode():
+    if DROP_MODE_ENABLED:
+        await close_drop_pools()
+
+@app.on_event("shutdown")
+async def shutdown_background_tasks():
+    await stop_background_tasks()
+
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    await close_http_clients()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+    password_hash_executor.shutdown(wait=False)
+    shippo_executor.shutdown(wait=False)
+    if image_transcode_executor is not None:
+        image_transcode_executor.shutdown(wait=False)
\ No newline at end of file
@@ -1,4 +1,5 @@
 import React, { useState, useEffect, useRef } from 'react';
+import useLiveEvents from '../hooks/useLiveEvents';
 
 const LiveVisitorCounter = ({ isAdmin }) => {
   const [visitorCount, setVisitorCount] = useState(0);
@@ -43,9 +44,19 @@ const LiveVisitorCounter = ({ isAdmin }) => {
     return () => clearInterval(heartbeatInterval);
   }, [BACKEND_URL]);
 
-  // Fetch visitor count (only if admin)
+  // Visitor count is pushed over the live events stream (admin badge only)
+  const { live, status } = useLiveEvents(isAdmin);
+  const polling = status === 'closed' || status === 'unsupported';
+
+  useEffect(() => {
+    if (isAdmin && typeof live?.visitors === 'number') {
+      setVisitorCount(live.visitors);
+    }
+  }, [isAdmin, live?.visitors]);
+
+  // Fall back to polling the count when the stream isn't available
   useEffect(() => {
-    if (!isAdmin) return;
+    if (!isAdmin || !polling) return;
 
     const fetchVisitorCount = async () => {
       try {
@@ -66,7 +77,7 @@ const LiveVisitorCounter = ({ isAdmin }) => {
     const countInterval = setInterval(fetchVisitorCount, 10000);
 
     return () => clearInterval(countInterval);
-  }, [isAdmin, BACKEND_URL]);
+  }, [isAdmin, polling, BACKEND_URL]);
 
   // Only show for admin users
   if (!isAdmin) return null;
@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { Users } from 'lucide-react';
+import useLiveEvents from '../hooks/useLiveEvents';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL;
 
@@ -9,8 +10,25 @@ const WaitlistStats = () => {
     progress: 75 // Percentage to next drop
   });
   const [isAnimating, setIsAnimating] = useState(false);
+  const { live, status } = useLiveEvents();
+  const polling = status === 'closed' || status === 'unsupported';
 
+  // Live stream: the server pushes waitlist changes as they happen
   useEffect(() => {
+    if (!live?.waitlist) return;
+    setStats({
+      waitlistCount: live.waitlist.total_waitlist || 2847,
+      progress: live.waitlist.progress || 75
+    });
+    setIsAnimating(true);
+    const timeout = setTimeout(() => setIsAnimating(false), 500);
+    return () => clearTimeout(timeout);
+  }, [live?.waitlist]);
+
+  // Fallback when the live stream isn't available
+  useEffect(() => {
+    if (!polling) return;
+
     // Fetch actual stats from backend
     const fetchStats = async () => {
       try {
@@ -41,7 +59,7 @@ const WaitlistStats = () => {
     }, 30000); // Every 30 seconds
 
     return () => clearInterval(interval);
-  }, []);
+  }, [polling]);
 
   const formatNumber = (num) => {
     return num.toLocaleString();
@@ -0,0 +1,97 @@
+import { useEffect, useState } from 'react';
+
+// One shared EventSource for /api/events/live, however many components listen.
+// The server sends a full "snapshot" event on connect (and after skipped ticks)
+// followed by "update" events carrying only the fields that changed.
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+
+let source = null;
+let state = null;
+let status = 'connecting';
+const listeners = new Set();
+
+const notify = () => listeners.forEach((listener) => listener(state, status));
+
+const applyUpdate = (changes) => {
+  const next = { ...state, ...changes };
+  if (changes.stock) {
+    next.stock = { ...(state?.stock || {}) };
+    Object.entries(changes.stock).forEach(([variant, value]) => {
+      if (value === null) {
+        delete next.stock[variant];
+      } else {
+        next.stock[variant] = value;
+      }
+    });
+  }
+  state = next;
+};
+
+const connect = () => {
+  if (source || typeof window === 'undefined' || !window.EventSource) {
+    if (!source) {
+      status = 'unsupported';
+    }
+    return;
+  }
+
+  source = new EventSource(`${BACKEND_URL}/api/events/live`);
+  status = 'connecting';
+
+  source.addEventListener('snapshot', (event) => {
+    state = JSON.parse(event.data);
+    status = 'open';
+    notify();
+  });
+
+  source.addEventListener('update', (event) => {
+    applyUpdate(JSON.parse(event.data));
+    notify();
+  });
+
+  source.onerror = () => {
+    // The browser retries on its own; CLOSED means it gave up (e.g. 503 when full)
+    if (source && source.readyState === EventSource.CLOSED) {
+      source = null;
+      status = 'closed';
+      notify();
+    }
+  };
+};
+
+const disconnect = () => {
+  if (source) {
+    source.close();
+    source = null;
+  }
+  status = 'connecting';
+};
+
+// Returns { live, status }: live is the latest state (or null before the first
+// snapshot); status is 'connecting' | 'open' | 'closed' | 'unsupported'.
+// Callers fall back to polling when status is 'closed' or 'unsupported'.
+// Pass enabled=false to stay off the stream (no connection is opened for it).
+const useLiveEvents = (enabled = true) => {
+  const [snapshot, setSnapshot] = useState({ live: state, status });
+
+  useEffect(() => {
+    if (!enabled) return undefined;
+
+    const listener = (live, currentStatus) => setSnapshot({ live, status: currentStatus });
+    listeners.add(listener);
+    connect();
+    listener(state, status);
+
+    return () => {
+      listeners.delete(listener);
+      if (listeners.size === 0) {
+        disconnect();
+      }
+    };
+  }, [enabled]);
+
+  return snapshot;
+};
+
+export default useLiveEvents;
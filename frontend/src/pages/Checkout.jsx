@@ -206,16 +206,8 @@ const Checkout = () => {
         origin_url: window.location.origin
       };
 
-      // Mark promo code as used
-      if (appliedPromo) {
-        await fetch(`${API_URL}/api/promo/use`, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ code: appliedPromo.code, subtotal: cartTotals.total })
-        });
-      }
-
-      // Create Stripe checkout session
+      // Create Stripe checkout session (also redeems the promo code, failing once
+      // the code's usage limit is reached)
       const response = await fetch(`${API_URL}/api/checkout/create-session`, {
         method: 'POST',
         headers: {
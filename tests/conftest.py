@@ -0,0 +1,111 @@
+"""
+Shared fixtures for the backend tests.
+
+Tests run against a scratch database on the MongoDB at MONGO_URL when one is
+reachable, otherwise against mongomock-motor, with the registered indexes built
+(the unique ones matter). Tests that need a real server
+(query plans, transactions) use the `real_db` fixture, which skips without one.
+"""
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'raze_test')
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import server
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def connect_mongo():
+    """A client for the MongoDB at MONGO_URL, or None if it isn't reachable"""
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True, serverSelectionTimeoutMS=500)
+    try:
+        await client.admin.command("ping")
+    except Exception:
+        client.close()
+        return None
+    return client
+
+
+def reset_server_state():
+    """Clear the in-process caches that would leak between tests"""
+    server.inventory_snapshot.update(variants={}, by_product={}, loaded_at=None)
+    server.checkout_status_cache.clear()
+    server.session_cache.clear()
+    server.single_flight_calls.clear()
+    server.shipping_quote_cache.clear()
+    server.promo_index.clear()
+    server.promo_index_misses.clear()
+    server.promo_index_state["loaded_at"] = None
+    server.inventory_transactions_supported = None
+
+
+async def use_database(monkeypatch, client):
+    name = f"raze_test_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", client[name])
+    reset_server_state()
+    return name
+
+
+async def drop_partial_unique_indexes():
+    """mongomock ignores partialFilterExpression, so these would reject documents a
+    real server lets through (e.g. many orders without a stripe_session_id)"""
+    for collection, indexes in server.INDEX_REGISTRY.items():
+        for index in indexes:
+            if index.document.get("unique") and "partialFilterExpression" in index.document:
+                await server.db[collection].drop_index(index.document["name"])
+
+
+@pytest.fixture
+async def db(monkeypatch):
+    client = await connect_mongo()
+    mocked = client is None
+    if mocked:
+        mongomock_motor = pytest.importorskip("mongomock_motor", reason="no MongoDB at MONGO_URL and mongomock-motor not installed")
+        client = mongomock_motor.AsyncMongoMockClient(tz_aware=True)
+    name = await use_database(monkeypatch, client)
+    await server.ensure_indexes()
+    if mocked:
+        await drop_partial_unique_indexes()
+    yield server.db
+    await client.drop_database(name)
+    client.close()
+
+
+@pytest.fixture
+async def real_db(monkeypatch):
+    client = await connect_mongo()
+    if client is None:
+        pytest.skip("no MongoDB reachable at MONGO_URL")
+    name = await use_database(monkeypatch, client)
+    yield server.db
+    await client.drop_database(name)
+    client.close()
+
+
+@pytest.fixture
+async def api(db):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+def admin_headers():
+    token = f"test-{uuid.uuid4().hex}"
+    server.admin_sessions.add(token)
+    yield {"X-Admin-Token": token}
+    server.admin_sessions.discard(token)
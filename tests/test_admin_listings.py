@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class CountingCollection:
+    """Metadata says 100 documents, an exact count says 97 (e.g. after an unclean shutdown)"""
+
+    name = "orders"
+
+    def __init__(self):
+        self.exact_counts = 0
+
+    async def count_documents(self, query):
+        self.exact_counts += 1
+        return 97
+
+    async def estimated_document_count(self):
+        return 100
+
+
+@pytest.fixture(autouse=True)
+def empty_count_cache():
+    server.page_count_cache.clear()
+    yield
+    server.page_count_cache.clear()
+
+
+async def test_cached_count_is_exact_and_reused():
+    collection = CountingCollection()
+
+    assert await server.count_listing(collection, {}, "cached") == 97
+    assert await server.count_listing(collection, {}, "cached") == 97
+    assert collection.exact_counts == 1
+
+
+async def test_estimated_count_only_for_unfiltered_listings():
+    collection = CountingCollection()
+
+    assert await server.count_listing(collection, {}, "estimated") == 100
+    assert await server.count_listing(collection, {"status": "paid"}, "estimated") == 97
+    assert await server.count_listing(collection, {}, "none") is None
+
+
+@pytest.mark.parametrize("legacy_strings", [False, True])
+async def test_cursor_walk_with_equal_timestamps_skips_and_repeats_nothing(db, api, admin_headers, monkeypatch, legacy_strings):
+    monkeypatch.setitem(server.date_storage, "legacy_strings", legacy_strings)
+    start = datetime(2026, 2, 2, 12, tzinfo=timezone.utc)
+    # 11 entries over 3 timestamps, so every page boundary falls inside a run of equal created_at
+    entries = [{"id": f"entry-{n:02d}", "email": f"{n}@example.com", "product_id": 1, "variant": "Black",
+                "access_code": f"RAZE-{n:04d}", "created_at": start + timedelta(minutes=n % 3)} for n in range(11)]
+    await db.waitlist.insert_many([dict(entry) for entry in entries])
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {"limit": 3, "count": "none", **({"cursor": cursor} if cursor else {})}
+        page = (await api.get("/api/admin/waitlist", params=params, headers=admin_headers)).json()
+        seen += [entry["id"] for entry in page["waitlist"]]
+        pages += 1
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    expected = [entry["id"] for entry in sorted(entries, key=lambda entry: (entry["created_at"], entry["id"]), reverse=True)]
+    assert seen == expected
+    assert pages == 4
+
+
+def test_cursor_round_trips_and_rejects_garbage():
+    moment = datetime(2026, 2, 2, 12, 30, tzinfo=timezone.utc)
+    assert server.decode_page_cursor(server.encode_page_cursor(moment, "entry-01")) == (moment, "entry-01")
+    assert server.decode_page_cursor(server.encode_page_cursor(7, "a")) == (7, "a")
+    with pytest.raises(server.HTTPException):
+        server.decode_page_cursor("not-a-cursor")
@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+TEE = {"product_id": 1, "product_name": "Performance T-Shirt", "color": "Black", "size": "M"}
+SHIPPING = {"first_name": "A", "last_name": "B", "email": "a@example.com", "address_line1": "1 Main St",
+            "city": "Austin", "state": "TX", "postal_code": "78701", "country": "US"}
+
+
+async def start_checkout(db, session_id, quantity=2):
+    """What create-session leaves behind: a stock hold, a pending order and a transaction"""
+    items = [{**TEE, "quantity": quantity, "price": 45.0}]
+    await server.acquire_inventory_hold(items, owner=session_id)
+    await db.pending_orders.insert_one({
+        "session_id": session_id, "items": items, "shipping": SHIPPING,
+        "subtotal": 45.0 * quantity, "discount": 0, "shipping_cost": 0, "total": 45.0 * quantity
+    })
+    await db.payment_transactions.insert_one({"session_id": session_id, "status": "pending", "payment_status": "initiated"})
+
+
+async def drain_stripe_events():
+    while event := await server.claim_stripe_event():
+        await server.handle_stripe_event(event)
+
+
+async def stock_level(db):
+    doc = await db.inventory.find_one(server.variant_filter(server.inventory_key(TEE)))
+    return doc["quantity"], doc["reserved"]
+
+
+@pytest.fixture
+async def stocked(db, monkeypatch):
+    monkeypatch.setattr(server, "STRIPE_LOCAL_EVENTS", True)
+    await db.inventory.insert_one({**TEE, "quantity": 10, "reserved": 0, "low_stock_threshold": 5})
+    return db
+
+
+async def test_local_paid_event_creates_one_order_and_commits_stock_once(stocked, api):
+    await start_checkout(stocked, "cs_1")
+    event = {"session_id": "cs_1", "event_id": "evt_1"}
+
+    first = await api.post("/api/webhook/stripe/local", json=event)
+    again = await api.post("/api/webhook/stripe/local", json=event)
+    assert (first.json()["duplicate"], again.json()["duplicate"]) == (False, True)
+    await drain_stripe_events()
+
+    # A second, distinct event for the same session changes nothing
+    await api.post("/api/webhook/stripe/local", json={"session_id": "cs_1", "event_id": "evt_2"})
+    await drain_stripe_events()
+
+    assert await stocked.orders.count_documents({"stripe_session_id": "cs_1"}) == 1
+    assert await stock_level(stocked) == (8, 0)
+    assert await stocked.webhook_outbox.count_documents({"endpoint": "order_confirmation"}) == 1
+    assert await stocked.pending_orders.count_documents({}) == 0
+    assert {event["status"] for event in await stocked.stripe_events.find({}).to_list(None)} == {"done"}
+
+
+async def test_local_events_disabled_by_default(api, monkeypatch):
+    monkeypatch.setattr(server, "STRIPE_LOCAL_EVENTS", False)
+    response = await api.post("/api/webhook/stripe/local", json={"session_id": "cs_1"})
+    assert response.status_code == 404
+
+
+async def test_failed_step_is_resumed_on_retry(stocked, api, monkeypatch):
+    await start_checkout(stocked, "cs_1")
+    send_email = server.send_order_confirmation_email
+
+    async def outbox_down(order):
+        raise RuntimeError("outbox unavailable")
+
+    monkeypatch.setattr(server, "send_order_confirmation_email", outbox_down)
+    await api.post("/api/webhook/stripe/local", json={"session_id": "cs_1", "event_id": "evt_1"})
+    await drain_stripe_events()
+
+    event = await stocked.stripe_events.find_one({"_id": "evt_1"})
+    assert (event["status"], event["attempts"]) == ("pending", 1)
+    order = await stocked.orders.find_one({"stripe_session_id": "cs_1"})
+    assert order["finalized"] is False
+    assert "confirmation_email" not in order["finalization"]
+    assert await stock_level(stocked) == (8, 0)
+
+    monkeypatch.setattr(server, "send_order_confirmation_email", send_email)
+    await stocked.stripe_events.update_one({"_id": "evt_1"}, {"$set": {"next_attempt_at": server.datetime.now(server.timezone.utc)}})
+    await drain_stripe_events()
+
+    assert (await stocked.stripe_events.find_one({"_id": "evt_1"}))["status"] == "done"
+    assert (await stocked.orders.find_one({"stripe_session_id": "cs_1"}))["finalized"] is True
+    assert await stocked.webhook_outbox.count_documents({"endpoint": "order_confirmation"}) == 1
+    assert await stock_level(stocked) == (8, 0)
+    rollup = await stocked.orders_rollup.find({}).to_list(None)
+    assert sum(bucket["orders"] for bucket in rollup) == 1
+
+
+async def test_concurrent_finalizers_create_one_order(stocked):
+    await start_checkout(stocked, "cs_1")
+
+    results = await asyncio.gather(*[server.finalize_checkout_session("cs_1") for _ in range(5)])
+
+    assert len({result["id"] for result in results}) == 1
+    # Whoever didn't win the lease finishes on its next attempt
+    assert (await server.finalize_checkout_session("cs_1"))["finalized"] is True
+    assert await stocked.orders.count_documents({}) == 1
+    assert await stock_level(stocked) == (8, 0)
+    assert await stocked.webhook_outbox.count_documents({"endpoint": "order_confirmation"}) == 1
+
+
+async def test_stripe_clients_per_host_are_bounded(monkeypatch):
+    monkeypatch.setenv("STRIPE_API_KEY", "sk_test")
+    monkeypatch.setattr(server, "stripe_checkout_clients", server.TTLCache(maxsize=32, ttl=3600))
+    for n in range(100):
+        request = server.Request({"type": "http", "scheme": "https", "path": "/", "query_string": b"",
+                                  "headers": [(b"host", f"attacker-{n}.test".encode())]})
+        server.get_stripe_checkout(request)
+
+    assert len(server.stripe_checkout_clients) == 32
+
+
+async def test_event_that_keeps_outliving_its_lease_is_dead_lettered(stocked, api, monkeypatch):
+    monkeypatch.setattr(server, "STRIPE_EVENT_MAX_ATTEMPTS", 2)
+    await api.post("/api/webhook/stripe/local", json={"session_id": "cs_1", "event_id": "evt_1"})
+
+    for attempt in range(1, 3):
+        assert (await server.claim_stripe_event())["_id"] == "evt_1"
+        assert (await stocked.stripe_events.find_one({"_id": "evt_1"}))["attempts"] == attempt
+        past = server.datetime.now(server.timezone.utc) - server.timedelta(seconds=1)
+        await stocked.stripe_events.update_one({"_id": "evt_1"}, {"$set": {"lease_expires_at": past}})
+
+    assert await server.claim_stripe_event() is None
+    assert (await stocked.stripe_events.find_one({"_id": "evt_1"}))["status"] == "dead"
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2026, 2, 2, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+async def legacy_waitlist(db, monkeypatch):
+    """Seven waitlist entries an hour apart, created_at stored as ISO strings like before the migration"""
+    monkeypatch.setitem(server.date_storage, "legacy_strings", True)
+    await db.waitlist.insert_many([
+        {"id": f"entry-{n}", "email": f"{n}@example.com", "product_id": 1, "variant": "Black",
+         "access_code": f"RAZE-{n:04d}", "created_at": (START + timedelta(hours=n)).isoformat()}
+        for n in range(7)
+    ])
+    return db
+
+
+async def ids_in_range(db, **bounds):
+    docs = await db.waitlist.find(server.date_range("created_at", **bounds), {"_id": 0, "id": 1}).to_list(None)
+    return sorted(doc["id"] for doc in docs)
+
+
+async def test_migration_resumes_and_is_idempotent(legacy_waitlist, monkeypatch):
+    db = legacy_waitlist
+    window = {"gte": START + timedelta(hours=2), "lt": START + timedelta(hours=5)}
+    before = await ids_in_range(db, **window)
+    assert before == ["entry-2", "entry-3", "entry-4"]
+
+    # The first run dies after its first batch has been checkpointed
+    collection_type = type(db.waitlist)
+    bulk_write = collection_type.bulk_write
+    calls = []
+
+    async def dies_on_second_batch(collection, operations, **kwargs):
+        calls.append(len(operations))
+        if len(calls) == 2:
+            raise ConnectionError("primary stepped down")
+        return await bulk_write(collection, operations, **kwargs)
+
+    monkeypatch.setattr(collection_type, "bulk_write", dies_on_second_batch)
+    with pytest.raises(ConnectionError):
+        await server.migrate_native_dates(batch_size=3)
+    monkeypatch.setattr(collection_type, "bulk_write", bulk_write)
+    migration = await db.schema_migrations.find_one({"_id": server.MIGRATION_NATIVE_DATES})
+    assert (migration["state"], migration["progress"]["waitlist"]["converted"]) == ("running", 3)
+    assert server.date_storage["legacy_strings"] is True
+
+    migration = await server.migrate_native_dates(batch_size=3)
+    assert (migration["state"], migration["progress"]["waitlist"]["converted"]) == ("completed", 7)
+    assert await server.migrate_native_dates(batch_size=3) == migration
+
+    assert await db.waitlist.count_documents({"created_at": {"$type": "string"}}) == 0
+    doc = await db.waitlist.find_one({"id": "entry-3"})
+    assert doc["created_at"] == START + timedelta(hours=3)
+    assert server.date_storage["legacy_strings"] is False
+    assert "$or" not in server.date_range("created_at", **window)
+    assert await ids_in_range(db, **window) == before
+
+
+async def test_cursor_walk_over_mixed_string_and_date_values(legacy_waitlist, api, admin_headers):
+    db = legacy_waitlist
+    # Half migrated: new entries are dates, older ones still strings
+    await db.waitlist.insert_many([
+        {"id": f"entry-{n}", "email": f"{n}@example.com", "product_id": 1, "variant": "Black",
+         "access_code": f"RAZE-{n:04d}", "created_at": START + timedelta(hours=n)}
+        for n in range(7, 11)
+    ])
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, "count": "none", **({"cursor": cursor} if cursor else {})}
+        page = (await api.get("/api/admin/waitlist", params=params, headers=admin_headers)).json()
+        seen += [entry["id"] for entry in page["waitlist"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    assert seen == [f"entry-{n}" for n in range(10, -1, -1)]
@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+TEE = {"product_id": 1, "product_name": "Performance T-Shirt", "color": "Black", "size": "M"}
+
+
+@pytest.fixture
+async def stocked(db, monkeypatch):
+    monkeypatch.setattr(server, "drop_pools", {})
+    monkeypatch.setattr(server, "drop_lease_locks", {})
+    monkeypatch.setattr(server, "drop_pending_holds", [])
+    monkeypatch.setattr(server, "drop_flush_wakeup", asyncio.Event())
+    await db.inventory.insert_one({**TEE, "quantity": 10, "reserved": 0, "low_stock_threshold": 5})
+    return db
+
+
+async def allocate(quantity):
+    """Start a drop-mode allocation and return once it is waiting for the group commit"""
+    task = asyncio.create_task(server.allocate_drop_hold([{**TEE, "quantity": quantity}], owner="cs_1"))
+    while not server.drop_pending_holds:
+        await asyncio.sleep(0)
+    return task
+
+
+async def worker_goes_stale(db):
+    past = datetime.now(timezone.utc) - timedelta(seconds=server.DROP_MODE_LEASE_STALE_SECONDS + 1)
+    await db.drop_leases.update_many({}, {"$set": {"heartbeat_at": past}})
+
+
+async def reserved(db):
+    return (await db.inventory.find_one({"product_id": 1}))["reserved"]
+
+
+async def test_flush_after_reclaim_is_refused(stocked):
+    task = await allocate(2)
+    await worker_goes_stale(stocked)
+
+    assert await server.reconcile_drop_leases() == {"leases": 1, "units": 10}
+    await server.flush_drop_holds()
+
+    with pytest.raises(HTTPException) as error:
+        await task
+    assert error.value.status_code == 409
+    assert await stocked.inventory_holds.count_documents({}) == 0
+    assert await reserved(stocked) == 0
+
+
+async def test_reclaim_after_flush_keeps_the_held_units(stocked):
+    task = await allocate(2)
+    await server.flush_drop_holds()
+    await task
+    await worker_goes_stale(stocked)
+
+    assert await server.reconcile_drop_leases() == {"leases": 1, "units": 8}
+    assert (await stocked.drop_leases.find_one({}))["allocated"] == 2
+    assert await reserved(stocked) == 2
+
+
+async def test_failed_insert_gives_units_back_to_lease_and_pool(stocked, monkeypatch):
+    task = await allocate(2)
+
+    async def insert_fails(collection, documents, ordered=True):
+        raise ConnectionError("primary stepped down")
+
+    # Collection objects are built per attribute access, so patch their class
+    monkeypatch.setattr(type(stocked.inventory_holds), "insert_many", insert_fails)
+    await server.flush_drop_holds()
+
+    with pytest.raises(HTTPException) as error:
+        await task
+    assert error.value.status_code == 503
+    assert (await stocked.drop_leases.find_one({}))["allocated"] == 0
+    assert server.drop_pools[server.inventory_key(TEE)]["available"] == 10
+
+
+async def test_startup_reclaims_leases_with_drop_mode_off(stocked, monkeypatch):
+    monkeypatch.setattr(server, "DROP_MODE_ENABLED", False)
+    monkeypatch.setattr(server, "DROP_MODE_LEASE_STALE_SECONDS", 0)
+    task = await allocate(2)
+    await server.flush_drop_holds()
+    await task
+
+    await server.reconcile_drop_leases_at_startup()
+
+    assert (await stocked.drop_leases.find_one({}))["state"] == "closed"
+    assert await reserved(stocked) == 2
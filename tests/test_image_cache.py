@@ -0,0 +1,126 @@
+import io
+
+import httpx
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+IMAGE_URL = "https://i.imgur.com/tee.png"
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 1024
+
+
+@pytest.fixture
+def image_cache(tmp_path, monkeypatch):
+    origin = httpx.AsyncClient(transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, content=PNG, headers={"content-type": "image/png"})
+    ))
+    monkeypatch.setattr(server, "get_http_client", lambda name: origin)
+    monkeypatch.setattr(server, "IMAGE_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(server, "image_memory_cache", server.OrderedDict())
+    monkeypatch.setattr(server, "image_disk_index", server.OrderedDict())
+    monkeypatch.setitem(server.image_cache_stats, "disk_bytes", 0)
+    return tmp_path
+
+
+async def get_image(api):
+    server.image_memory_cache.clear()  # Exercise the disk tier
+    return await api.get("/api/proxy-image", params={"url": IMAGE_URL, "format": "original"})
+
+
+async def test_disk_hit_streams_the_cached_file(api, image_cache):
+    assert (await get_image(api)).headers["X-Cache"] == "MISS"
+
+    response = await get_image(api)
+
+    assert response.headers["X-Cache"] == "HIT-DISK"
+    assert response.content == PNG
+    assert response.headers["Content-Length"] == str(len(PNG))
+
+
+async def test_missing_file_falls_back_to_origin(api, image_cache):
+    await get_image(api)
+    for path in image_cache.iterdir():
+        path.unlink()
+
+    response = await get_image(api)
+
+    assert (response.status_code, response.headers["X-Cache"], response.content) == (200, "MISS", PNG)
+    assert len(server.image_disk_index) == 1
+    assert server.image_cache_stats["disk_bytes"] == len(PNG)
+
+
+async def test_eviction_updates_the_index_before_touching_files(image_cache, monkeypatch):
+    for name in ("old", "new"):
+        path = image_cache / f"{name}.png"
+        path.write_bytes(PNG)
+        server.image_disk_index[name] = {"path": path, "size": len(PNG), "content_type": "image/png", "etag": name}
+        server.image_cache_stats["disk_bytes"] += len(PNG)
+    monkeypatch.setattr(server, "IMAGE_CACHE_DISK_BYTES", len(PNG))
+
+    evicted = server.evict_disk_images()
+
+    assert evicted == [image_cache / "old.png"]
+    assert list(server.image_disk_index) == ["new"]
+    assert server.image_cache_stats["disk_bytes"] == len(PNG)
+    server.unlink_image_files(evicted)
+    assert sorted(path.name for path in image_cache.iterdir()) == ["new.png"]
+
+
+@pytest.fixture
+def photo(image_cache, monkeypatch):
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.new("RGB", (800, 400), (200, 30, 30)).save(out, format="PNG")
+    origin = httpx.AsyncClient(transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, content=out.getvalue(), headers={"content-type": "image/png"})
+    ))
+    monkeypatch.setattr(server, "get_http_client", lambda name: origin)
+    return out.getvalue()
+
+
+def dimensions(content):
+    from PIL import Image
+
+    with Image.open(io.BytesIO(content)) as img:
+        return img.format, img.size
+
+
+async def test_webp_resize_is_transcoded_once_then_cached(api, photo):
+    params = {"url": IMAGE_URL, "format": "webp", "w": 200}
+
+    first = await api.get("/api/proxy-image", params=params)
+    again = await api.get("/api/proxy-image", params=params)
+
+    assert (first.headers["content-type"], first.headers["X-Cache"]) == ("image/webp", "MISS")
+    assert dimensions(first.content) == ("WEBP", (200, 100))
+    assert (again.headers["X-Cache"], again.content) == ("HIT-MEMORY", first.content)
+    server.image_memory_cache.clear()
+    from_disk = await api.get("/api/proxy-image", params=params)
+    assert (from_disk.headers["X-Cache"], from_disk.headers["content-type"]) == ("HIT-DISK", "image/webp")
+
+
+@pytest.mark.parametrize("accept, content_type, image_format", [
+    ("image/avif,image/webp,*/*", "image/avif", "AVIF"),
+    ("image/webp,*/*", "image/webp", "WEBP"),
+    ("*/*", "image/png", "PNG"),
+])
+async def test_auto_format_follows_accept(api, photo, accept, content_type, image_format):
+    if image_format == "AVIF" and not server.IMAGE_AVIF_SUPPORTED:
+        pytest.skip("this Pillow build can't encode AVIF")
+    response = await api.get("/api/proxy-image", params={"url": IMAGE_URL, "w": 100}, headers={"Accept": accept})
+
+    assert response.headers["content-type"] == content_type
+    assert response.headers["Vary"] == "Accept"
+    assert dimensions(response.content) == (image_format, (100, 50))
+
+
+async def test_quality_is_part_of_the_cache_key(api, photo):
+    low, high = [
+        await api.get("/api/proxy-image", params={"url": IMAGE_URL, "format": "webp", "q": q}) for q in (30, 95)
+    ]
+
+    assert (low.headers["X-Cache"], high.headers["X-Cache"]) == ("MISS", "MISS")
+    assert low.content != high.content
@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_registered_indexes_build(real_db):
+    assert await server.ensure_indexes() == {}
+
+
+async def test_hot_queries_use_indexes(real_db):
+    await server.ensure_indexes()
+
+    collscans = [result["name"] for result in await server.verify_hot_query_plans() if result["collscan"]]
+    assert collscans == []
+
+
+async def test_verify_endpoint_fails_on_collscan(real_db, admin_headers):
+    # Collections with data but no indexes: every hot query scans
+    for collection in {query["collection"] for query in server.HOT_QUERIES}:
+        await real_db[collection].insert_one({"seed": True})
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as api:
+        response = await api.get("/api/admin/indexes/verify", headers=admin_headers)
+        assert response.status_code == 503
+        assert "order_by_stripe_session" in response.json()["collscans"]
+
+        await server.ensure_indexes()
+        response = await api.get("/api/admin/indexes/verify", headers=admin_headers)
+        assert response.status_code == 200
+        assert response.json()["success"] is True
+
+
+async def test_verify_endpoint_status_follows_plans(api, admin_headers, monkeypatch):
+    plans = [{"name": "order_by_id", "collection": "orders", "stages": ["COLLSCAN"], "collscan": True}]
+
+    async def fake_plans():
+        return plans
+
+    monkeypatch.setattr(server, "verify_hot_query_plans", fake_plans)
+    response = await api.get("/api/admin/indexes/verify", headers=admin_headers)
+    assert (response.status_code, response.json()["collscans"]) == (503, ["order_by_id"])
+
+    plans[0].update(stages=["FETCH", "IXSCAN"], collscan=False)
+    response = await api.get("/api/admin/indexes/verify", headers=admin_headers)
+    assert (response.status_code, response.json()["success"]) == (200, True)
+
+
+async def insert_order(db, order_id, session_id, minute):
+    await db.orders.insert_one({
+        "id": order_id, "order_number": f"RAZE-{order_id}", "stripe_session_id": session_id, "status": "confirmed",
+        "total": 45.0, "items": [{"quantity": 1}], "created_at": datetime(2026, 1, 1, 12, minute, tzinfo=timezone.utc)
+    })
+
+
+async def test_dedupe_keeps_earliest_order_per_session(db):
+    if "stripe_session_id_unique" in await db.orders.index_information():
+        await db.orders.drop_index("stripe_session_id_unique")  # As before the unique index existed
+    await insert_order(db, "b", "cs_1", 2)
+    await insert_order(db, "a", "cs_1", 1)
+    await insert_order(db, "c", "cs_1", 3)
+    await insert_order(db, "d", "cs_2", 1)
+
+    assert await server.dedupe_stripe_session_orders() == 2
+    assert sorted(order["id"] for order in await db.orders.find({}).to_list(None)) == ["a", "d"]
+    archived = await db.orders_duplicates.find({}).to_list(None)
+    assert sorted(order["id"] for order in archived) == ["b", "c"]
+    assert {order["duplicate_of"] for order in archived} == {"a"}
+    assert sum(bucket["orders"] for bucket in await db.orders_rollup.find({}).to_list(None)) == 2
+
+    assert await server.dedupe_stripe_session_orders() == 0
+
+
+async def test_unique_session_index_replaces_old_index_despite_duplicates(real_db):
+    await real_db.orders.create_index("stripe_session_id", name="stripe_session_id")
+    await insert_order(real_db, "a", "cs_1", 1)
+    await insert_order(real_db, "b", "cs_1", 2)
+
+    assert await server.ensure_indexes() == {}
+    indexes = await real_db.orders.index_information()
+    assert indexes["stripe_session_id_unique"]["unique"] is True
+    assert "stripe_session_id" not in indexes
+    assert await real_db.orders.count_documents({"stripe_session_id": "cs_1"}) == 1
+
+
+async def test_retired_index_kept_when_replacement_fails(real_db, monkeypatch):
+    await real_db.orders.create_index("stripe_session_id", name="stripe_session_id")
+    await insert_order(real_db, "a", "cs_1", 1)
+    await insert_order(real_db, "b", "cs_1", 2)
+    monkeypatch.setitem(server.INDEX_PREREQUISITES, ("orders", "stripe_session_id_unique"), lambda: asyncio.sleep(0))
+
+    failures = await server.ensure_indexes()
+    assert server.unique_index_failures(failures) == ["orders.stripe_session_id_unique"]
+    assert "stripe_session_id" in await real_db.orders.index_information()
+
+
+async def test_retired_index_dropped_after_replacement_exists(db):
+    await db.orders.create_index("stripe_session_id", name="stripe_session_id")
+
+    assert await server.ensure_indexes() == {}
+    indexes = await db.orders.index_information()
+    assert "stripe_session_id_unique" in indexes
+    assert "stripe_session_id" not in indexes
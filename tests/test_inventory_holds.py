@@ -0,0 +1,134 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+TEE = {"product_id": 1, "product_name": "Performance T-Shirt", "color": "Black", "size": "M"}
+HOODIE = {"product_id": 5, "product_name": "Hoodie", "color": "Grey", "size": "XL"}  # No inventory document
+
+
+async def stock(db, item=TEE, quantity=5, reserved=0):
+    await db.inventory.insert_one({**item, "quantity": quantity, "reserved": reserved, "low_stock_threshold": 5})
+
+
+async def variant(db, item=TEE):
+    return await db.inventory.find_one(server.variant_filter(server.inventory_key(item)), {"_id": 0})
+
+
+async def test_hold_reserves_then_commit_deducts(db):
+    await stock(db)
+    hold = await server.acquire_inventory_hold([{**TEE, "quantity": 2}], owner="cs_1")
+    assert (await variant(db))["reserved"] == 2
+
+    committed = await server.commit_inventory_hold({"owner": "cs_1"}, hold["items"])
+    assert committed["hold"]["id"] == hold["id"]
+    assert committed["oversold"] == []
+    doc = await variant(db)
+    assert (doc["quantity"], doc["reserved"]) == (3, 0)
+    assert (await db.inventory_holds.find_one({"id": hold["id"]}))["state"] == "committed"
+
+
+async def test_release_returns_units_once(db):
+    await stock(db)
+    hold = await server.acquire_inventory_hold([{**TEE, "quantity": 3}], owner="cs_1")
+
+    assert await server.release_inventory_hold({"id": hold["id"]})
+    assert await server.release_inventory_hold({"id": hold["id"]}) is None
+    doc = await variant(db)
+    assert (doc["quantity"], doc["reserved"]) == (5, 0)
+
+
+async def test_insufficient_stock_reserves_nothing(db):
+    await stock(db, quantity=5)
+    await stock(db, {**TEE, "size": "L"}, quantity=1)
+
+    with pytest.raises(HTTPException) as error:
+        await server.acquire_inventory_hold([{**TEE, "quantity": 2}, {**TEE, "size": "L", "quantity": 2}])
+    assert error.value.status_code == 400
+    assert (await variant(db))["reserved"] == 0
+    assert (await variant(db, {**TEE, "size": "L"}))["reserved"] == 0
+
+
+async def test_variant_without_inventory_is_untracked(db):
+    await stock(db)
+    hold = await server.acquire_inventory_hold([{**TEE, "quantity": 1}, {**HOODIE, "quantity": 2}], owner="cs_1")
+
+    stored = await db.inventory_holds.find_one({"id": hold["id"]})
+    assert [line.get("untracked", False) for line in stored["items"]] == [False, True]
+    assert (await variant(db))["reserved"] == 1
+
+    await server.commit_inventory_hold({"owner": "cs_1"}, hold["items"])
+    assert await variant(db, HOODIE) is None
+    assert (await variant(db))["quantity"] == 4
+
+
+async def test_commit_without_hold_never_oversells(db):
+    await stock(db, quantity=3, reserved=2)  # Two units held by another checkout
+
+    result = await server.commit_inventory_hold({"owner": "cs_expired"}, [{**TEE, "quantity": 2}])
+    assert result["hold"] is None
+    assert [line["quantity"] for line in result["oversold"]] == [2]
+    doc = await variant(db)
+    assert (doc["quantity"], doc["reserved"]) == (3, 2)
+
+    result = await server.commit_inventory_hold({"owner": "cs_expired"}, [{**TEE, "quantity": 1}])
+    assert result["oversold"] == []
+    assert (await variant(db))["quantity"] == 2
+
+
+async def test_late_payment_after_stock_is_gone_flags_order(db):
+    await stock(db, quantity=1)
+    await db.pending_orders.insert_one({
+        "session_id": "cs_late",
+        "items": [{**TEE, "quantity": 1, "price": 45.0}],
+        "shipping": {"first_name": "A", "last_name": "B", "email": "a@example.com", "address_line1": "1 Main St",
+                     "city": "Austin", "state": "TX", "postal_code": "78701", "country": "US"},
+        "subtotal": 45.0, "discount": 0, "shipping_cost": 0, "total": 45.0
+    })
+    await server.acquire_inventory_hold([{**TEE, "quantity": 1}], owner="cs_other")
+
+    await server.finalize_checkout_session("cs_late")
+
+    order = await db.orders.find_one({"stripe_session_id": "cs_late"})
+    assert order["needs_review"] is True
+    assert (await variant(db))["quantity"] == 1
+
+
+class FailingInventory:
+    async def bulk_write(self, operations, ordered=True, session=None):
+        raise BulkWriteError({"writeErrors": [{"index": 0, "errmsg": "Cannot apply $inc to a value of non-numeric type"}],
+                              "nMatched": 0, "nModified": 0, "nUpserted": 0, "upserted": []})
+
+
+async def test_bulk_write_errors_abort_transactions(monkeypatch):
+    monkeypatch.setattr(server, "db", SimpleNamespace(inventory=FailingInventory()))
+    monkeypatch.setattr(server, "refresh_inventory_variants", lambda keys: asyncio.sleep(0))
+    update = [(server.inventory_key(TEE), {"$inc": {"reserved": -1}})]
+
+    # Outside a transaction the caller gets a per-item report
+    report = await server.bulk_update_variants(update, lookup=False)
+    assert report["results"][0]["status"] == "error"
+
+    # Inside one, the error propagates so the transaction aborts
+    with pytest.raises(BulkWriteError):
+        await server.bulk_update_variants(update, lookup=False, session=object())
+
+    # Hold callers can't act on a partial report, so they get the error without one as well
+    with pytest.raises(BulkWriteError):
+        await server.bulk_update_variants(update, lookup=False, raise_on_error=True)
+
+
+async def test_partial_release_without_transaction_raises(db, monkeypatch):
+    await stock(db)
+    hold = await server.acquire_inventory_hold([{**TEE, "quantity": 2}], owner="cs_1")
+
+    # Collection objects are built per attribute access, so patch their class
+    monkeypatch.setattr(type(db.inventory), "bulk_write", FailingInventory.bulk_write)
+    with pytest.raises(BulkWriteError):
+        await server.release_inventory_hold({"id": hold["id"]})
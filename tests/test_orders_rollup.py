@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+TEE = {"product_id": 1, "product_name": "Performance T-Shirt", "color": "Black", "size": "M", "price": 45.0}
+SHIPPING = {"first_name": "A", "last_name": "B", "email": "a@example.com", "address_line1": "1 Main St",
+            "city": "Austin", "state": "TX", "postal_code": "78701", "country": "US"}
+
+
+async def place_order(api, quantity=2):
+    response = await api.post("/api/orders", json={
+        "items": [{**TEE, "quantity": quantity}], "shipping": SHIPPING,
+        "subtotal": 45.0 * quantity, "total": 45.0 * quantity
+    })
+    return response.json()["order"]
+
+
+async def buckets(db):
+    return {bucket["status"]: (bucket["orders"], bucket["revenue"], bucket["item_units"])
+            for bucket in await db.orders_rollup.find({}).to_list(None) if bucket["orders"]}
+
+
+async def test_order_writes_move_buckets(db, api, monkeypatch):
+    order = await place_order(api)
+    assert await buckets(db) == {"pending": (1, 90.0, 2)}
+
+    await api.patch(f"/api/orders/{order['id']}", json={"status": "confirmed"})
+    await api.patch(f"/api/orders/{order['id']}", json={"notes": "gift wrap"})  # No transition
+    assert await buckets(db) == {"confirmed": (1, 90.0, 2)}
+
+    monkeypatch.setattr(server, "shippo_client", server.FakeShippo(latency=0))
+    await api.post("/api/shipping/label", json={"rate_id": "fake_rate_0", "order_id": order["id"]})
+    assert await buckets(db) == {"processing": (1, 90.0, 2)}
+
+    await api.patch(f"/api/orders/{order['id']}", json={"status": "cancelled"})
+    stats = (await api.get("/api/orders/stats")).json()
+    assert (stats["total_orders"], stats["cancelled"], stats["total_revenue"]) == (1, 1, 0)
+
+
+async def test_stats_series_covers_the_last_n_days(db, api):
+    await place_order(api)
+    await place_order(api, quantity=1)
+    old = await place_order(api)
+    # Reassign one order to a week ago, then let the rebuild re-bucket it
+    await db.orders.update_one({"id": old["id"]}, {"$set": {"created_at": datetime.now(timezone.utc) - timedelta(days=7)}})
+    await server.rebuild_orders_rollup()
+
+    stats = (await api.get("/api/orders/stats", params={"days": 3})).json()
+
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    assert [(day["day"], day["orders"], day["item_units"]) for day in stats["series"]] == [(today, 2, 3)]
+    assert stats["total_orders"] == 3
+    assert len((await api.get("/api/orders/stats", params={"days": 8})).json()["series"]) == 2
+
+
+async def test_concurrent_rebuilds_converge(db, api):
+    for _ in range(3):
+        await place_order(api)
+    await db.orders_rollup.insert_one({"_id": "2000-01-01|pending", "day": "2000-01-01", "status": "pending",
+                                       "orders": 5, "revenue": 0.0, "item_units": 0})
+
+    await asyncio.gather(*(server.rebuild_orders_rollup() for _ in range(3)))
+
+    assert await buckets(db) == {"pending": (3, 270.0, 6)}
+
+
+async def test_backfill_runs_once(db, api):
+    await place_order(api)
+    await db.orders_rollup.delete_many({})
+
+    assert await asyncio.gather(server.backfill_orders_rollup(), server.backfill_orders_rollup()) in ([True, False], [False, True])
+    assert await buckets(db) == {"pending": (1, 90.0, 2)}
+    assert (await db.schema_migrations.find_one({"_id": server.ORDERS_ROLLUP_BACKFILL}))["state"] == "completed"
+
+    await db.orders_rollup.delete_many({})
+    assert await server.backfill_orders_rollup() is False
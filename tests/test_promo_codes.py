@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+TEE = {"product_id": 1, "product_name": "Performance T-Shirt", "color": "Black", "size": "M", "price": 45.0}
+SHIPPING = {"first_name": "A", "last_name": "B", "email": "a@example.com", "address_line1": "1 Main St",
+            "city": "Austin", "state": "TX", "postal_code": "78701", "country": "US"}
+
+
+class FakeStripe:
+    def __init__(self, error=None):
+        self.error = error
+
+    async def create_checkout_session(self, checkout_request):
+        if self.error:
+            raise self.error
+        return server.CheckoutSessionResponse(url="https://checkout.stripe.test/cs_1", session_id="cs_1")
+
+
+@pytest.fixture
+async def promo(db):
+    await db.promo_codes.insert_one({"code": "DROP10", "discount_type": "percentage", "discount_value": 10,
+                                     "min_order": 0, "max_uses": 5, "uses": 0, "active": True})
+    await db.inventory.insert_one({**TEE, "quantity": 3, "reserved": 0, "low_stock_threshold": 1})
+    return db
+
+
+def checkout(quantity=1):
+    return {"items": [{**TEE, "quantity": quantity}], "shipping": SHIPPING, "subtotal": 45.0 * quantity,
+            "discount": 4.5, "promo_code": "drop10", "total": 40.5 * quantity, "origin_url": "https://raze.test"}
+
+
+async def uses(db):
+    return (await db.promo_codes.find_one({"code": "DROP10"}))["uses"]
+
+
+async def test_checkout_redeems_promo_for_the_session(promo, api, monkeypatch):
+    monkeypatch.setattr(server, "get_stripe_checkout", lambda request: FakeStripe())
+
+    response = await api.post("/api/checkout/create-session", json=checkout())
+
+    assert response.json()["session_id"] == "cs_1"
+    assert await uses(promo) == 1
+    redemption = await promo.promo_redemptions.find_one({})
+    assert (redemption["code"], redemption["reference"]) == ("DROP10", "cs_1")
+
+
+async def test_sold_out_checkout_keeps_the_promo_use(promo, api, monkeypatch):
+    monkeypatch.setattr(server, "get_stripe_checkout", lambda request: FakeStripe())
+
+    response = await api.post("/api/checkout/create-session", json=checkout(quantity=4))
+
+    assert response.status_code == 400
+    assert await uses(promo) == 0
+    assert await promo.promo_redemptions.count_documents({}) == 0
+
+
+async def test_stripe_failure_gives_the_promo_use_back(promo, api, monkeypatch):
+    monkeypatch.setattr(server, "get_stripe_checkout", lambda request: FakeStripe(RuntimeError("stripe down")))
+
+    response = await api.post("/api/checkout/create-session", json=checkout())
+
+    assert response.status_code == 500
+    assert await uses(promo) == 0
+    assert await promo.promo_redemptions.count_documents({}) == 0
+    assert (await promo.inventory.find_one({}))["reserved"] == 0
+
+
+async def test_exhausted_promo_releases_the_hold(promo, api, monkeypatch):
+    monkeypatch.setattr(server, "get_stripe_checkout", lambda request: FakeStripe())
+    await promo.promo_codes.update_one({"code": "DROP10"}, {"$set": {"uses": 5}})
+
+    response = await api.post("/api/checkout/create-session", json=checkout())
+
+    assert response.status_code == 400
+    assert (await promo.inventory.find_one({}))["reserved"] == 0
+
+
+@pytest.mark.parametrize("shards", [0, 4])
+async def test_code_capped_at_zero_is_refused(db, shards):
+    await db.promo_codes.insert_one({"code": "NONE", "discount_type": "percentage", "discount_value": 10,
+                                     "max_uses": 0, "uses": 0, "active": True})
+    if shards:
+        await server.shard_promo_usage("NONE", shards)
+
+    with pytest.raises(server.HTTPException) as error:
+        await server.redeem_promo_code("NONE")
+    assert error.value.status_code == 400
+    assert await db.promo_usage_shards.count_documents({"cap": {"$ne": 0}}) == 0
+
+
+def test_split_promo_caps_sum_to_remaining():
+    assert server.split_promo_caps(10, 4) == [3, 3, 2, 2]
+    assert server.split_promo_caps(2, 4) == [1, 1, 0, 0]
+    assert server.split_promo_caps(-3, 2) == [0, 0]
+    assert server.split_promo_caps(None, 3) == [None, None, None]
+
+
+@pytest.mark.parametrize("shards", [0, 8])
+async def test_limit_holds_exactly_under_concurrency(db, api, admin_headers, shards):
+    max_uses = 7
+    await db.promo_codes.insert_one({"code": "HOT", "discount_type": "percentage", "discount_value": 10,
+                                     "max_uses": max_uses, "uses": 0, "active": True})
+    if shards:
+        await server.shard_promo_usage("HOT", shards)
+
+    responses = await asyncio.gather(*(
+        api.post("/api/promo/use", json={"code": "hot", "email": f"buyer{n}@example.com"}) for n in range(20)
+    ))
+
+    statuses = [response.status_code for response in responses]
+    assert (statuses.count(200), statuses.count(400)) == (max_uses, 20 - max_uses)
+    await server.rollup_promo_usage()
+    assert (await db.promo_codes.find_one({"code": "HOT"}))["uses"] == max_uses
+    assert await db.promo_redemptions.count_documents({"code": "HOT"}) == max_uses
+
+    listing = (await api.get("/api/promo/HOT/redemptions", params={"limit": 5}, headers=admin_headers)).json()
+    assert (listing["uses"], listing["max_uses"], listing["total"]) == (max_uses, max_uses, max_uses)
+    assert len(listing["redemptions"]) == 5 and listing["next_cursor"]
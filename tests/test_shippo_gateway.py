@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+ADDRESS = {"first_name": "A", "last_name": "B", "email": "a@example.com", "address_line1": "1 Main St",
+           "city": "Austin", "state": "TX", "postal_code": "78701", "country": "US"}
+
+
+@pytest.fixture
+def fake_shippo(monkeypatch):
+    fake = server.FakeShippo(latency=0.01)
+    monkeypatch.setattr(server, "shippo_client", fake)
+    return fake
+
+
+def quote(street="1 Main St"):
+    return {"address_to": {**ADDRESS, "address_line1": street}}
+
+
+async def test_pool_has_a_thread_for_every_slot():
+    assert server.shippo_executor._max_workers >= sum(server.SHIPPO_CONCURRENCY.values())
+
+
+async def test_rates_labels_and_tracking_through_fake(api, fake_shippo):
+    response = await api.post("/api/shipping/rates", json=quote())
+    rates = response.json()["rates"]
+    assert [rate["amount"] for rate in rates] == sorted(rate["amount"] for rate in rates)
+
+    response = await api.post("/api/shipping/label", json={"rate_id": rates[0]["object_id"], "order_id": "o1"})
+    assert response.json()["success"] is True
+
+    response = await api.get("/api/shipping/tracking/usps/FAKE123")
+    assert response.json()["status"] == "TRANSIT"
+
+
+async def test_not_configured_is_503(api, monkeypatch):
+    monkeypatch.setattr(server, "shippo_client", None)
+    response = await api.post("/api/shipping/rates", json=quote())
+    assert response.status_code == 503
+    assert response.json()["error"] == "not_configured"
+
+
+async def test_busy_is_503_with_retry_after(api, fake_shippo, monkeypatch):
+    fake_shippo.latency = 0.3
+    monkeypatch.setitem(server.shippo_slots, "rates", asyncio.Semaphore(1))
+    monkeypatch.setattr(server, "SHIPPO_QUEUE_TIMEOUT_SECONDS", 0.05)
+
+    first, second = await asyncio.gather(
+        api.post("/api/shipping/rates", json=quote("1 Main St")),
+        api.post("/api/shipping/rates", json=quote("2 Main St"))
+    )
+
+    assert sorted([first.status_code, second.status_code]) == [200, 503]
+    busy = first if first.status_code == 503 else second
+    assert (busy.json()["error"], busy.headers["Retry-After"]) == ("busy", "5")
+
+
+async def test_timeout_is_504_and_warns_about_label_purchase(api, fake_shippo, monkeypatch):
+    fake_shippo.latency = 0.3
+    monkeypatch.setattr(server, "SHIPPO_TIMEOUT_SECONDS", 0.05)
+
+    response = await api.post("/api/shipping/label", json={"rate_id": "fake_rate_0", "order_id": "o1"})
+
+    assert response.status_code == 504
+    body = response.json()
+    assert (body["error"], body["operation"]) == ("timeout", "label")
+    assert "may still have been purchased" in body["message"]
+
+
+async def test_carrier_error_is_502(api, fake_shippo, monkeypatch):
+    def carrier_down(carrier, tracking_number):
+        raise ConnectionError("carrier down")
+
+    monkeypatch.setattr(fake_shippo.track, "get_status", carrier_down)
+    response = await api.get("/api/shipping/tracking/usps/FAKE123")
+
+    assert response.status_code == 502
+    assert response.json() == {"success": False, "error": "carrier_error", "operation": "tracking", "message": "carrier down"}
@@ -0,0 +1,48 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+JOIN = {"email": "a@example.com", "product_id": 1, "product_name": "Performance T-Shirt",
+        "variant": "Black", "size": "M x2"}
+
+
+async def spots_taken(db):
+    return (await db.counters.find_one({"_id": server.WAITLIST_COUNTER_ID}))["taken"]
+
+
+async def test_losing_a_join_race_merges_into_the_winner(api, db, monkeypatch):
+    claim = server.claim_waitlist_slot
+
+    async def rival_joins_first():
+        # The same person's other tab inserts between our lookup and our insert
+        position = await claim()
+        await db.waitlist.insert_one({"id": "rival", "email": "a@example.com", "product_id": 1, "variant": "Black",
+                                      "size": "L x1", "sizes": {"L": 1}, "access_code": "RAZE-RIVAL", "position": position})
+        return await claim()
+
+    monkeypatch.setattr(server, "claim_waitlist_slot", rival_joins_first)
+    response = await api.post("/api/waitlist/join", json={**JOIN, "force_add": True})
+
+    body = response.json()
+    assert (body["access_code"], body["is_update"]) == ("RAZE-RIVAL", True)
+    assert (await db.waitlist.find_one({"id": "rival"}))["sizes"] == {"L": 1, "M": 2}
+    assert await db.waitlist.count_documents({}) == 1
+    assert await spots_taken(db) == 1
+
+
+async def test_access_code_collisions_are_retried_then_give_up(api, db, monkeypatch):
+    await db.waitlist.insert_one({"id": "other", "email": "b@example.com", "product_id": 1, "variant": "Black",
+                                  "access_code": "RAZE-TAKEN", "position": 1})
+    codes = iter(["taken", "taken", "fresh"])
+    monkeypatch.setattr(server.secrets, "token_hex", lambda n: next(codes))
+
+    response = await api.post("/api/waitlist/join", json=JOIN)
+    assert response.json()["access_code"] == "RAZE-FRESH"
+
+    monkeypatch.setattr(server.secrets, "token_hex", lambda n: "taken")
+    response = await api.post("/api/waitlist/join", json={**JOIN, "email": "c@example.com"})
+    assert response.status_code == 500
+    assert await db.waitlist.count_documents({"email": "c@example.com"}) == 0
+    assert await spots_taken(db) == 2
@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeN8n:
+    """Stands in for the pooled n8n client; each post() pops the next outcome"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.posts = []
+
+    async def post(self, url, json=None, headers=None):
+        self.posts.append((url, json))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return httpx.Response(outcome)
+
+
+@pytest.fixture
+def n8n(monkeypatch):
+    fake = FakeN8n()
+    monkeypatch.setattr(server, "get_http_client", lambda name: fake)
+    return fake
+
+
+async def deliver_next():
+    entries = await server.claim_outbox_entries()
+    assert entries
+    await server.deliver_outbox_entries(entries)
+    return entries
+
+
+async def entry(db):
+    return await db.webhook_outbox.find_one({}, {"_id": 0})
+
+
+async def test_delivered_on_success(db, n8n):
+    n8n.outcomes = [200]
+    await server.enqueue_webhook("signup", "https://n8n.test/signup", {"email": "a@example.com"})
+
+    await deliver_next()
+
+    stored = await entry(db)
+    assert (stored["status"], stored["attempts_at_delivery"]) == ("delivered", 1)
+    assert n8n.posts == [("https://n8n.test/signup", {"email": "a@example.com"})]
+
+
+@pytest.mark.parametrize("outcome", [503, httpx.ConnectError("refused"), httpx.InvalidURL("bad url"), KeyError("email")])
+async def test_failure_backs_off_instead_of_staying_in_flight(db, n8n, outcome):
+    n8n.outcomes = [outcome]
+    await server.enqueue_webhook("signup", "https://n8n.test/signup", {"email": "a@example.com"})
+
+    await deliver_next()
+
+    stored = await entry(db)
+    assert (stored["status"], stored["attempts"]) == ("pending", 1)
+    assert "lease_expires_at" not in stored
+    assert stored["next_attempt_at"] > datetime.now(timezone.utc)
+    assert await server.claim_outbox_entries() == []  # Not due until the backoff passes
+
+
+async def test_dead_lettered_after_max_attempts(db, n8n, monkeypatch):
+    monkeypatch.setattr(server, "WEBHOOK_OUTBOX_MAX_ATTEMPTS", 3)
+    n8n.outcomes = [ValueError("not serializable")] * 3
+    await server.enqueue_webhook("signup", "https://n8n.test/signup", {"email": "a@example.com"})
+
+    for _ in range(3):
+        await deliver_next()
+        await db.webhook_outbox.update_many({"status": "pending"}, {"$set": {"next_attempt_at": datetime.now(timezone.utc)}})
+
+    stored = await entry(db)
+    assert (stored["status"], stored["attempts"]) == ("dead", 3)
+    assert stored["last_error"] == "ValueError: not serializable"
+
+
+async def test_lease_blocks_reclaim_until_it_expires(db):
+    await server.enqueue_webhook("signup", "https://n8n.test/signup", {"email": "a@example.com"})
+
+    assert len(await server.claim_outbox_entries()) == 1
+    assert await server.claim_outbox_entries() == []
+
+    # The worker holding it died: once the lease lapses another worker takes over
+    await db.webhook_outbox.update_one({}, {"$set": {"lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    reclaimed = await server.claim_outbox_entries()
+    assert len(reclaimed) == 1
+    assert (await entry(db))["status"] == "in_flight"
+
+
+async def test_entry_id_makes_enqueue_idempotent(db):
+    for _ in range(2):
+        await server.enqueue_webhook("order_confirmation", "https://n8n.test/order", {"n": 1}, entry_id="order_confirmation:o1")
+
+    assert await db.webhook_outbox.count_documents({}) == 1
+
+
+async def test_entry_that_keeps_outliving_its_lease_is_dead_lettered(db, monkeypatch):
+    monkeypatch.setattr(server, "WEBHOOK_OUTBOX_MAX_ATTEMPTS", 3)
+    await server.enqueue_webhook("signup", "https://n8n.test/signup", {"email": "a@example.com"})
+
+    for attempt in range(1, 4):
+        assert len(await server.claim_outbox_entries()) == 1
+        assert (await entry(db))["attempts"] == attempt
+        # The worker hangs or dies mid-delivery every time
+        await db.webhook_outbox.update_one({}, {"$set": {"lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+
+    assert await server.claim_outbox_entries() == []
+    stored = await entry(db)
+    assert (stored["status"], stored["attempts"]) == ("dead", 3)
+    assert "lease_expires_at" not in stored